@@ -0,0 +1,407 @@
+'''
+Confined Timeout
+Micro-benchmarks of the hot paths
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+The extension is loaded from its directory with the in-memory storage and driven with stub contexts.
+Every benchmark runs against synthetic guilds of increasing size, and the JSON report holds
+the timings and the growth exponent of each benchmark over the sizes (0 is constant time, 1 is linear).
+
+    python benchmark/bench.py [--sizes 100,1000,10000] [--repeat 200] [--output report.json] [--baseline old.json]
+
+With a baseline report the benchmarks whose exponent grew by more than the tolerance are listed and the exit code is 1.
+'''
+import argparse
+import asyncio
+import contextlib
+import datetime
+import importlib
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+from typing import Any, Awaitable, Callable, Optional
+
+PACKAGE_NAME: str = "confined_timeout_bench"
+GUILD_ID: int = 1000
+
+def load_package(path: str) -> types.ModuleType:
+    '''Import the extension from its directory without installing it'''
+    package: types.ModuleType = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [path]
+    sys.modules[PACKAGE_NAME] = package
+    return importlib.import_module(f"{PACKAGE_NAME}.main")
+
+################ Stubs ################
+
+class StubRole:
+    def __init__(self, id: int) -> None:
+        self.id: int = id
+        self.name: str = f"role{id}"
+        self.mention: str = f"<@&{id}>"
+        self.members: list = []
+
+class StubMember:
+    def __init__(self, id: int, role_ids: list[int]) -> None:
+        self.id: int = id
+        self._role_ids: list[int] = role_ids
+        self.display_name: str = f"user{id}"
+        self.username: str = f"name{id}"
+        self.mention: str = f"<@{id}>"
+        self.bot: bool = False
+
+class StubChannel:
+    def __init__(self, id: int) -> None:
+        self.id: int = id
+        self.name: str = f"channel{id}"
+        self.mention: str = f"<#{id}>"
+        self.permission_overwrites: list = []
+
+    async def edit_permission(self, *args, **kwargs) -> None:
+        pass
+
+    async def edit(self, *args, **kwargs) -> None:
+        pass
+
+    async def delete_permission(self, *args, **kwargs) -> None:
+        pass
+
+    async def send(self, *args, **kwargs) -> None:
+        pass
+
+class StubGuild:
+    def __init__(self, id: int) -> None:
+        self.id: int = id
+        self.members: dict[int, StubMember] = {}
+        self.roles: dict[int, StubRole] = {}
+        self.channels: dict[int, StubChannel] = {}
+
+    def get_member(self, id: int) -> Optional[StubMember]:
+        return self.members.get(id)
+
+    def get_role(self, id: int) -> Optional[StubRole]:
+        return self.roles.get(id)
+
+    def get_channel(self, id: int) -> Optional[StubChannel]:
+        return self.channels.get(id)
+
+class StubBot:
+    def __init__(self) -> None:
+        self.owner_ids: set[int] = set()
+        self.app: types.SimpleNamespace = types.SimpleNamespace(team=None)
+
+class StubContext:
+    def __init__(self, bot: StubBot, guild: StubGuild, author: StubMember, channel: StubChannel, input_text: str = "") -> None:
+        self.bot: StubBot = bot
+        self.guild: StubGuild = guild
+        self.guild_id: int = guild.id
+        self.author: StubMember = author
+        self.channel: StubChannel = channel
+        self.input_text: str = input_text
+        self.sent: Any = None
+
+    async def send(self, *args, **kwargs) -> None:
+        self.sent = (args, kwargs)
+
+class StubResolver:
+    def __init__(self, guild: StubGuild) -> None:
+        self.guild: StubGuild = guild
+
+    async def channel(self, id: int) -> Optional[StubChannel]:
+        return self.guild.get_channel(id)
+
+    async def user(self, id: int) -> Optional[StubMember]:
+        return self.guild.get_member(id)
+
+    async def member(self, guild_id: int, id: int) -> Optional[StubMember]:
+        return self.guild.get_member(id)
+
+################ Fixture ################
+
+class Fixture:
+    '''
+    A synthetic guild with the size as the number of global admins, channel moderators and prisoners.
+    The moderators and prisoners are spread over one channel per 50 of them.
+    '''
+    def __init__(self, main: types.ModuleType, size: int, repeat: int) -> None:
+        self.main = main
+        self.size: int = size
+        self.repeat: int = repeat
+        self.channels: int = max(1, size // 50)
+        self.guild: StubGuild = StubGuild(GUILD_ID)
+        self.bot: StubBot = StubBot()
+        self.bot.cache = types.SimpleNamespace(get_channel=self.guild.get_channel)
+        rng: random.Random = random.Random(size)
+        for c in range(self.channels):
+            self.guild.channels[c + 1] = StubChannel(c + 1)
+        for r in range(size):
+            self.guild.roles[10_000_000 + r] = StubRole(10_000_000 + r)
+        for m in range(size * 3 + repeat):
+            # Ordinary members have a few roles that are not admin roles
+            self.guild.members[m + 1] = StubMember(m + 1, [20_000_000 + rng.randrange(1000) for _ in range(5)])
+        self.channel: StubChannel = self.guild.channels[1]
+        ext_cls = main.ModuleRetr0initConfinedTimeout
+        # Skip the Extension construction that needs a connected client
+        self.ext = object.__new__(ext_cls)
+        self.ext.bot = self.bot
+        self.ext.resolver = StubResolver(self.guild)
+        self.ext.coordinator = None
+        self.ext.release_lease = main.release_lease_name((0,), 1)
+        self.ext.release_scheduler = main.ReleaseScheduler(self._noop)
+        self.ext.release_retries = {}
+        self.ext.reconciler = main.Reconciler(self.ext.reconcile_keys, self.ext.reconcile_channel)
+        self.ext.outbound = main.OutboundScheduler()
+        self.ext.overwrites = main.OverwriteCoalescer(window=0)
+
+    @staticmethod
+    async def _noop(keys) -> None:
+        pass
+
+    async def setup(self) -> None:
+        main = self.main
+        main.storage = importlib.import_module(f"{PACKAGE_NAME}.storage").MemoryStorage()
+        await main.guilds.clear()
+        storage = main.storage
+        self.ext.history = main.HistoryRecorder(storage.add_history, storage.compact_history)
+        USER, ROLE = main.MRCTType.USER, main.MRCTType.ROLE
+        half: int = self.size // 2
+        for i in range(half):
+            storage.add_admin(GUILD_ID, i + 1, USER)
+        for i in range(self.size - half):
+            storage.add_admin(GUILD_ID, 10_000_000 + i, ROLE)
+        for i in range(self.size):
+            storage.add_moderator(GUILD_ID, self.size + i + 1, USER, i % self.channels + 1)
+        release: int = int(time.time()) + 86400
+        for i in range(self.size):
+            storage.add_prisoner(GUILD_ID, self.size * 2 + i + 1, i % self.channels + 1, release)
+        # The prisoners released by the release benchmark
+        for i in range(self.repeat):
+            storage.add_prisoner(GUILD_ID, self.size * 3 + i + 1, 1, release)
+        self.state = await main.guilds.load(GUILD_ID)
+
+    def ctx(self, author_id: int, input_text: str = "") -> StubContext:
+        return StubContext(self.bot, self.guild, self.guild.get_member(author_id), self.channel, input_text)
+
+################ Measure ################
+
+async def measure(func: Callable[[int], Awaitable[Any]], repeat: int, warmup: int = 3) -> dict[str, float]:
+    '''Time each call in microseconds. The call receives its iteration number.'''
+    for i in range(warmup):
+        await func(-1 - i)
+    samples: list[float] = []
+    for i in range(repeat):
+        start: int = time.perf_counter_ns()
+        await func(i)
+        samples.append((time.perf_counter_ns() - start) / 1000)
+    samples.sort()
+    return {
+        "mean_us": statistics.fmean(samples),
+        "p50_us": samples[len(samples) // 2],
+        "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "min_us": samples[0],
+    }
+
+async def run_hot_paths(main: types.ModuleType, size: int, repeat: int) -> dict[str, dict[str, float]]:
+    fixture: Fixture = Fixture(main, size, repeat)
+    await fixture.setup()
+    ext = fixture.ext
+    state = fixture.state
+    guild: StubGuild = fixture.guild
+    # An admin by role is found through the last role of the member
+    role_admin: StubMember = guild.get_member(size * 3 + repeat)
+    role_admin._role_ids = role_admin._role_ids + [10_000_000 + size - 1 - size // 2]
+    admin_user: int = 1
+    moderator: int = size + 1
+    plain: int = size * 3
+    prisoner_member: StubMember = guild.get_member(size * 2 + 1)
+    to_release: list = [state.prisoners.get(size * 3 + i + 1, 1) for i in range(repeat)]
+    ext_cls = main.ModuleRetr0initConfinedTimeout
+
+    async def admin_check_user(i: int) -> None:
+        await main.my_admin_check(fixture.ctx(admin_user))
+    async def admin_check_role(i: int) -> None:
+        await main.my_admin_check(StubContext(fixture.bot, guild, role_admin, fixture.channel))
+    async def admin_check_miss(i: int) -> None:
+        await main.my_admin_check(fixture.ctx(plain))
+    async def moderator_check_hit(i: int) -> None:
+        await main.my_channel_moderator_check(fixture.ctx(moderator))
+    async def moderator_check_miss(i: int) -> None:
+        await main.my_channel_moderator_check(fixture.ctx(plain))
+    async def check_prisoner(i: int) -> None:
+        ext.check_prisoner(state, prisoner_member, 10, fixture.channel)
+    async def jail_guards(i: int) -> None:
+        ext.check_jail(state, guild.get_member(plain), 10, fixture.channel)
+    async def release_state_update(i: int) -> None:
+        if i >= 0:
+            await ext.release_prinsoner(state, to_release[i])
+    async def autocomplete_release(i: int) -> None:
+        await ext_cls.autocomplete_release_user(ext, fixture.ctx(moderator, "user"))
+    async def autocomplete_remove_admin(i: int) -> None:
+        await ext_cls.autocomplete_removeGlobalAdmin_user(ext, fixture.ctx(admin_user, "user1"))
+    async def summary_render(i: int) -> None:
+        sections: list = [main.Section("Settings:", ["Log channel is not set!"]), ext.admin_section(state, guild)]
+        sections.extend(ext.summary_streams(state, guild))
+        main.LazyPages(sections, title="Summary for Confined Timeout")[0]
+
+    benchmarks: dict[str, Callable[[int], Awaitable[Any]]] = {
+        "my_admin_check.user": admin_check_user,
+        "my_admin_check.role": admin_check_role,
+        "my_admin_check.miss": admin_check_miss,
+        "my_channel_moderator_check.hit": moderator_check_hit,
+        "my_channel_moderator_check.miss": moderator_check_miss,
+        "check_prisoner": check_prisoner,
+        "jail_prisoner.guards": jail_guards,
+        "release_prinsoner.state_update": release_state_update,
+        "autocomplete.release_user": autocomplete_release,
+        "autocomplete.remove_global_admin_user": autocomplete_remove_admin,
+        "summary.render_first_page": summary_render,
+    }
+    results: dict[str, dict[str, float]] = {}
+    for name, func in benchmarks.items():
+        results[name] = await measure(func, repeat, warmup=0 if func is release_state_update else 3)
+    await main.guilds.clear()
+    return results
+
+async def run_load(main: types.ModuleType, size: int, repeat: int) -> dict[str, dict[str, float]]:
+    '''
+    The startup against a SQLite database: opening with the migrations, the scan of the release times,
+    and loading the partition of one guild. The rows are spread over 10 guilds.
+    '''
+    storage_module = importlib.import_module(f"{PACKAGE_NAME}.storage")
+    directory: str = tempfile.mkdtemp()
+    path: str = os.path.join(directory, "bench.db")
+    storage = storage_module.SQLiteStorage(path)
+    await storage.open()
+    release: int = int(time.time()) + 86400
+    for i in range(size):
+        guild_id: int = GUILD_ID + i % 10
+        storage.add_admin(guild_id, i + 1, 1)
+        storage.add_moderator(guild_id, size + i + 1, 1, i % 50 + 1)
+        storage.add_prisoner(guild_id, size * 2 + i + 1, i % 50 + 1, release)
+    await storage.close()
+    rounds: int = max(3, min(repeat, 20))
+    results: dict[str, dict[str, float]] = {}
+    for name in ("open", "load_prisoners", "load_guild"):
+        samples: list[float] = []
+        for _ in range(rounds):
+            storage = storage_module.SQLiteStorage(path)
+            start: int = time.perf_counter_ns()
+            await storage.open()
+            opened: int = time.perf_counter_ns()
+            await storage.load_prisoners()
+            scanned: int = time.perf_counter_ns()
+            await storage.load_guild(GUILD_ID)
+            loaded: int = time.perf_counter_ns()
+            await storage.close()
+            samples.append({"open": opened - start, "load_prisoners": scanned - opened, "load_guild": loaded - scanned}[name] / 1000)
+        samples.sort()
+        results[f"async_init.{name}"] = {
+            "mean_us": statistics.fmean(samples),
+            "p50_us": samples[len(samples) // 2],
+            "p95_us": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "min_us": samples[0],
+        }
+    for f in os.listdir(directory):
+        os.remove(os.path.join(directory, f))
+    os.rmdir(directory)
+    return results
+
+################ Report ################
+
+def growth_exponent(sizes: list[int], means: list[float]) -> Optional[float]:
+    '''The least squares slope of log(time) over log(size)'''
+    points: list[tuple[float, float]] = [(math.log(s), math.log(m)) for s, m in zip(sizes, means) if s > 0 and m > 0]
+    if len(points) < 2:
+        return None
+    mx: float = statistics.fmean(p[0] for p in points)
+    my: float = statistics.fmean(p[1] for p in points)
+    denominator: float = sum((p[0] - mx) ** 2 for p in points)
+    if denominator == 0:
+        return None
+    return sum((p[0] - mx) * (p[1] - my) for p in points) / denominator
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions: list[str] = []
+    for name, scaling in report["scaling"].items():
+        old: Optional[dict] = baseline.get("scaling", {}).get(name)
+        if old is None or old["exponent"] is None or scaling["exponent"] is None:
+            continue
+        # A negative exponent is noise around constant time
+        if scaling["exponent"] > max(old["exponent"], 0.0) + tolerance:
+            regressions.append(f"{name}: exponent {old['exponent']:.2f} -> {scaling['exponent']:.2f}")
+    return regressions
+
+async def run(main: types.ModuleType, sizes: list[int], repeat: int, skip_load: bool) -> dict:
+    runs: list[dict] = []
+    for size in sizes:
+        results: dict[str, dict[str, float]] = await run_hot_paths(main, size, repeat)
+        if not skip_load:
+            results.update(await run_load(main, size, repeat))
+        runs.append({"size": size, "results": results})
+    scaling: dict[str, dict] = {}
+    for name in runs[0]["results"]:
+        means: list[float] = [r["results"][name]["mean_us"] for r in runs]
+        exponent: Optional[float] = growth_exponent(sizes, means)
+        scaling[name] = {"exponent": round(exponent, 3) if exponent is not None else None}
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "repeat": repeat,
+        "sizes": sizes,
+        "runs": runs,
+        "scaling": scaling,
+    }
+
+def main() -> int:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Confined Timeout micro-benchmarks")
+    parser.add_argument("--package", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help="Directory of the extension")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma separated numbers of admins, moderators and prisoners")
+    parser.add_argument("--repeat", type=int, default=200, help="Timed calls per benchmark")
+    parser.add_argument("--skip-load", action="store_true", help="Skip the SQLite load benchmarks")
+    parser.add_argument("--output", help="Write the JSON report to the file instead of stdout")
+    parser.add_argument("--baseline", help="JSON report of a previous version to compare the growth with")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="Allowed growth of the exponent over the baseline")
+    args = parser.parse_args()
+
+    sizes: list[int] = sorted(int(s) for s in args.sizes.split(","))
+    ext_main: types.ModuleType = load_package(args.package)
+    # The extension prints its messages, which must not end up in the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report: dict = asyncio.run(run(ext_main, sizes, args.repeat, args.skip_load))
+    text: str = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions: list[str] = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Scaling regression {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
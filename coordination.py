@@ -0,0 +1,268 @@
+'''
+Confined Timeout
+Coordination of several bot processes sharing one database
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Run the local demo with several processes sharing one SQLite file from the parent directory of the package:
+    python -m <package>.coordination [processes] [seconds]
+'''
+import asyncio
+import os
+import socket
+import sys
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+import sqlalchemy
+from sqlalchemy import select as sqlselect
+from sqlalchemy import delete as sqldelete
+from sqlalchemy.ext.asyncio import async_sessionmaker
+import sqlalchemy.dialects.sqlite as sqlite
+
+from .model import ChangeDB, LeaseDB
+
+def new_owner() -> str:
+    '''A lease owner name unique to this process'''
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def release_lease_name(shard_ids: Iterable[int], total_shards: int) -> str:
+    '''The lease of the releaser of the guilds in the shards run by one process'''
+    return f"release:{','.join(str(i) for i in sorted(shard_ids))}/{total_shards}"
+
+def guild_shard(guild_id: int, total_shards: int) -> int:
+    '''The shard receiving the events of the guild'''
+    return (guild_id >> 22) % total_shards
+
+class Coordinator:
+    '''
+    Leases and change polling on the shared database.
+    A lease is held by one owner until it expires, and the holder renews it on every tick.
+    Every process polls the change log and is told about the guilds changed by the other processes.
+    The expiry uses the wall clock, so the clocks of the hosts have to be in sync well within the TTL.
+    '''
+    def __init__(self, session_maker: async_sessionmaker, owner: Optional[str] = None, lease_ttl: float = 30.0, interval: float = 2.0, retention: float = 600.0) -> None:
+        '''
+        owner: str          (Optional) The unique name of this process
+        lease_ttl: float    Seconds a lease stays valid without being renewed
+        interval: float     Seconds between the lease renewals and change polls
+        retention: float    Seconds the change log is kept
+        '''
+        self.Session = session_maker
+        self.owner: str = owner if owner is not None else new_owner()
+        self.lease_ttl: float = lease_ttl
+        self.interval: float = interval
+        self.retention: float = retention
+        self.on_change: Optional[Callable[[set[int]], Awaitable[Any]]] = None
+        self._wanted: dict[str, tuple[Optional[Callable[[str], Awaitable[Any]]], Optional[Callable[[str], Awaitable[Any]]]]] = {}
+        # The held leases and the time of their last successful renewal
+        self._held: dict[str, float] = {}
+        self._last_seq: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def holds(self, name: str) -> bool:
+        return name in self._held
+
+    def want(
+        self,
+        name: str,
+        on_acquire: Optional[Callable[[str], Awaitable[Any]]] = None,
+        on_lose: Optional[Callable[[str], Awaitable[Any]]] = None) -> None:
+        '''Compete for the lease on every tick and get notified when it is acquired or lost'''
+        self._wanted[name] = (on_acquire, on_lose)
+
+    ################ Leases ################
+
+    async def try_acquire(self, name: str) -> bool:
+        '''
+        Take the lease if it is free or expired, or renew it if it is already held.
+        Return whether this process holds the lease.
+        '''
+        now: float = time.time()
+        stmt = sqlite.insert(LeaseDB).values(name=name, owner=self.owner, expires_at=now + self.lease_ttl)
+        stmt = stmt.on_conflict_do_update(
+            index_elements = ["name"],
+            set_ = {"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at},
+            where = sqlalchemy.or_(LeaseDB.owner == self.owner, LeaseDB.expires_at < now)
+        )
+        async with self.Session() as session:
+            await session.execute(stmt)
+            owner: Optional[str] = (await session.execute(sqlselect(LeaseDB.owner).where(LeaseDB.name == name))).scalar()
+            await session.commit()
+        return owner == self.owner
+
+    async def release(self, name: str) -> None:
+        '''Give the lease up so another process can take it over without waiting for the expiry'''
+        self._held.pop(name, None)
+        async with self.Session() as session:
+            await session.execute(sqldelete(LeaseDB).where(sqlalchemy.and_(LeaseDB.name == name, LeaseDB.owner == self.owner)))
+            await session.commit()
+
+    async def _renew(self) -> None:
+        for name, (on_acquire, on_lose) in list(self._wanted.items()):
+            # The renewal is valid for the TTL from before the attempt
+            started: float = time.time()
+            try:
+                held: bool = await self.try_acquire(name)
+            except Exception as e:
+                print(f"Failed to renew the lease {name}: {e!r}")
+                # Keep the lease until it might have expired for the others
+                renewed: Optional[float] = self._held.get(name)
+                held = renewed is not None and time.time() < renewed + self.lease_ttl
+                if held:
+                    continue
+            if held and name not in self._held:
+                self._held[name] = started
+                if on_acquire is not None:
+                    await on_acquire(name)
+            elif held:
+                self._held[name] = started
+            elif name in self._held:
+                del self._held[name]
+                if on_lose is not None:
+                    await on_lose(name)
+
+    ################ Changes ################
+
+    async def poll_changes(self) -> set[int]:
+        '''Return the guilds changed by the other processes since the last poll'''
+        async with self.Session() as session:
+            if self._last_seq is None:
+                # Nothing is loaded before the first poll so the earlier changes do not matter
+                self._last_seq = (await session.execute(sqlselect(sqlalchemy.func.max(ChangeDB.seq)))).scalar() or 0
+                return set()
+            rows = (await session.execute(
+                sqlselect(ChangeDB.seq, ChangeDB.guild_id, ChangeDB.origin).where(ChangeDB.seq > self._last_seq)
+            )).all()
+        changed: set[int] = set()
+        for seq, guild_id, origin in rows:
+            self._last_seq = max(self._last_seq, seq)
+            if origin != self.owner:
+                changed.add(guild_id)
+        return changed
+
+    async def prune_changes(self) -> None:
+        async with self.Session() as session:
+            await session.execute(sqldelete(ChangeDB).where(ChangeDB.changed_at < time.time() - self.retention))
+            await session.commit()
+
+    ################ Loop ################
+
+    async def tick(self) -> None:
+        await self._renew()
+        changed: set[int] = await self.poll_changes()
+        if changed and self.on_change is not None:
+            await self.on_change(changed)
+        # Any lease holder keeps the change log short
+        if self._held:
+            await self.prune_changes()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def close(self) -> None:
+        '''Stop and give up all the held leases'''
+        self.stop()
+        for name in list(self._held):
+            await self.release(name)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Coordination tick failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+################ Local demo ################
+
+def _demo_worker(path: str, index: int, seconds: float, crash: bool, results) -> None:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from .model import DBBase
+
+    async def run() -> None:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}", connect_args={"timeout": 10})
+        async with engine.begin() as conn:
+            await conn.run_sync(DBBase.metadata.create_all)
+        Session = async_sessionmaker(engine)
+        coordinator: Coordinator = Coordinator(Session, owner=f"worker-{index}", lease_ttl=2.0, interval=0.2)
+        lease: str = release_lease_name((0,), 1)
+        intervals: list[list[float]] = []
+        seen: set[int] = set()
+        async def on_acquire(name: str) -> None:
+            intervals.append([time.time(), time.time()])
+        async def on_change(guild_ids: set[int]) -> None:
+            seen.update(guild_ids)
+        coordinator.want(lease, on_acquire)
+        coordinator.on_change = on_change
+        deadline: float = time.time() + seconds * (0.4 if crash else 1)
+        while time.time() < deadline:
+            await coordinator.tick()
+            if coordinator.holds(lease):
+                intervals[-1][1] = time.time()
+            # Every worker changes its own guild
+            async with Session() as session:
+                await session.execute(sqlalchemy.insert(ChangeDB).values(guild_id=index, origin=coordinator.owner, changed_at=time.time()))
+                await session.commit()
+            await asyncio.sleep(coordinator.interval)
+        # A crashed worker never gives the lease up
+        if not crash:
+            await coordinator.close()
+        await engine.dispose()
+        results.put((index, crash, intervals, sorted(seen)))
+
+    asyncio.run(run())
+
+def demo(processes: int = 3, seconds: float = 10.0) -> bool:
+    '''
+    Run the workers against one SQLite file. The first worker crashes while holding the lease.
+    Return whether the lease was never held by two workers at once.
+    '''
+    import multiprocessing
+    import tempfile
+    path: str = os.path.join(tempfile.mkdtemp(), "coordination_demo.db")
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=_demo_worker, args=(path, i, seconds, i == 0, results))
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+        # Let the first worker take the lease first
+        time.sleep(0.5)
+    reports = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    held: list[tuple[float, float, int]] = []
+    for index, crash, intervals, seen in sorted(reports):
+        print(f"worker-{index}{' (crashed)' if crash else ''}: held the lease {[(round(a, 2), round(b, 2)) for a, b in intervals]}, saw changes of guilds {seen}")
+        held.extend((a, b, index) for a, b in intervals)
+    held.sort()
+    exclusive: bool = all(held[i][1] <= held[i + 1][0] for i in range(len(held) - 1))
+    print("The lease was held by one worker at a time" if exclusive else "The lease was held by several workers at once!")
+    return exclusive
+
+if __name__ == "__main__":
+    sys.exit(0 if demo(*(int(a) for a in sys.argv[1:3])) else 1)
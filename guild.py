@@ -0,0 +1,155 @@
+'''
+Confined Timeout
+Per-guild partitioned state
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import functools
+import time
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+from .index import NameIndex, PermissionIndex, PrisonerStore
+
+class GuildState:
+    '''
+    The in-memory partition of one guild.
+    Every check, listing and autocomplete of a guild only touches its own partition.
+    '''
+    __slots__ = ('guild_id', 'names', 'permissions', 'prisoners', 'settings', 'log_pipeline', 'last_used')
+    def __init__(self, guild_id: int, prisoner_factory: Optional[Callable[[int, int, int, float], Any]] = None) -> None:
+        self.guild_id: int = guild_id
+        self.names: NameIndex = NameIndex()
+        self.permissions: PermissionIndex = PermissionIndex(self.names)
+        self.prisoners: PrisonerStore = PrisonerStore(
+            self.names, functools.partial(prisoner_factory, guild_id) if prisoner_factory is not None else None)
+        # The list of Config sorted by the setting type
+        self.settings: list = []
+        self.log_pipeline: Optional[Any] = None
+        self.last_used: float = time.monotonic()
+
+    def touch(self) -> None:
+        self.last_used = time.monotonic()
+
+class GuildRegistry:
+    '''
+    Guild partitions loaded lazily the first time the guild is touched and evicted when idle.
+    Concurrent loads of the same guild share one load.
+    '''
+    def __init__(
+        self,
+        loader: Callable[[GuildState], Awaitable[None]],
+        idle_ttl: float = 3600.0,
+        on_evict: Optional[Callable[[GuildState], Awaitable[None]]] = None,
+        prisoner_factory: Optional[Callable[[int, int, int, float], Any]] = None) -> None:
+        '''
+        loader: Callable            Coroutine function filling a new partition from the database
+        idle_ttl: float             Seconds without a touch before the partition is evicted
+        on_evict: Callable          (Optional) Coroutine function called with the evicted partition
+        prisoner_factory: Callable  (Optional) Build a prisoner from the guild id, id, channel id and release epoch seconds
+        '''
+        self.loader = loader
+        self.idle_ttl: float = idle_ttl
+        self.on_evict = on_evict
+        self.prisoner_factory = prisoner_factory
+        self._states: dict[int, GuildState] = {}
+        self._loading: dict[int, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._states
+
+    def __iter__(self) -> Iterator[GuildState]:
+        return iter(list(self._states.values()))
+
+    def get(self, guild_id: int) -> Optional[GuildState]:
+        '''Return the partition if it is loaded'''
+        state: Optional[GuildState] = self._states.get(guild_id)
+        if state is not None:
+            state.touch()
+        return state
+
+    def peek(self, guild_id: int) -> Optional[GuildState]:
+        '''Return the partition if it is loaded without keeping it from the eviction'''
+        return self._states.get(guild_id)
+
+    async def load(self, guild_id: int) -> GuildState:
+        '''Return the partition, loading it first if needed'''
+        state: Optional[GuildState] = self.get(guild_id)
+        if state is not None:
+            return state
+        future: Optional[asyncio.Future] = self._loading.get(guild_id)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[guild_id] = future
+        try:
+            state = GuildState(guild_id, self.prisoner_factory)
+            await self.loader(state)
+            self._states[guild_id] = state
+            future.set_result(state)
+            return state
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Only the waiters should see the exception
+            future.exception()
+            raise
+        finally:
+            del self._loading[guild_id]
+
+    async def evict(self, guild_id: int) -> bool:
+        '''Return False if the guild is not loaded'''
+        state: Optional[GuildState] = self._states.pop(guild_id, None)
+        if state is None:
+            return False
+        if self.on_evict is not None:
+            try:
+                await self.on_evict(state)
+            except Exception as e:
+                print(f"Failed to evict guild {guild_id}: {e!r}")
+        return True
+
+    async def evict_idle(self) -> list[int]:
+        '''Evict the partitions idle for longer than the TTL and return their guild ids'''
+        deadline: float = time.monotonic() - self.idle_ttl
+        idle: list[int] = [gid for gid, state in self._states.items() if state.last_used < deadline]
+        for gid in idle:
+            await self.evict(gid)
+        return idle
+
+    async def clear(self) -> None:
+        for gid in list(self._states):
+            await self.evict(gid)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.idle_ttl / 4, 1.0))
+            await self.evict_idle()
@@ -0,0 +1,126 @@
+'''
+Confined Timeout
+Append-only moderation history with monthly buckets
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import datetime
+import time
+from enum import Enum, unique
+from typing import Any, Awaitable, Callable, Optional
+
+@unique
+class HistoryKind(int, Enum):
+    JAIL = 0
+    RELEASE = 1
+
+# (at, guild_id, kind, user_id, channel_id, moderator_id, duration, reason)
+HistoryEvent = tuple[int, int, int, int, int, int, int, str]
+
+# Longer reasons are cut to fit the column
+REASON_LIMIT: int = 200
+
+def history_bucket(at: int) -> int:
+    '''The UTC month of the epoch seconds as YYYYMM'''
+    dt: datetime.datetime = datetime.datetime.fromtimestamp(at, datetime.timezone.utc)
+    return dt.year * 100 + dt.month
+
+def months_before(bucket: int, months: int) -> int:
+    '''The bucket the months before the bucket'''
+    index: int = (bucket // 100) * 12 + bucket % 100 - 1 - months
+    return (index // 12) * 100 + index % 12 + 1
+
+class HistoryRecorder:
+    '''
+    Buffer the history events and write them in batches, apart from the prisoner writes,
+    so the history never slows the jails and releases down.
+    The releaser also runs the retention, which summarizes and drops the buckets past the retention in bulk.
+    '''
+    def __init__(
+        self,
+        write: Callable[[list[HistoryEvent]], Awaitable[Any]],
+        compact: Callable[[int], Awaitable[int]],
+        window: float = 1.0,
+        batch_size: int = 500,
+        retention_months: int = 6,
+        compact_interval: float = 6 * 3600) -> None:
+        '''
+        write: Callable             Coroutine function appending the events
+        compact: Callable           Coroutine function summarizing and dropping the buckets before the bucket, returning how many
+        window: float               Seconds the first buffered event waits for the others
+        batch_size: int             Events written at once
+        retention_months: int       Months of the detailed history kept besides the current one
+        compact_interval: float     Seconds between the retention runs
+        '''
+        self.write = write
+        self.compact = compact
+        self.window: float = window
+        self.batch_size: int = batch_size
+        self.retention_months: int = retention_months
+        self.compact_interval: float = compact_interval
+        self._buffer: list[HistoryEvent] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._retention_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def record(self, guild_id: int, kind: HistoryKind, user_id: int, channel_id: int, moderator_id: int = 0, reason: str = "", duration: int = 0) -> None:
+        '''Buffer the event. It does not wait for the event to be written.'''
+        self._buffer.append((int(time.time()), guild_id, int(kind), user_id, channel_id, moderator_id, duration, reason[:REASON_LIMIT]))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later(self.window))
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        '''Write everything buffered so far'''
+        while self._buffer:
+            events: list[HistoryEvent] = self._buffer[:self.batch_size]
+            del self._buffer[:self.batch_size]
+            try:
+                await self.write(events)
+            except Exception as e:
+                # The history is best effort and never holds the moderation up
+                print(f"Failed to write {len(events)} history events: {e!r}")
+
+    async def run_retention(self) -> int:
+        '''Summarize and drop the buckets older than the retention. Return the number of buckets dropped.'''
+        return await self.compact(months_before(history_bucket(int(time.time())), self.retention_months))
+
+    def start(self) -> None:
+        if self._retention_task is None or self._retention_task.done():
+            self._retention_task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._retention_task is not None:
+            self._retention_task.cancel()
+            self._retention_task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                dropped: int = await self.run_retention()
+                if dropped > 0:
+                    print(f"History retention summarized {dropped} monthly buckets")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"History retention failed: {e!r}")
+            await asyncio.sleep(self.compact_interval)
@@ -0,0 +1,425 @@
+'''
+Confined Timeout
+In-memory indexes of the module state
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+from array import array
+import bisect
+import itertools
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Keep in sync with MRCTType in main.py
+TYPE_USER: int = 1
+TYPE_ROLE: int = 2
+
+def member_role_ids(member) -> Iterable[int]:
+    '''
+    Get the role ids of a member without building the Role objects
+    '''
+    role_ids = getattr(member, "_role_ids", None)
+    if role_ids is not None:
+        return role_ids
+    return [r.id for r in getattr(member, "roles", ())]
+
+# The longest substrings of the names indexed for the substring search
+GRAM_SIZE: int = 3
+
+def name_grams(name: str) -> set[str]:
+    '''The substrings of the name up to the gram size'''
+    return {name[i:i + n] for n in range(1, GRAM_SIZE + 1) for i in range(len(name) - n + 1)}
+
+class _NameScope:
+    '''Sorted case-folded names of one autocomplete scope and the ids by the substrings of their names'''
+    __slots__ = ('keys', 'labels', 'pending', 'grams')
+    def __init__(self) -> None:
+        self.keys: list[tuple[str, int]] = []
+        self.labels: dict[int, tuple[str, tuple[str, ...]]] = {}
+        self.pending: set[int] = set()
+        self.grams: dict[str, set[int]] = {}
+
+class NameIndex:
+    '''
+    Case-folded name index for the autocomplete, partitioned by scope.
+    Entries are added without names and named lazily by the first autocomplete that needs them.
+    Prefix matches are ranked before substring matches.
+    The substring matches are found by the grams of the text, so a search does not scan every name.
+    '''
+    def __init__(self) -> None:
+        self._scopes: dict[Hashable, _NameScope] = {}
+        # The ids of the scopes of a kind read from their owner instead of being added
+        self._sources: dict[str, Callable[[Hashable], Iterable[int]]] = {}
+
+    def source(self, kind: str, ids: Callable[[Hashable], Iterable[int]]) -> None:
+        '''Read the ids of the scopes of the kind from the callable, so they cost nothing until named'''
+        self._sources[kind] = ids
+
+    def clear(self, kind: Optional[str] = None) -> None:
+        '''Clear all scopes, or only the scopes whose key starts with the kind'''
+        if kind is None:
+            self._scopes.clear()
+            return
+        for scope in [k for k in self._scopes if k[0] == kind]:
+            del self._scopes[scope]
+
+    def add(self, scope: Hashable, id: int) -> None:
+        s: Optional[_NameScope] = self._scopes.get(scope)
+        if s is None:
+            s = self._scopes[scope] = _NameScope()
+        if id not in s.labels:
+            s.pending.add(id)
+
+    def remove(self, scope: Hashable, id: int) -> None:
+        s: Optional[_NameScope] = self._scopes.get(scope)
+        if s is None:
+            return
+        s.pending.discard(id)
+        label = s.labels.pop(id, None)
+        if label is not None:
+            for name in label[1]:
+                i: int = bisect.bisect_left(s.keys, (name, id))
+                if i < len(s.keys) and s.keys[i] == (name, id):
+                    del s.keys[i]
+                for gram in name_grams(name):
+                    ids: Optional[set[int]] = s.grams.get(gram)
+                    if ids is not None:
+                        ids.discard(id)
+                        if not ids:
+                            del s.grams[gram]
+        if not s.labels and not s.pending:
+            del self._scopes[scope]
+
+    def pending(self, scope: Hashable) -> list[int]:
+        '''The ids in the scope not named yet'''
+        s: Optional[_NameScope] = self._scopes.get(scope)
+        source: Optional[Callable[[Hashable], Iterable[int]]] = self._sources.get(scope[0])
+        if source is not None:
+            return [id for id in source(scope) if s is None or id not in s.labels]
+        return list(s.pending) if s is not None else []
+
+    def name(self, scope: Hashable, id: int, label: str, names: Iterable[str] = ()) -> None:
+        '''Set the display label and the searchable names of an entry'''
+        self.remove(scope, id)
+        s: _NameScope = self._scopes.setdefault(scope, _NameScope())
+        folded: tuple[str, ...] = tuple(dict.fromkeys(n.casefold() for n in (label, *names, str(id)) if n))
+        s.labels[id] = (label, folded)
+        for name in folded:
+            bisect.insort(s.keys, (name, id))
+            for gram in name_grams(name):
+                s.grams.setdefault(gram, set()).add(id)
+
+    def search(self, scope: Hashable, text: str, limit: int = 25) -> list[tuple[str, int]]:
+        '''Return up to the limit of (label, id), prefix matches first'''
+        s: Optional[_NameScope] = self._scopes.get(scope)
+        if s is None:
+            return []
+        text = text.casefold()
+        found: dict[int, None] = {}
+        i: int = bisect.bisect_left(s.keys, (text,))
+        while i < len(s.keys) and len(found) < limit and s.keys[i][0].startswith(text):
+            found[s.keys[i][1]] = None
+            i += 1
+        if len(found) < limit:
+            for id in self._containing(s, text):
+                if id not in found:
+                    found[id] = None
+                    if len(found) >= limit:
+                        break
+        return [(s.labels[id][0], id) for id in found]
+
+    @staticmethod
+    def _containing(s: _NameScope, text: str) -> Iterable[int]:
+        '''The ids with a name containing the text. Only the ids sharing every gram of the text are checked.'''
+        if len(text) <= GRAM_SIZE:
+            return s.grams.get(text, ())
+        grams: list[Optional[set[int]]] = [s.grams.get(text[i:i + GRAM_SIZE]) for i in range(len(text) - GRAM_SIZE + 1)]
+        if any(g is None for g in grams):
+            return ()
+        grams.sort(key=len)
+        return (id for id in grams[0].intersection(*grams[1:]) if any(text in name for name in s.labels[id][1]))
+
+class PermissionIndex:
+    '''
+    Hash index of the global admins and the channel moderators.
+    A check costs a few set lookups regardless of the number of entries.
+    '''
+    def __init__(self, names: Optional[NameIndex] = None) -> None:
+        self.names: Optional[NameIndex] = names
+        self.admin_users: set[int] = set()
+        self.admin_roles: set[int] = set()
+        self.moderator_users: dict[int, set[int]] = {}
+        self.moderator_roles: dict[int, set[int]] = {}
+        self.moderator_count: int = 0
+
+    def clear(self) -> None:
+        self.admin_users.clear()
+        self.admin_roles.clear()
+        self.moderator_users.clear()
+        self.moderator_roles.clear()
+        self.moderator_count = 0
+        if self.names is not None:
+            self.names.clear("admin")
+            self.names.clear("moderator")
+
+    ######## Global Admin ########
+
+    def _admin_set(self, type: int) -> set[int]:
+        return self.admin_users if type == TYPE_USER else self.admin_roles
+
+    def has_admin(self, id: int, type: int) -> bool:
+        return id in self._admin_set(type)
+
+    def add_admin(self, id: int, type: int) -> bool:
+        '''Return False if it already exists'''
+        s: set[int] = self._admin_set(type)
+        if id in s:
+            return False
+        s.add(id)
+        if self.names is not None:
+            self.names.add(("admin", type), id)
+        return True
+
+    def remove_admin(self, id: int, type: int) -> bool:
+        '''Return False if it does not exist'''
+        s: set[int] = self._admin_set(type)
+        if id not in s:
+            return False
+        s.remove(id)
+        if self.names is not None:
+            self.names.remove(("admin", type), id)
+        return True
+
+    def admins(self, type: int) -> set[int]:
+        return self._admin_set(type)
+
+    def is_admin(self, member) -> bool:
+        '''Whether the member is a global admin as a user or through one of the roles'''
+        if member.id in self.admin_users:
+            return True
+        if not self.admin_roles:
+            return False
+        return not self.admin_roles.isdisjoint(member_role_ids(member))
+
+    ######## Channel Moderator ########
+
+    def _moderator_map(self, type: int) -> dict[int, set[int]]:
+        return self.moderator_users if type == TYPE_USER else self.moderator_roles
+
+    def has_moderator(self, id: int, type: int, channel_id: int) -> bool:
+        return id in self._moderator_map(type).get(channel_id, ())
+
+    def add_moderator(self, id: int, type: int, channel_id: int) -> bool:
+        '''Return False if it already exists'''
+        s: set[int] = self._moderator_map(type).setdefault(channel_id, set())
+        if id in s:
+            return False
+        s.add(id)
+        self.moderator_count += 1
+        if self.names is not None:
+            self.names.add(("moderator", type, channel_id), id)
+        return True
+
+    def remove_moderator(self, id: int, type: int, channel_id: int) -> bool:
+        '''Return False if it does not exist'''
+        m: dict[int, set[int]] = self._moderator_map(type)
+        s: set[int] = m.get(channel_id)
+        if s is None or id not in s:
+            return False
+        s.remove(id)
+        if not s:
+            del m[channel_id]
+        self.moderator_count -= 1
+        if self.names is not None:
+            self.names.remove(("moderator", type, channel_id), id)
+        return True
+
+    def moderators(self, type: int, channel_id: int) -> set[int]:
+        return self._moderator_map(type).get(channel_id, set())
+
+    def _moderator_stream(self) -> Iterable[tuple[int, tuple[int, int]]]:
+        for channel_id, users in self.moderator_users.items():
+            yield from ((channel_id, (id, TYPE_USER)) for id in users)
+            yield from ((channel_id, (id, TYPE_ROLE)) for id in self.moderator_roles.get(channel_id, ()))
+        for channel_id, roles in self.moderator_roles.items():
+            if channel_id not in self.moderator_users:
+                yield from ((channel_id, (id, TYPE_ROLE)) for id in roles)
+
+    def moderator_slice(self, start: int, stop: int) -> list[tuple[int, tuple[int, int]]]:
+        '''
+        The (channel_id, (id, type)) of the moderators of all channels from the start to the stop position,
+        grouped by channel with the users first. Only the moderators up to the stop are visited.
+        '''
+        return list(itertools.islice(self._moderator_stream(), start, stop))
+
+    def moderator_channels(self) -> list[int]:
+        '''All channel ids that have at least one moderator'''
+        return list(dict.fromkeys((*self.moderator_users, *self.moderator_roles)))
+
+    def is_moderator(self, member, channel_id: int) -> bool:
+        '''Whether the member is a moderator of the channel as a user or through one of the roles'''
+        if member.id in self.moderator_users.get(channel_id, ()):
+            return True
+        roles: set[int] = self.moderator_roles.get(channel_id)
+        if not roles:
+            return False
+        return not roles.isdisjoint(member_role_ids(member))
+
+class PrisonerStore:
+    '''
+    Prisoners in parallel typed columns sorted by (channel_id, id), 24 bytes per prisoner.
+    The prisoners of a channel are one contiguous run found by binary search,
+    and the scans over the release times are vectorized with NumPy when it is installed.
+    The member join lookup scans the id column, and the autocomplete reads the ids of a channel from it,
+    so only the prisoners named by an autocomplete cost more than the columns.
+    The prisoner objects are only built by the factory when they are asked for.
+    This is the only place to mutate the prisoner state so that the indexes are always consistent.
+    '''
+    def __init__(self, names: Optional[NameIndex] = None, factory: Optional[Callable[[int, int, int], Any]] = None) -> None:
+        '''
+        names: NameIndex    (Optional) The name index of the autocomplete
+        factory: Callable   (Optional) Build a prisoner from the id, the channel id and the release epoch seconds
+        '''
+        self.names: Optional[NameIndex] = names
+        self.factory: Callable[[int, int, int], Any] = factory if factory is not None else (lambda id, channel_id, release_at: (id, channel_id, release_at))
+        self._channel_ids: array = array("q")
+        self._ids: array = array("q")
+        self._release_at: array = array("q")
+        if names is not None:
+            names.source("prisoner", lambda scope: self.ids_in_channel(scope[1]))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter([self._build(i) for i in range(len(self._ids))])
+
+    def __contains__(self, key: tuple[int, int]) -> bool:
+        return self._find(*key)[1]
+
+    def _build(self, i: int):
+        return self.factory(self._ids[i], self._channel_ids[i], self._release_at[i])
+
+    def _run(self, channel_id: int) -> tuple[int, int]:
+        '''The slots of the channel'''
+        return bisect.bisect_left(self._channel_ids, channel_id), bisect.bisect_right(self._channel_ids, channel_id)
+
+    def _find(self, id: int, channel_id: int) -> tuple[int, bool]:
+        '''The slot of the prisoner or where it would be inserted, and whether it exists'''
+        lo, hi = self._run(channel_id)
+        i: int = bisect.bisect_left(self._ids, id, lo, hi)
+        return i, i < hi and self._ids[i] == id
+
+    def clear(self) -> None:
+        del self._channel_ids[:], self._ids[:], self._release_at[:]
+        if self.names is not None:
+            self.names.clear("prisoner")
+
+    def load(self, rows: Iterable[tuple[int, int, int]]) -> None:
+        '''
+        Replace the prisoners with the (id, channel_id, release_at) rows.
+        The columns are sorted once and built in bulk instead of inserting the rows one by one.
+        '''
+        self.clear()
+        # The first row of a prisoner wins, as with insert
+        unique: dict[tuple[int, int], int] = {}
+        for id, channel_id, release_at in rows:
+            unique.setdefault((channel_id, id), release_at)
+        keys: list[tuple[int, int]] = sorted(unique)
+        self._channel_ids = array("q", [k[0] for k in keys])
+        self._ids = array("q", [k[1] for k in keys])
+        self._release_at = array("q", [unique[k] for k in keys])
+
+    def get(self, id: int, channel_id: int):
+        i, found = self._find(id, channel_id)
+        return self._build(i) if found else None
+
+    def release_at(self, id: int, channel_id: int) -> Optional[int]:
+        i, found = self._find(id, channel_id)
+        return self._release_at[i] if found else None
+
+    def add(self, prisoner) -> bool:
+        '''Return False if the prisoner already exists'''
+        return self.insert(prisoner.id, prisoner.channel_id, prisoner.release_at)
+
+    def insert(self, id: int, channel_id: int, release_at: int) -> bool:
+        '''Add one prisoner from the columns. Return False if the prisoner already exists. Use load for many.'''
+        i, found = self._find(id, channel_id)
+        if found:
+            return False
+        self._channel_ids.insert(i, channel_id)
+        self._ids.insert(i, id)
+        self._release_at.insert(i, release_at)
+        return True
+
+    def remove(self, id: int, channel_id: int):
+        '''Return the removed prisoner or None if it does not exist'''
+        i, found = self._find(id, channel_id)
+        if not found:
+            return None
+        prisoner = self._build(i)
+        del self._channel_ids[i], self._ids[i], self._release_at[i]
+        if self.names is not None:
+            self.names.remove(("prisoner", channel_id), id)
+        return prisoner
+
+    def slice(self, start: int, stop: int) -> list[tuple[int, tuple[int, int]]]:
+        '''The (channel_id, (id, release_at)) of the prisoners from the start to the stop position, grouped by channel'''
+        return list(zip(self._channel_ids[start:stop], zip(self._ids[start:stop], self._release_at[start:stop])))
+
+    def in_channel(self, channel_id: int) -> list:
+        lo, hi = self._run(channel_id)
+        return [self._build(i) for i in range(lo, hi)]
+
+    def ids_in_channel(self, channel_id: int) -> list[int]:
+        lo, hi = self._run(channel_id)
+        return self._ids[lo:hi].tolist()
+
+    def of_user(self, id: int) -> list:
+        '''The prisoners of the user in all the channels. The id column is scanned in C by array.index.'''
+        result: list = []
+        i: int = -1
+        while True:
+            try:
+                i = self._ids.index(id, i + 1)
+            except ValueError:
+                return result
+            result.append(self._build(i))
+
+    def count_in_channel(self, channel_id: int) -> int:
+        lo, hi = self._run(channel_id)
+        return hi - lo
+
+    def channels(self) -> list[int]:
+        result: list[int] = []
+        i: int = 0
+        while i < len(self._channel_ids):
+            result.append(self._channel_ids[i])
+            i = bisect.bisect_right(self._channel_ids, self._channel_ids[i], i)
+        return result
+
+    def time_left_in_channel(self, channel_id: int, now: float) -> list[tuple[int, float]]:
+        '''The (id, seconds until the release) of the prisoners in the channel'''
+        lo, hi = self._run(channel_id)
+        if numpy is not None and hi > lo:
+            left: list[float] = (numpy.frombuffer(self._release_at, dtype=numpy.int64)[lo:hi] - now).tolist()
+        else:
+            left = [t - now for t in self._release_at[lo:hi]]
+        return list(zip(self._ids[lo:hi], left))
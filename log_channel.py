@@ -0,0 +1,175 @@
+'''
+Confined Timeout
+Log channel pipeline
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+import interactions
+
+from .metrics import DISCORD_SECONDS
+from .outbound import OutboundShed
+
+# Discord message limits
+EMBED_DESCRIPTION_LIMIT: int = 4096
+EMBEDS_PER_MESSAGE: int = 10
+MESSAGE_EMBED_CHARACTER_LIMIT: int = 6000
+EMBED_TITLE: str = "Confined Timeout"
+
+class LogPipeline:
+    '''
+    Queue the log messages and pack everything within a short window into as few embeds as possible.
+    The resolved log channel is cached until invalidated.
+    Messages dropped by the send under pressure are put back and packed with the next ones.
+    '''
+    def __init__(
+        self,
+        resolve_channel: Callable[[], Awaitable[Optional[interactions.MessageableMixin]]],
+        window: float = 2.0,
+        send: Optional[Callable[[interactions.MessageableMixin, list[interactions.Embed]], Awaitable[Any]]] = None) -> None:
+        '''
+        resolve_channel: Callable   Coroutine function returning the log channel
+        window: float               Seconds the messages are collected before they are sent
+        send: Callable              (Optional) Coroutine function sending the embeds to the channel
+        '''
+        self.resolve_channel = resolve_channel
+        self.window: float = window
+        self.send_embeds = send if send is not None else self._send_embeds
+        self._queue: list[tuple[str, int, interactions.Timestamp]] = []
+        self._channel: Optional[interactions.MessageableMixin] = None
+        self._resolved: bool = False
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def send(self, message: str, colour: int = 0) -> None:
+        '''Queue a log message without waiting for it to be sent'''
+        self._queue.append((message, colour, interactions.Timestamp.now()))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    def invalidate(self) -> None:
+        '''Resolve the log channel again on the next send'''
+        self._channel = None
+        self._resolved = False
+
+    async def _get_channel(self) -> Optional[interactions.MessageableMixin]:
+        if not self._resolved:
+            self._channel = await self.resolve_channel()
+            self._resolved = True
+        return self._channel
+
+    @staticmethod
+    def pack(entries: list[tuple[str, int, interactions.Timestamp]], counts: Optional[list[int]] = None) -> list[list[interactions.Embed]]:
+        '''
+        Pack the entries into embeds and the embeds into messages.
+        Consecutive entries of the same colour share one embed.
+        counts: list    (Optional) Filled with the number of entries in each message
+        '''
+        messages: list[list[interactions.Embed]] = []
+        embeds: list[interactions.Embed] = []
+        size: int = 0
+        description: str = ""
+        # Entries in the current description and in the current message
+        described: int = 0
+        packed: int = 0
+        current_colour: Optional[int] = None
+        current_time: Optional[interactions.Timestamp] = None
+
+        def close_embed() -> None:
+            nonlocal embeds, size, description, described, packed
+            if not description:
+                return
+            length: int = len(EMBED_TITLE) + len(description)
+            if len(embeds) >= EMBEDS_PER_MESSAGE or size + length > MESSAGE_EMBED_CHARACTER_LIMIT:
+                messages.append(embeds)
+                if counts is not None:
+                    counts.append(packed)
+                embeds, size, packed = [], 0, 0
+            embeds.append(interactions.Embed(
+                title=EMBED_TITLE,
+                description=description,
+                color=current_colour,
+                timestamp=current_time
+            ))
+            size += length
+            description = ""
+            packed += described
+            described = 0
+
+        for message, colour, timestamp in entries:
+            message = message if len(message) <= EMBED_DESCRIPTION_LIMIT else f"{message[:EMBED_DESCRIPTION_LIMIT - 3]}..."
+            if colour != current_colour or len(description) + len(message) + 1 > EMBED_DESCRIPTION_LIMIT:
+                close_embed()
+                current_colour, current_time = colour, timestamp
+            description = message if not description else f"{description}\n{message}"
+            described += 1
+        close_embed()
+        if embeds:
+            messages.append(embeds)
+            if counts is not None:
+                counts.append(packed)
+        return messages
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            # Do not lose the drained entries if the pipeline is closed while sending
+            await asyncio.shield(self._flush())
+
+    async def _flush(self) -> None:
+        entries: list[tuple[str, int, interactions.Timestamp]] = self._queue
+        self._queue = []
+        if not entries:
+            return
+        try:
+            channel: Optional[interactions.MessageableMixin] = await self._get_channel()
+            if channel is None:
+                return
+            counts: list[int] = []
+            sent: int = 0
+            for embeds, count in zip(self.pack(entries, counts), counts):
+                try:
+                    await self.send_embeds(channel, embeds)
+                except OutboundShed:
+                    # Pack the rest with the next batch
+                    self._queue[:0] = entries[sent:]
+                    self._wakeup.set()
+                    return
+                sent += count
+        except Exception as e:
+            # The channel may be deleted or inaccessible, resolve it again next time
+            self.invalidate()
+            print(f"Failed to send the log messages: {e!r}")
+
+    @staticmethod
+    async def _send_embeds(channel: interactions.MessageableMixin, embeds: list[interactions.Embed]) -> None:
+        with DISCORD_SECONDS.time("send"):
+            await channel.send(embeds=embeds)
+
+    async def close(self) -> None:
+        '''Send everything queued and stop the pipeline'''
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self._flush()
@@ -27,32 +27,35 @@ import os
 # aiofiles module is recommended for file operation
 import aiofiles
 import asyncio
+import functools
+import io
 
 import math
+import operator
+import re
+import time
 
 from enum import Enum, unique
 from dataclasses import dataclass
 import datetime
-from typing import Union, cast, Callable, Awaitable, Optional, Self
-
-import sqlalchemy
-from sqlalchemy import select as sqlselect
-from sqlalchemy import delete as sqldelete
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, async_sessionmaker
-import sqlalchemy.dialects.sqlite as sqlite
-
-from .model import GlobalAdminDB, ModeratorDB, PrisonerDB, SettingDB, DBBase
-
-engine: AsyncEngine = create_async_engine(f"sqlite+aiosqlite:///{os.path.dirname(__file__)}/confined_timeout_db.db")
-Session = async_sessionmaker(engine)
-
-@sqlalchemy.event.listens_for(engine.sync_engine, "connect")
-def do_connect(dbapi_connection, connection_record):
-    dbapi_connection.isolation_level = None
-
-@sqlalchemy.event.listens_for(engine.sync_engine, "begin")
-def do_begin(conn):
-    conn.exec_driver_sql("BEGIN")
+from typing import Union, cast, Callable, Awaitable, Iterator, Optional, Self
+
+from .storage import GuildRows, SQLiteStorage, Storage
+from .guild import GuildRegistry, GuildState
+from .history import HistoryEvent, HistoryKind, HistoryRecorder
+from .coordination import Coordinator, guild_shard, release_lease_name
+from .scheduler import HorizonLoader, ReleaseScheduler, release_horizon
+from .log_channel import LogPipeline
+from .pages import LazyPages, Section, StreamSection
+from .resolver import EntityResolver
+from .metrics import COMMAND_SECONDS, metrics, metrics_port
+from .outbound import OutboundScheduler, Priority
+from .overwrites import OverwriteCoalescer
+from .profiler import LoopProfiler, ProfileReport
+from .reconciler import Reconciler
+
+# All the persistence goes through the storage. Replace it before the extension is loaded to use another backend.
+storage: Storage = SQLiteStorage(f"{os.path.dirname(__file__)}/confined_timeout_db.db")
 
 @unique
 class MRCTType(int, Enum):
@@ -63,31 +66,32 @@ class MRCTType(int, Enum):
 class SettingType(int, Enum):
     LOG_CHANNEL = 0
     MINUTE_LIMIT = 1
+    RECOVERY_CONCURRENCY = 2
 
-@dataclass
-class GlobalAdmin:
-    '''Global Admin Data Class'''
-    __slots__ = ('id', 'type')
-    id: int
-    type: int
-
-@dataclass
-class ChannelModerator:
-    '''Channel Moderator Data Class'''
-    __slots__ = ('id', 'type', 'channel_id')
-    id: int
-    type: int
-    channel_id: int
+SETTING_DEFAULTS: dict[SettingType, int] = {
+    SettingType.LOG_CHANNEL: 600,
+    SettingType.MINUTE_LIMIT: 600,
+    SettingType.RECOVERY_CONCURRENCY: 5,
+}
 
 @dataclass
 class Prisoner:
     '''Prinsoner Data Class'''
-    __slots__ = ('id', 'release_datetime', 'channel_id')
+    __slots__ = ('id', 'release_at', 'channel_id', 'guild_id')
     id: int
-    release_datetime: datetime.datetime
+    # UTC epoch seconds
+    release_at: int
     channel_id: int
+    guild_id: int
     def to_tuple(self) -> tuple:
         return (self.id, self.channel_id)
+    def to_key(self) -> tuple:
+        '''The release scheduler key across all guilds'''
+        return (self.guild_id, self.id, self.channel_id)
+    @classmethod
+    def from_columns(cls, guild_id: int, id: int, channel_id: int, release_at: int) -> Self:
+        '''Build the prisoner from the columns of the prisoner store'''
+        return cls(id, release_at, channel_id, guild_id)
 
 @dataclass
 class Config:
@@ -116,41 +120,69 @@ GLOBAL_ADMIN_USER_CUSTOM_ID: str = "retr0init_confined_timeout_GlobalAdmin_user"
 GLOBAL_ADMIN_ROLE_CUSTOM_ID: str = "retr0init_confined_timeout_GlobalAdmin_role"
 CHANNEL_MODERATOR_USER_CUSTOM_ID: str = "retr0init_confined_timeout_ChannelModerator_user"
 CHANNEL_MODERATOR_ROLE_CUSTOM_ID: str = "retr0init_confined_timeout_ChannelModerator_role"
+RELEASE_SELECT_CUSTOM_ID: str = "retr0init_confined_timeout_ReleaseSelect"
+
+# Members listed under a role entry in the view commands
+ROLE_MEMBERS_SHOWN: int = 10
+# Latest events listed by the history commands
+HISTORY_SHOWN: int = 200
+# Seconds before a failed release is tried again, doubled on every failure up to the cap
+RELEASE_RETRY_SECONDS: int = 30
+RELEASE_RETRY_MAX_SECONDS: int = 1800
 TIMEOUT_DIALOG_CUSTOM_ID: str = "retr0init_confined_timeout_TimeoutDialog"
 
-global_admins: list[GlobalAdmin] = []
-channel_moderators: list[ChannelModerator] = []
-prisoners: list[Prisoner] = []
-prisoner_tasks: dict[tuple[int], asyncio.Task] = {}
-global_settings: list[Config] = []
+JAIL_DENY_PERMISSIONS: list[interactions.Permissions] = [
+    interactions.Permissions.SEND_MESSAGES,
+    interactions.Permissions.SEND_MESSAGES_IN_THREADS,
+    interactions.Permissions.SEND_TTS_MESSAGES,
+    interactions.Permissions.SEND_VOICE_MESSAGES,
+    interactions.Permissions.ADD_REACTIONS,
+    interactions.Permissions.ATTACH_FILES,
+    interactions.Permissions.CREATE_INSTANT_INVITE,
+    interactions.Permissions.MENTION_EVERYONE,
+    interactions.Permissions.MANAGE_MESSAGES,
+    interactions.Permissions.MANAGE_THREADS,
+    interactions.Permissions.MANAGE_CHANNELS
+]
+JAIL_DENY_PERMISSIONS_FORUM: list[interactions.Permissions] = [interactions.Permissions.CREATE_POSTS] + JAIL_DENY_PERMISSIONS
+# The denied bits of a jail overwrite recognized by the reconciliation
+JAIL_DENY_MASK: int = int(functools.reduce(operator.or_, JAIL_DENY_PERMISSIONS))
+JAIL_DENY_MASK_FORUM: int = int(functools.reduce(operator.or_, JAIL_DENY_PERMISSIONS_FORUM))
+
+async def load_guild_state(state: GuildState) -> None:
+    '''
+    Read the global admins, channel moderators, prisoners and settings of the guild into its partition
+    '''
+    rows: GuildRows = await storage.load_guild(state.guild_id)
+    for id, type in rows.admins:
+        state.permissions.add_admin(id, type)
+    for id, type, channel_id in rows.moderators:
+        state.permissions.add_moderator(id, type, channel_id)
+    state.prisoners.load(rows.prisoners)
+    for _ in SettingType:
+        Config(_, SETTING_DEFAULTS[_], None).upsert(state.settings)
+    for type, setting, setting1 in rows.settings:
+        Config(type, setting, setting1).upsert(state.settings)
+
+# Global admins, channel moderators, prisoners and settings partitioned by guild
+guilds: GuildRegistry = GuildRegistry(load_guild_state, prisoner_factory=Prisoner.from_columns)
 
 async def my_admin_check(ctx: interactions.BaseContext) -> bool:
     '''
     Check whether the person has the global admin permission to run the command
     '''
-    res: bool = await interactions.is_owner()(ctx)
-    gadmin_user: GlobalAdmin = GlobalAdmin(ctx.author.id, MRCTType.USER)
-    res_user: bool = gadmin_user in global_admins
-    res_role: bool = any(map(lambda x: ctx.author.has_role(x.id) and isinstance(x, GlobalAdmin) if x.type == MRCTType.ROLE else False, global_admins))
-
-    return res or res_user or res_role
+    state: GuildState = await guilds.load(ctx.guild_id)
+    if state.permissions.is_admin(ctx.author):
+        return True
+    return await interactions.is_owner()(ctx)
 
 async def my_channel_moderator_check(ctx: interactions.BaseContext) -> bool:
     '''
     Check whether the member has the channel moderator permission to run the command
     '''
     channel_id: int = ctx.channel.id if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel.id
-    cmod_user: ChannelModerator = ChannelModerator(
-        ctx.author.id,
-        MRCTType.USER,
-        channel_id
-    )
-    res_user: bool = cmod_user in channel_moderators
-    res_role: bool = any(map(
-        lambda x: ctx.author.has_role(x.id) and isinstance(x, ChannelModerator) if x.type == MRCTType.ROLE else False,
-        (_ for _ in channel_moderators if _.channel_id == channel_id)
-    ))
-    return res_user or res_role
+    state: GuildState = await guilds.load(ctx.guild_id)
+    return state.permissions.is_moderator(ctx.author, channel_id)
 
 async def mycheck_or(*check_funcs: Callable[..., Awaitable[bool]]) -> Callable[..., Awaitable[bool]]:
     async def func(ctx: interactions.BaseContext) -> bool:
@@ -182,35 +214,64 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         name="setting",
         description="Settings of the Confined Timeout system"
     )
+    module_group_debug: interactions.SlashCommand = module_base.group(
+        name="debug",
+        description="Diagnostics of the Confined Timeout system"
+    )
     # Record async_start status to prevent duplicated start
     startup_flag: bool = False
-    # asyncio locks
-    lock_db: asyncio.Lock = asyncio.Lock()
 
     ################ Initial functions STARTS ################
 
     def __init__(self, bot):
+        # One heap of release times for the prisoners of all guilds keyed on Prisoner.to_key()
+        self.release_scheduler: ReleaseScheduler = ReleaseScheduler(self.release_prisoners_due)
+        # Only the releases due within the horizon are in the heap, the later ones stay in the storage
+        self.release_window: HorizonLoader = HorizonLoader(self.release_scheduler, self.load_release_window, release_horizon())
+        # The failed attempts of the releases retried with a backoff
+        self.release_retries: dict[tuple[int, int, int], int] = {}
+        # The log pipeline of a guild is closed with its partition
+        guilds.on_evict = self.evict_guild_state
+        # Gateway cache, then TTL/LRU cache, then REST for every entity lookup
+        self.resolver: EntityResolver = EntityResolver(bot)
+        # Processes sharing the storage elect one releaser per set of shards and reload the guilds changed by the others
+        self.coordinator: Optional[Coordinator] = storage.create_coordinator()
+        if self.coordinator is not None:
+            self.coordinator.on_change = self.refresh_changed_guilds
+        # The shards run by this process, read again once the bot is ready
+        self.shard_ids: tuple[int, ...] = (0,)
+        self.total_shards: int = 1
+        self.release_lease: str = release_lease_name(self.shard_ids, self.total_shards)
+        # Enforcement goes before the interaction follow-ups, the announcements and the logs
+        self.outbound: OutboundScheduler = OutboundScheduler(
+            limit=50,
+            low_priority_limit=10,
+            route_limits={"add_permission": 50, "delete_permission": 50, "send": 2})
+        # The overwrite changes of one channel within a short window are applied by one request
+        self.overwrites: OverwriteCoalescer = OverwriteCoalescer(
+            lambda route, label, call: self.outbound.run(Priority.ENFORCEMENT, route, label, call),
+            current=self.current_channel)
+        # The releaser walks the channels and repairs the drift between the prisoners and the overwrites
+        self.reconciler: Reconciler = Reconciler(self.reconcile_keys, self.reconcile_channel)
+        # The jails and the releases are appended to the monthly history tables in batches
+        self.history: HistoryRecorder = HistoryRecorder(storage.add_history, storage.compact_history)
+        # Captures of the debug profile command
+        self.profiler: LoopProfiler = LoopProfiler()
+        self.add_extension_prerun(self.metrics_prerun)
+        self.add_extension_postrun(self.metrics_postrun)
+        if metrics.enabled:
+            self.register_gauges()
         asyncio.create_task(self.async_init())
 
     async def async_init(self) -> None:
-        '''Read all data into local list'''
-        global global_admins
-        global channel_moderators
-        global prisoners
-        async with engine.begin() as conn:
-            await conn.run_sync(DBBase.metadata.create_all)
-        async with Session() as conn:
-            gas = await conn.execute(sqlselect(GlobalAdminDB))
-            cms = await conn.execute(sqlselect(ModeratorDB))
-            ps  = await conn.execute(sqlselect(PrisonerDB))
-            gss = await conn.execute(sqlselect(SettingDB))
-        global_admins = [GlobalAdmin(ga[0].id, ga[0].type) for ga in gas]
-        channel_moderators = [ChannelModerator(cm[0].id, cm[0].type, cm[0].channel_id) for cm in cms]
-        prisoners = [Prisoner(p[0].id, p[0].release_datetime, p[0].channel_id) for p in ps]
-        for _ in SettingType:
-            Config(_, 600, None).upsert(global_settings)
-        for gs in gss:
-            Config(gs[0].type, gs[0].setting, gs[0].setting1).upsert(global_settings)
+        '''Open the storage. The guild partitions are loaded when the guilds are touched.'''
+        await storage.open()
+        port: Optional[int] = metrics_port()
+        if port is not None:
+            try:
+                await metrics.serve(port)
+            except OSError as e:
+                print(f"Failed to serve the metrics on port {port}: {e!r}")
         await self.async_start()
 
     async def async_start(self) -> None:
@@ -218,236 +279,583 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
             return
         self.startup_flag = True
         await self.bot.wait_until_ready()
-        cdt: datetime.datetime = datetime.datetime.now()
-        for p in prisoners:
-            duration_minutes: int = (p.release_datetime.replace(tzinfo=None) - cdt).total_seconds() / 60
-            if duration_minutes <= 0:
-                # Release the prinsoner
-                await self.release_prinsoner(p)
-            else:
-                task = asyncio.create_task(self.release_prisoner_task(duration_minutes=duration_minutes, prisoner=p))
-                prisoner_tasks[p.to_tuple()] = task
-                task.add_done_callback(lambda x:prisoner_tasks.pop(p.to_tuple()))
+        self.read_shards()
+        await self.adopt_legacy_rows()
+        guilds.start()
+        if self.coordinator is None:
+            # Nothing else shares the storage
+            await self.acquire_release_lease(self.release_lease)
+            return
+        # The prisoners are only scheduled by the process holding the release lease of the shards
+        self.coordinator.want(self.release_lease, self.acquire_release_lease, self.lose_release_lease)
+        self.coordinator.start()
+
+    def read_shards(self) -> None:
+        '''
+        The shards run by this process and the total, known once the bot is logged in.
+        An AutoShardedClient runs several shards and has no connection state of its own.
+        '''
+        self.total_shards = max(1, getattr(self.bot, "total_shards", 1))
+        states: Optional[list] = getattr(self.bot, "_connection_states", None)
+        if states:
+            self.shard_ids = tuple(sorted(state.shard_id for state in states))
+        else:
+            state = getattr(self.bot, "_connection_state", None)
+            self.shard_ids = (getattr(state, "shard_id", 0),)
+        self.release_lease = release_lease_name(self.shard_ids, self.total_shards)
+
+    def owns_guild(self, guild_id: int) -> bool:
+        '''Whether the guild is in one of the shards of this process'''
+        return self.total_shards <= 1 or guild_shard(guild_id, self.total_shards) in self.shard_ids
+
+    def is_releaser(self) -> bool:
+        return self.coordinator is None or self.coordinator.holds(self.release_lease)
+
+    async def acquire_release_lease(self, name: str) -> None:
+        '''
+        Schedule the prisoners of the shards and recover the overdue ones in the background,
+        so that the lease keeps being renewed during the recovery
+        '''
+        # Only the release times are read up front, the partitions are loaded once the prisoners are due.
+        # The overdue prisoners and the window of the active ones are range scans of the release time index.
+        now: int = int(time.time())
+        ps: list[tuple[int, int, int, int]] = await storage.load_due(until=now, shards=(self.shard_ids, self.total_shards))
+        overdue: dict[int, dict[int, list[Prisoner]]] = {}
+        for guild_id, id, channel_id, release_at in ps:
+            overdue.setdefault(guild_id, {}).setdefault(channel_id, []).append(Prisoner(id, release_at, channel_id, guild_id))
+        # Schedule the active prisoners first so that the recovery does not delay them
+        await self.release_window.advance(since=now)
+        self.release_scheduler.start()
+        self.release_window.start()
+        self.reconciler.start()
+        self.history.start()
+        if len(overdue) > 0:
+            asyncio.create_task(self.recover_all_overdue(overdue, now))
+
+    async def lose_release_lease(self, name: str) -> None:
+        '''Another process releases the prisoners of the shards now'''
+        print(f"Lost the release lease {name}")
+        self.release_scheduler.stop()
+        self.release_scheduler.clear()
+        self.release_retries.clear()
+        self.release_window.stop()
+        self.release_window.reset()
+        self.reconciler.stop()
+        self.reconciler.reset()
+        self.history.stop()
+
+    async def load_release_window(self, since: int, until: int) -> list[tuple[tuple[int, int, int], int]]:
+        '''The scheduler keys and the release times of the prisoners of the shards due in the window'''
+        ps: list[tuple[int, int, int, int]] = await storage.load_due(since, until, shards=(self.shard_ids, self.total_shards))
+        return [((guild_id, id, channel_id), release_at) for guild_id, id, channel_id, release_at in ps]
+
+    async def refresh_changed_guilds(self, guild_ids: set[int]) -> None:
+        '''
+        The guilds changed by the other processes are evicted and reloaded on the next touch.
+        The releaser also schedules the prisoners jailed by the other processes.
+        '''
+        for guild_id in guild_ids:
+            await guilds.evict(guild_id)
+        if not self.is_releaser():
+            return
+        guild_ids = {gid for gid in guild_ids if self.owns_guild(gid)}
+        if len(guild_ids) == 0:
+            return
+        ps: list[tuple] = await storage.load_prisoners(guild_ids)
+        # Rows released by the others are skipped once due as they are not in the reloaded partition.
+        # The ones beyond the window are loaded with a later page.
+        for guild_id, id, channel_id, release_at in ps:
+            self.release_window.offer((guild_id, id, channel_id), release_at)
+
+    async def recover_all_overdue(self, overdue: dict[int, dict[int, list[Prisoner]]], before: int) -> None:
+        results: list = await asyncio.gather(*(self.recover_guild_overdue(gid, o, before) for gid, o in overdue.items()), return_exceptions=True)
+        for gid, result in zip(overdue, results):
+            if isinstance(result, Exception):
+                print(f"Failed to recover the prisoners in guild {gid}: {result!r}")
+                for ps in overdue[gid].values():
+                    for p in ps:
+                        self.retry_release(p.to_key())
+
+    async def adopt_legacy_rows(self) -> None:
+        '''
+        Assign the rows written before the guild partitioning to their guilds.
+        A bot in one guild takes all of them, otherwise the channel rows are assigned by the guild of the channel.
+        '''
+        channel_ids, admins = await storage.legacy_rows()
+        if len(channel_ids) == 0 and admins == 0:
+            return
+        if len(self.bot.guilds) == 1:
+            await storage.adopt_legacy(self.bot.guilds[0].id)
+            return
+        for channel_id in channel_ids:
+            channel: Optional[interactions.GuildChannel] = await self.resolver.channel(channel_id)
+            if channel is None or not hasattr(channel, "guild"):
+                continue
+            await storage.adopt_legacy(channel.guild.id, channel_id)
+        if admins > 0:
+            print(f"{admins} global admin(s) from before the guild partitioning cannot be assigned to a guild!")
+
+    async def recover_guild_overdue(self, guild_id: int, overdue: dict[int, list[Prisoner]], before: int) -> None:
+        state: GuildState = await guilds.load(guild_id)
+        await self.recover_overdue(state, overdue, before)
     
+    async def recover_overdue(self, state: GuildState, overdue: dict[int, list[Prisoner]], before: int) -> None:
+        '''
+        Release the prisoners of the guild overdue during the downtime.
+        Each channel is resolved once and gets one recovery summary, and all the expired rows are deleted in one statement.
+        '''
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(state.settings[SettingType.RECOVERY_CONCURRENCY].setting)
+        async def recover_channel(channel_id: int, ps: list[Prisoner]) -> list[tuple[Prisoner, str]]:
+            async with semaphore:
+                channel: Optional[interactions.GuildChannel] = await self.resolver.channel(channel_id)
+                if channel is None:
+                    # The channel is deleted so there is no overwrite to remove
+                    for p in ps:
+                        state.prisoners.remove(p.id, p.channel_id)
+                        self.history.record(state.guild_id, HistoryKind.RELEASE, p.id, p.channel_id, reason="Channel deleted")
+                    return []
+                released, failed = await self.release_prisoners_bulk(state, channel, ps, delete_rows=False, reason="Expired during downtime")
+                msg: str = f"Recovered after restart. {self.release_summary(channel, released, failed)}"
+                self.send_log_channel(state, msg, int("00FF00", 16))
+                if len(released) > 0:
+                    self.outbound.submit_nowait(Priority.ANNOUNCEMENT, channel.id, "send", lambda: channel.send(embed=interactions.Embed(
+                        title="Confined Timeout", description=msg[:4096], color=int("00FF00", 16)), silent=True))
+                return failed
+        channel_ids: list[int] = list(overdue)
+        results: list = await asyncio.gather(*(recover_channel(cid, overdue[cid]) for cid in channel_ids), return_exceptions=True)
+        kept: list[tuple[int, int]] = []
+        for cid, result in zip(channel_ids, results):
+            if isinstance(result, Exception):
+                print(f"Failed to recover the prisoners in channel {cid}: {result!r}")
+                kept.extend(p.to_tuple() for p in overdue[cid] if p.to_tuple() in state.prisoners)
+            else:
+                kept.extend(p.to_tuple() for p, _ in result)
+        storage.remove_overdue(state.guild_id, before, kept)
+        # The prisoners left jailed are released by the scheduler later
+        for id, channel_id in kept:
+            self.retry_release((state.guild_id, id, channel_id))
+
     def drop(self):
         asyncio.create_task(self.async_drop())
-        for i, task in prisoner_tasks.items():
-            task.cancel()
-        prisoner_tasks.clear()
+        self.release_scheduler.stop()
+        self.release_scheduler.clear()
+        self.release_retries.clear()
+        self.release_window.stop()
+        self.reconciler.stop()
+        self.history.stop()
+        guilds.stop()
+        if self.coordinator is not None:
+            self.coordinator.stop()
         super().drop()
     
     async def async_drop(self):
         '''
-        Dispose the Database Engine connection
+        Flush the pending writes and close the storage
         '''
-        await engine.dispose()
+        await self.overwrites.drain()
+        await guilds.clear()
+        await self.history.flush()
+        await storage.flush()
+        # Let another process take the shards over without waiting for the lease expiry
+        if self.coordinator is not None:
+            await self.coordinator.close()
+        await storage.close()
+        await metrics.close()
+
+    ################ Metrics ################
+
+    def register_gauges(self) -> None:
+        '''The gauges are only computed when the metrics are collected'''
+        metrics.gauge("confined_timeout_guilds_loaded", "Guild partitions in memory", lambda: len(guilds))
+        metrics.gauge("confined_timeout_prisoners", "Prisoners of the loaded guilds", lambda: sum(len(state.prisoners) for state in guilds))
+        metrics.gauge("confined_timeout_scheduled_releases", "Releases waiting in the scheduler", lambda: len(self.release_scheduler))
+        metrics.gauge("confined_timeout_moderators", "Channel moderators of the loaded guilds", lambda: sum(
+            len(ids) for state in guilds for m in (state.permissions.moderator_users, state.permissions.moderator_roles) for ids in m.values()
+        ))
+        metrics.gauge("confined_timeout_resolver_cache", "Entities in the resolver cache", lambda: len(self.resolver))
+
+    async def metrics_prerun(self, ctx: interactions.BaseContext, *args, **kwargs) -> None:
+        # Only timed while the metrics are enabled or a profile is being captured
+        if metrics.enabled or self.profiler.running:
+            ctx.confined_timeout_started = time.perf_counter()
+
+    async def metrics_postrun(self, ctx: interactions.BaseContext, *args, **kwargs) -> None:
+        '''Handlers that raise never reach the postrun, so only the completed ones are timed'''
+        started: Optional[float] = getattr(ctx, "confined_timeout_started", None)
+        if started is not None:
+            elapsed: float = time.perf_counter() - started
+            name: str = getattr(ctx, "invoke_target", None) or type(ctx).__name__
+            COMMAND_SECONDS.observe(elapsed, name)
+            self.profiler.record_handler(name, elapsed)
 
     ################ Initial functions FINISH ################
     ##########################################################
     ################ Utility functions STARTS ################
 
-    async def update_global_setting(self, confType: SettingType, setting: int, setting1: Optional[str] = None) -> None:
+    async def evict_guild_state(self, state: GuildState) -> None:
+        if state.log_pipeline is not None:
+            await state.log_pipeline.close()
+
+    async def update_global_setting(self, state: GuildState, confType: SettingType, setting: int, setting1: Optional[str] = None) -> None:
         assert isinstance(confType, int)
         assert isinstance(setting, int)
         conf: Config = Config(confType, setting, setting1)
-        conf.upsert(global_settings)
-        to_insert: dict = {"type": confType, "setting": setting}
+        conf.upsert(state.settings)
         if setting1 is not None:
             assert isinstance(setting1, str)
-            to_insert["setting1"] = setting1
-        async with self.lock_db:
-            async with Session() as session:
-                stmt = sqlite.insert(SettingDB).values(
-                    [to_insert]
-                )
-                stmt = stmt.on_conflict_do_update(
-                    index_elements = ['type'],
-                    set_ = dict(
-                        setting = stmt.excluded.setting,
-                        setting1 = stmt.excluded.setting1
-                    )
-                )
-                await session.execute(stmt)
-                await session.commit()
-
-    async def release_prinsoner(self, prisoner: Prisoner, ctx: interactions.BaseContext = None) -> None:
-        if not any(i.id == prisoner.id and i.channel_id == prisoner.channel_id for i in prisoners):
+        await storage.upsert_setting(state.guild_id, confType, setting, setting1)
+
+    async def current_channel(self, channel_id: int) -> Optional[interactions.GuildChannel]:
+        '''The gateway copy of the channel, or a fresh one from the API'''
+        channel: Optional[interactions.GuildChannel] = self.bot.cache.get_channel(channel_id)
+        if channel is None:
+            try:
+                channel = await self.bot.cache.fetch_channel(channel_id, force=True)
+            except interactions.errors.NotFound:
+                return None
+            self.resolver.invalidate(("channel", channel_id))
+        return channel
+
+    async def release_prinsoner(self, state: GuildState, prisoner: Prisoner, ctx: interactions.BaseContext = None, reason: str = "") -> None:
+        if prisoner.to_tuple() not in state.prisoners:
             if ctx is not None:
                 await ctx.send("This member is not prisoned!", ephemeral=True)
             return
-        channel: interactions.GuildChannel = await self.bot.fetch_channel(prisoner.channel_id)
-        user: interactions.User = await self.bot.fetch_user(prisoner.id)
+        channel: Optional[interactions.GuildChannel] = await self.resolver.channel(prisoner.channel_id)
+        # The user may be deleted, then only the id is known
+        user: Optional[interactions.User] = await self.resolver.user(prisoner.id)
+        name: str = user.display_name if user is not None else str(prisoner.id)
+        mention: str = user.mention if user is not None else f"<@{prisoner.id}>"
+        self.reconciler.touch((state.guild_id, prisoner.channel_id))
+        if channel is None:
+            # The channel is deleted along with its overwrites
+            self.prune_prisoners(state, prisoner.channel_id, [prisoner.id], "Channel deleted")
+            return
         try:
-            await channel.delete_permission(user, f"Member {user.display_name}({user.id}) is released from Channel {channel.name} timeout.")
+            await self.overwrites.delete(channel, prisoner.id, f"Member {name}({prisoner.id}) is released from Channel {channel.name} timeout.")
+        except interactions.errors.NotFound:
+            # The overwrite is already removed
+            pass
         except interactions.errors.Forbidden:
             print("The bot needs to have enough permissions!")
             if ctx is not None:
                 await ctx.send("The bot needs to have enough permissions! Please contact technical support!", ephemeral=True)
             return
-        for p in prisoners:
-            if p.id == prisoner.id and p.channel_id == prisoner.channel_id:
-                prisoners.remove(p)
-                break
-        async with self.lock_db:
-            async with Session() as session:
-                await session.execute(
-                    sqldelete(PrisonerDB).
-                    where(sqlalchemy.and_(
-                        PrisonerDB.id == prisoner.id,
-                        PrisonerDB.channel_id == prisoner.channel_id
-                    ))
-                )
-                await session.commit()
+        state.prisoners.remove(prisoner.id, prisoner.channel_id)
+        self.release_scheduler.cancel(prisoner.to_key())
+        storage.remove_prisoner(prisoner.guild_id, prisoner.id, prisoner.channel_id)
+        self.history.record(
+            state.guild_id, HistoryKind.RELEASE, prisoner.id, prisoner.channel_id,
+            moderator_id=ctx.author.id if ctx is not None else 0,
+            reason=reason if len(reason) > 0 or ctx is not None else "Expired")
         if ctx is not None:
-            msg: str = f"The prisoner {ctx.guild.get_member(prisoner.id).mention} is released in {channel.mention}!"
+            msg: str = f"The prisoner {mention} is released in {channel.mention}!"
             await ctx.send(embed=interactions.Embed(
                 title="Confined Timeout", description=msg, color=int("00FF00", 16)))
-            await self.send_log_channel(msg, int("00FF00", 16))
+            self.send_log_channel(state, msg, int("00FF00", 16))
         else:
-            if global_settings[SettingType.LOG_CHANNEL].setting1 is not None:
-                g: interactions.Guild = self.bot.get_guild(int(global_settings[SettingType.LOG_CHANNEL].setting1))
-                msg: str = f"The prisoner {g.get_member(prisoner.id).mention} is released in {channel.mention}!"
-                await self.send_log_channel(msg, int("00FF00", 16))
-                await g.get_channel(prisoner.channel_id).send(
+            if state.settings[SettingType.LOG_CHANNEL].setting1 is not None:
+                msg: str = f"The prisoner {mention} is released in {channel.mention}!"
+                self.send_log_channel(state, msg, int("00FF00", 16))
+                self.outbound.submit_nowait(Priority.ANNOUNCEMENT, channel.id, "send", lambda: channel.send(
                     embed=interactions.Embed(
                         title="Confined Timeout",
                         description=msg,
-                        color=int("00FF00", 16)))
+                        color=int("00FF00", 16))))
 
-    def check_prisoner(self, prisoner_member: interactions.Member, duration_minutes: int, channel: Union[interactions.GuildChannel, interactions.ThreadChannel]) -> tuple[bool, Prisoner]:
+    async def release_prisoners_bulk(self, state: GuildState, channel: interactions.GuildChannel, ps: list[Prisoner], delete_rows: bool = True, moderator_id: int = 0, reason: str = "") -> tuple[list[Prisoner], list[tuple[Prisoner, str]]]:
+        '''
+        Release the prisoners of one channel.
+        The permission overwrites are removed by one channel edit,
+        and the rows are deleted with a single statement unless delete_rows is False.
+        Return the released prisoners and the failed prisoners with the reasons.
+        '''
+        # Cancel all the scheduled releases in one pass
+        for p in ps:
+            self.release_scheduler.cancel(p.to_key())
+        self.reconciler.touch((state.guild_id, channel.id))
+        results: list = await asyncio.gather(*(
+            self.overwrites.delete(channel, p.id, f"Member {p.id} is released from Channel {channel.name} timeout.") for p in ps
+        ), return_exceptions=True)
+        released: list[Prisoner] = []
+        failed: list[tuple[Prisoner, str]] = []
+        for p, result in zip(ps, results):
+            if isinstance(result, interactions.errors.Forbidden):
+                failed.append((p, "The bot needs to have enough permissions!"))
+            elif isinstance(result, Exception) and not isinstance(result, interactions.errors.NotFound):
+                failed.append((p, f"Failed to remove the permission: {result!r}"))
+            else:
+                state.prisoners.remove(p.id, p.channel_id)
+                self.history.record(state.guild_id, HistoryKind.RELEASE, p.id, p.channel_id, moderator_id=moderator_id, reason=reason)
+                released.append(p)
+        if delete_rows and len(released) > 0:
+            if state.prisoners.count_in_channel(channel.id) == 0:
+                storage.remove_prisoners(state.guild_id, channel.id)
+            else:
+                storage.remove_prisoners(state.guild_id, channel.id, [p.id for p in released])
+        return released, failed
+
+    def release_summary(self, channel: interactions.GuildChannel, released: list[Prisoner], failed: list[tuple[Prisoner, str]]) -> str:
+        msg: str = f"{len(released)} prisoner(s) released in {channel.mention}!"
+        msg += "".join(f"\n- <@{p.id}>" for p in released)
+        if len(failed) > 0:
+            msg += f"\n{len(failed)} prisoner(s) failed:"
+            msg += "".join(f"\n- <@{p.id}>: {err}" for p, err in failed)
+        return msg
+
+    def check_prisoner(self, state: GuildState, prisoner_member: interactions.Member, duration_minutes: int, channel: Union[interactions.GuildChannel, interactions.ThreadChannel]) -> tuple[bool, Prisoner]:
         channel_id: int = channel.id if not hasattr(channel, "parent_channel") else channel.parent_channel.id
-        prisoner: Prisoner = Prisoner(prisoner_member.id, datetime.datetime.now() + datetime.timedelta(minutes=duration_minutes), channel_id)
-        cp: list[Prisoner] = [p for p in prisoners if p.id == prisoner.id and p.channel_id == prisoner.channel_id]
-        return len(cp) > 0, prisoner
+        prisoner: Prisoner = Prisoner(prisoner_member.id, math.ceil(time.time()) + duration_minutes * 60, channel_id, state.guild_id)
+        return prisoner.to_tuple() in state.prisoners, prisoner
 
-    async def jail_prisoner(self, prisoner_member: interactions.Member, duration_minutes: int, channel: Union[interactions.GuildChannel, interactions.ThreadChannel], ctx: interactions.SlashContext = None, reason: str = "") -> bool:
+    def check_jail(self, state: GuildState, prisoner_member: interactions.Member, duration_minutes: int, channel: Union[interactions.GuildChannel, interactions.ThreadChannel]) -> tuple[Optional[str], Prisoner]:
+        '''
+        The guards before jailing a member. Return the reason not to jail the member, or None if it can be jailed.
+        '''
         # Do not double jail existing prisoners
-        existed, prisoner = self.check_prisoner(prisoner_member, duration_minutes, channel)
+        existed, prisoner = self.check_prisoner(state, prisoner_member, duration_minutes, channel)
         if existed:
-            if ctx is not None:
-                await ctx.send("The prisoner is already prisoned!", ephemeral=True)
-            return False
+            return "The prisoner is already prisoned!", prisoner
 
         # Do not jail channel moderators themselves
         channel_id: int = channel.id if not hasattr(channel, "parent_channel") else channel.parent_channel.id
-        cmod_user: ChannelModerator = ChannelModerator(
-            prisoner_member.id,
-            MRCTType.USER,
-            channel_id
-        )
-        res_user: bool = cmod_user in channel_moderators
-        res_role: bool = any(map(
-            lambda x: prisoner_member.has_role(x.id) if x.type == MRCTType.ROLE else False,
-            (_ for _ in channel_moderators if _.channel_id == channel_id)
-        ))
-        if res_user or res_role:
-            if ctx is not None:
-                await ctx.send("You cannot jail channel moderator!", ephemeral=True)
-            return False
+        if state.permissions.is_moderator(prisoner_member, channel_id):
+            return "You cannot jail channel moderator!", prisoner
 
         # Do not jail global admin themselves
-        gadmin_user: GlobalAdmin = GlobalAdmin(
-            prisoner_member.id,
-            MRCTType.USER
-        )
-        res_user: bool = gadmin_user in global_admins
-        res_role: bool = any(map(
-            lambda x: prisoner_member.has_role(x.id) if x.type == MRCTType.ROLE else False,
-            global_admins
-        ))
-        if res_user or res_role:
-            if ctx is not None:
-                await ctx.send("You cannot jail global admin!", ephemeral=True)
-            return False
+        if state.permissions.is_admin(prisoner_member):
+            return "You cannot jail global admin!", prisoner
 
         # Test whether the jail duration is above the upper limit
-        minute_limit: int = global_settings[SettingType.MINUTE_LIMIT].setting
+        minute_limit: int = state.settings[SettingType.MINUTE_LIMIT].setting
         if duration_minutes > minute_limit:
+            return f"You cannot jail a member over {minute_limit} minutes!", prisoner
+        return None, prisoner
+
+    async def add_jail_permission(self, prisoner_member: interactions.Member, duration_minutes: int, channel: Union[interactions.GuildChannel, interactions.ThreadChannel], reason: str = "") -> None:
+        '''
+        Deny the member from sending messages in the channel. Raise Forbidden if the bot lacks the permission.
+        '''
+        # Test whether the channel is a ForumPost channel
+        if hasattr(channel, "parent_channel"):
+            # ForumPost, get its parent channel
+            await self.overwrites.deny(channel.parent_channel, prisoner_member.id, JAIL_DENY_MASK_FORUM, reason=f"Member {prisoner_member.display_name}({prisoner_member.id}) timeout for {duration_minutes} minutes in Channel {channel.parent_channel.name} reason:{reason[:50] if len(reason) > 51 else reason}")
+        else:
+            # Normal Text channel
+            await self.overwrites.deny(channel, prisoner_member.id, JAIL_DENY_MASK, reason=f"Member {prisoner_member.display_name}({prisoner_member.id}) timeout for {duration_minutes} minutes in Channel {channel.name} reason:{reason[:50] if len(reason) > 51 else reason}")
+
+    def record_prisoner(self, state: GuildState, prisoner: Prisoner, moderator_id: int = 0, reason: str = "") -> None:
+        '''
+        Store the jailed prisoner, append it to the history and schedule the release
+        '''
+        state.prisoners.add(prisoner)
+        storage.add_prisoner(prisoner.guild_id, prisoner.id, prisoner.channel_id, prisoner.release_at)
+        self.history.record(
+            state.guild_id, HistoryKind.JAIL, prisoner.id, prisoner.channel_id, moderator_id=moderator_id, reason=reason,
+            duration=max(prisoner.release_at - int(time.time()), 0))
+        # Unblock the member once the release time is reached, or leave it to a later page of the release window
+        if self.is_releaser():
+            self.release_window.offer(prisoner.to_key(), prisoner.release_at)
+
+    async def jail_prisoner(self, state: GuildState, prisoner_member: interactions.Member, duration_minutes: int, channel: Union[interactions.GuildChannel, interactions.ThreadChannel], ctx: interactions.SlashContext = None, reason: str = "") -> bool:
+        err, prisoner = self.check_jail(state, prisoner_member, duration_minutes, channel)
+        if err is not None:
             if ctx is not None:
-                await ctx.send(f"You cannot jail a member over {minute_limit} minutes!", ephemeral=True)
+                await ctx.send(err, ephemeral=True)
             return False
 
-        # Test whether the channel is a ForumPost channel
+        self.reconciler.touch((state.guild_id, prisoner.channel_id))
         try:
-            if hasattr(channel, "parent_channel"):
-                # ForumPost, get its parent channel
-                await channel.parent_channel.add_permission(prisoner_member, deny=[
-                    interactions.Permissions.CREATE_POSTS,
-                    interactions.Permissions.SEND_MESSAGES,
-                    interactions.Permissions.SEND_MESSAGES_IN_THREADS,
-                    interactions.Permissions.SEND_TTS_MESSAGES,
-                    interactions.Permissions.SEND_VOICE_MESSAGES,
-                    interactions.Permissions.ADD_REACTIONS,
-                    interactions.Permissions.ATTACH_FILES,
-                    interactions.Permissions.CREATE_INSTANT_INVITE,
-                    interactions.Permissions.MENTION_EVERYONE,
-                    interactions.Permissions.MANAGE_MESSAGES,
-                    interactions.Permissions.MANAGE_THREADS,
-                    interactions.Permissions.MANAGE_CHANNELS
-                ], reason=f"Member {prisoner_member.display_name}({prisoner_member.id}) timeout for {duration_minutes} minutes in Channel {channel.parent_channel.name} reason:{reason[:50] if len(reason) > 51 else reason}")
-            else:
-                # Normal Text channel
-                await channel.add_permission(prisoner_member, deny=[
-                    interactions.Permissions.SEND_MESSAGES,
-                    interactions.Permissions.SEND_MESSAGES_IN_THREADS,
-                    interactions.Permissions.SEND_TTS_MESSAGES,
-                    interactions.Permissions.SEND_VOICE_MESSAGES,
-                    interactions.Permissions.ADD_REACTIONS,
-                    interactions.Permissions.ATTACH_FILES,
-                    interactions.Permissions.CREATE_INSTANT_INVITE,
-                    interactions.Permissions.MENTION_EVERYONE,
-                    interactions.Permissions.MANAGE_MESSAGES,
-                    interactions.Permissions.MANAGE_THREADS,
-                    interactions.Permissions.MANAGE_CHANNELS
-                ], reason=f"Member {prisoner_member.display_name}({prisoner_member.id}) timeout for {duration_minutes} minutes in Channel {channel.name} reason:{reason[:50] if len(reason) > 51 else reason}")
+            await self.add_jail_permission(prisoner_member, duration_minutes, channel, reason)
         except interactions.errors.Forbidden:
             print("The bot needs to have enough permissions!")
             if ctx is not None:
                 await ctx.send("The bot needs to have enough permissions! Please contact technical support!", ephemeral=True)
             return False
-        prisoners.append(prisoner)
-        async with self.lock_db:
-            async with Session() as session:
-                session.add(PrisonerDB(
-                    id = prisoner.id,
-                    channel_id = prisoner.channel_id,
-                    release_datetime = prisoner.release_datetime
-                ))
-                await session.commit()
+        self.record_prisoner(state, prisoner, ctx.author.id if ctx is not None else 0, reason)
         if ctx is not None:
             await ctx.send(f"{prisoner_member.mention} is jailed for {duration_minutes} minutes. Reason: {'None' if len(reason) == 0 else reason[:50]+'...' if len(reason) > 51 else reason}", silent=True)
         else:
-            await channel.send(f"{prisoner_member.mention} is jailed for {duration_minutes} minutes in {channel.mention}. Reason: {'None' if len(reason) == 0 else reason[:50]+'...' if len(reason) > 51 else reason}", silent=True)
-        await self.send_log_channel(f"{prisoner_member.mention} is jailed for {duration_minutes} minutes in {channel.mention}. Reason: {'None' if len(reason) == 0 else reason[:50]+'...' if len(reason) > 51 else reason}", int("FFFF00", 16))
-        # Wait for a certain number of time and unblock the member
-        task = asyncio.create_task(self.release_prisoner_task(duration_minutes=duration_minutes, prisoner=prisoner, ctx=ctx))
-        prisoner_tasks[prisoner.to_tuple()] = task
-        task.add_done_callback(lambda x:prisoner_tasks.pop(prisoner.to_tuple()))
+            self.outbound.submit_nowait(Priority.ANNOUNCEMENT, channel.id, "send", lambda: channel.send(
+                f"{prisoner_member.mention} is jailed for {duration_minutes} minutes in {channel.mention}. Reason: {'None' if len(reason) == 0 else reason[:50]+'...' if len(reason) > 51 else reason}", silent=True))
+        self.send_log_channel(state, f"{prisoner_member.mention} is jailed for {duration_minutes} minutes in {channel.mention}. Reason: {'None' if len(reason) == 0 else reason[:50]+'...' if len(reason) > 51 else reason}", int("FFFF00", 16))
         return True
 
-    async def release_prisoner_task(self, duration_minutes: int, prisoner: Prisoner, ctx: interactions.BaseContext = None) -> None:
-        try:
-            await asyncio.sleep(duration_minutes * 60.0)
-            await self.release_prinsoner(prisoner=prisoner)
-            user: interactions.Member = ctx.guild.get_member(prisoner.id)
-            if ctx is not None:
-                await ctx.channel.send(f"{user.mention} is released!", silent=True)
-        except asyncio.CancelledError:
-            pass
+    async def jail_prisoners_bulk(self, state: GuildState, prisoner_members: list[interactions.Member], duration_minutes: int, channel: Union[interactions.GuildChannel, interactions.ThreadChannel], reason: str = "", moderator_id: int = 0) -> tuple[list[interactions.Member], list[tuple[interactions.Member, str]]]:
+        '''
+        Jail the members with the same guards as jail_prisoner.
+        The permission overwrites are applied by one channel edit, and the rows are written through the batching writer.
+        Return the jailed members and the failed members with the reasons.
+        '''
+        jailed: list[interactions.Member] = []
+        failed: list[tuple[interactions.Member, str]] = []
+        to_jail: list[tuple[interactions.Member, Prisoner]] = []
+        for member in {m.id: m for m in prisoner_members}.values():
+            err, prisoner = self.check_jail(state, member, duration_minutes, channel)
+            if err is not None:
+                failed.append((member, err))
+            else:
+                to_jail.append((member, prisoner))
+        if len(to_jail) > 0:
+            self.reconciler.touch((state.guild_id, to_jail[0][1].channel_id))
+        results: list = await asyncio.gather(*(
+            self.add_jail_permission(m, duration_minutes, channel, reason) for m, _ in to_jail
+        ), return_exceptions=True)
+        for (member, prisoner), result in zip(to_jail, results):
+            if isinstance(result, interactions.errors.Forbidden):
+                failed.append((member, "The bot needs to have enough permissions!"))
+            elif isinstance(result, Exception):
+                failed.append((member, f"Failed to apply the permission: {result!r}"))
+            else:
+                self.record_prisoner(state, prisoner, moderator_id, reason)
+                jailed.append(member)
+        # Wait until the rows are durable. The writer commits every batch_size operations,
+        # so a large bulk timeout may take several commits and is not atomic.
+        await storage.flush()
+        return jailed, failed
+
+    async def release_prisoners_due(self, keys: list[tuple[int, int, int]]) -> None:
+        '''
+        Scheduler callback. Release all the prisoners due in one wake-up.
+        The partitions of the guilds are loaded if they were evicted.
+        '''
+        by_guild: dict[int, list[tuple[int, int]]] = {}
+        for guild_id, id, channel_id in keys:
+            by_guild.setdefault(guild_id, []).append((id, channel_id))
+        states: list = await asyncio.gather(*(guilds.load(gid) for gid in by_guild), return_exceptions=True)
+        ps: list[tuple[GuildState, Prisoner]] = []
+        for gid, state in zip(by_guild, states):
+            if isinstance(state, Exception):
+                print(f"Failed to load guild {gid}: {state!r}")
+                continue
+            ps.extend((state, p) for p in (state.prisoners.get(*key) for key in by_guild[gid]) if p is not None)
+        results: list = await asyncio.gather(*(self.release_prinsoner(state, p) for state, p in ps), return_exceptions=True)
+        for (state, p), r in zip(ps, results):
+            if isinstance(r, Exception):
+                print(f"Failed to release prisoner {p.id} in channel {p.channel_id}: {r!r}")
+            # A release without the permission returns without raising, so check the state
+            if p.to_tuple() in state.prisoners:
+                self.retry_release(p.to_key())
+            else:
+                self.release_retries.pop(p.to_key(), None)
 
-    async def send_log_channel(self, message: str, colour: int = 0) -> None:
-        channel_config: Config = global_settings[SettingType.LOG_CHANNEL]
-        if channel_config.setting1 is None:
+    def retry_release(self, key: tuple[int, int, int]) -> None:
+        '''Schedule a failed release again with an exponential backoff'''
+        attempt: int = self.release_retries.get(key, 0)
+        self.release_retries[key] = attempt + 1
+        # Past releases are not in any window of the loader, so they go to the scheduler directly
+        self.release_scheduler.schedule(key, time.time() + min(RELEASE_RETRY_SECONDS * 2 ** attempt, RELEASE_RETRY_MAX_SECONDS))
+
+    def send_log_channel(self, state: GuildState, message: str, colour: int = 0) -> None:
+        '''
+        Queue the message for the log channel of the guild. It does not wait for the message to be sent.
+        '''
+        if state.settings[SettingType.LOG_CHANNEL].setting1 is None:
             return
-        guild: interactions.Guild = await self.bot.fetch_guild(int(channel_config.setting1))
-        channel: interactions.MessageableMixin = await guild.fetch_channel(channel_config.setting)
-        await channel.send(embed=interactions.Embed(
-            title="Confined Timeout",
-            description=message,
-            color=colour,
-            timestamp=interactions.Timestamp.now()
-        ))
-        pass
+        if state.log_pipeline is None:
+            state.log_pipeline = LogPipeline(lambda: self.resolve_log_channel(state), send=self.send_log_embeds)
+        state.log_pipeline.send(message, colour)
+
+    async def send_log_embeds(self, channel: interactions.MessageableMixin, embeds: list[interactions.Embed]) -> None:
+        await self.outbound.run(Priority.LOG, channel.id, "send", lambda: channel.send(embeds=embeds))
+
+    async def resolve_log_channel(self, state: GuildState) -> Optional[interactions.MessageableMixin]:
+        channel_config: Config = state.settings[SettingType.LOG_CHANNEL]
+        if channel_config.setting1 is None:
+            return None
+        return await self.resolver.channel(channel_config.setting)
+
+    def prune_prisoners(self, state: GuildState, channel_id: int, ids: list[int], reason: str) -> None:
+        '''Forget the prisoners of the channel without touching the overwrites, with one row delete'''
+        for id in ids:
+            state.prisoners.remove(id, channel_id)
+            self.release_scheduler.cancel((state.guild_id, id, channel_id))
+            self.release_retries.pop((state.guild_id, id, channel_id), None)
+            self.history.record(state.guild_id, HistoryKind.RELEASE, id, channel_id, reason=reason)
+        storage.remove_prisoners(state.guild_id, channel_id, ids)
+
+    def reconcile_keys(self) -> Iterator[tuple[int, int]]:
+        '''
+        The (guild_id, channel_id) of a reconciliation cycle: the cached channels of the guilds in the shards,
+        and the channels of the loaded prisoners that are not cached, which may be deleted.
+        The channels of a guild are only read when the cursor reaches the guild.
+        '''
+        guild_ids: list[int] = [guild.id for guild in self.bot.guilds if self.owns_guild(guild.id)]
+        for guild_id in guild_ids:
+            guild: Optional[interactions.Guild] = self.bot.cache.get_guild(guild_id)
+            channel_ids: dict[int, None] = {c.id: None for c in guild.channels if hasattr(c, "permission_overwrites")} if guild is not None else {}
+            state: Optional[GuildState] = guilds.peek(guild_id)
+            if state is not None:
+                channel_ids.update((cid, None) for cid in state.prisoners.channels())
+            for channel_id in channel_ids:
+                yield guild_id, channel_id
+
+    async def reconcile_channel(self, key: tuple[int, int], budget: int) -> tuple[int, bool]:
+        '''
+        Compare the prisoners of the channel with the member overwrites denying the jail permissions.
+        - A prisoner in the guild without the overwrite was released by hand, so the row is pruned.
+        - An overwrite of exactly the jail permissions without a prisoner is left over from a failed jail, so it is removed.
+        - The prisoners of a deleted channel are pruned.
+        The first two are only repaired once they are seen in two cycles in a row.
+        Return the API calls used and whether the channel is done.
+        '''
+        guild_id, channel_id = key
+        if not self.is_releaser():
+            return 0, True
+        state: Optional[GuildState] = guilds.peek(guild_id)
+        used: int = 0
+        channel: Optional[interactions.GuildChannel] = self.bot.cache.get_channel(channel_id)
+        if channel is None:
+            if state is None or state.prisoners.count_in_channel(channel_id) == 0:
+                return 0, True
+            if budget < 1:
+                return 0, False
+            used += 1
+            channel = await self.resolver.channel(channel_id)
+            if channel is None:
+                ids: list[int] = state.prisoners.ids_in_channel(channel_id)
+                self.prune_prisoners(state, channel_id, ids, "Channel deleted")
+                self.send_log_channel(state, f"Reconciliation: {len(ids)} prisoners of the deleted channel {channel_id} are removed", int("FFFF00", 16))
+                return used, True
+        jailed: dict[int, interactions.PermissionOverwrite] = {
+            int(o.id): o for o in channel.permission_overwrites
+            if o.type == interactions.OverwriteType.MEMBER and o.deny is not None and int(o.deny) & JAIL_DENY_MASK == JAIL_DENY_MASK
+        }
+        if state is None:
+            if len(jailed) == 0:
+                return used, True
+            state = await guilds.load(guild_id)
+        stored: set[int] = set(state.prisoners.ids_in_channel(channel_id))
+        # Members not in the cache may have left the guild and are re-jailed when they come back
+        missing: list[int] = [
+            i for i in stored
+            if i not in jailed and self.bot.cache.get_member(guild_id, i) is not None and self.reconciler.confirm(("missing", channel_id, i))
+        ]
+        orphans: list[int] = [
+            i for i, o in jailed.items()
+            if i not in stored and int(o.deny) in (JAIL_DENY_MASK, JAIL_DENY_MASK_FORUM) and not o.allow and self.reconciler.confirm(("orphan", channel_id, i))
+        ]
+        if len(missing) > 0:
+            self.prune_prisoners(state, channel_id, missing, "Overwrite removed by hand")
+            self.send_log_channel(state, f"Reconciliation: {len(missing)} prisoners without the overwrite in <#{channel_id}> are removed", int("FFFF00", 16))
+        removed: int = 0
+        if len(orphans) > 0:
+            if used >= budget:
+                return used, False
+            # The stale overwrites of the channel are removed by one request
+            used += 1
+            results: list = await asyncio.gather(*(
+                self.overwrites.delete(channel, id, f"Member {id} has no timeout record in Channel {channel.name}.") for id in orphans
+            ), return_exceptions=True)
+            for id, result in zip(orphans, results):
+                if isinstance(result, Exception):
+                    # Retried in the next cycle
+                    print(f"Failed to remove the stale overwrite of {id} in channel {channel_id}: {result!r}")
+                else:
+                    removed += 1
+        if removed > 0:
+            self.send_log_channel(state, f"Reconciliation: {removed} stale timeout overwrites in <#{channel_id}> are removed", int("FFFF00", 16))
+        return used, True
 
     ################ Utility functions FINISH ################
 
@@ -460,14 +868,15 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         """
         Re-jail the prisoners who left the guild
         """
-        cdt: datetime.datetime = datetime.datetime.now()
-        cps: list[Prisoner] = [p for p in prisoners if p.id == event.member.id]
+        state: GuildState = await guilds.load(event.guild_id)
+        now: float = time.time()
+        cps: list[Prisoner] = state.prisoners.of_user(event.member.id)
         for cp in cps:
-            duration_minutes: int = (cp.release_datetime.replace(tzinfo=None) - cdt).total_seconds() / 60
+            duration_minutes: int = (cp.release_at - now) / 60
             duration_minutes = math.ceil(duration_minutes) if duration_minutes > 0 else 1
-            channel: interactions.GuildChannel = await event.guild.fetch_channel(cp.channel_id)
-            await self.release_prinsoner(cp)
-            await self.jail_prisoner(event.member, duration_minutes, channel, reason="Re-jail escaped member")
+            channel: interactions.GuildChannel = await self.resolver.channel(cp.channel_id)
+            await self.release_prinsoner(state, cp, reason="Re-jail escaped member")
+            await self.jail_prisoner(state, event.member, duration_minutes, channel, reason="Re-jail escaped member")
 
     ################ Eventsl functions STARTS ################
 
@@ -488,9 +897,30 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         """
         Set the upper limit of timeout duration in minutes
         """
-        await self.update_global_setting(SettingType.MINUTE_LIMIT, minute)
+        state: GuildState = await guilds.load(ctx.guild_id)
+        await self.update_global_setting(state, SettingType.MINUTE_LIMIT, minute)
         await ctx.send(f"Timeout Upper Limit is {minute} minutes!")
-        await self.send_log_channel(f"Timeout Upper Limit is {minute} minutes!")
+        self.send_log_channel(state, f"Timeout Upper Limit is {minute} minutes!")
+
+    @module_group_setting.subcommand("recovery_concurrency", sub_cmd_description="Set the channels recovered at the same time after a restart")
+    @interactions.slash_option(
+        name = "concurrency",
+        description = "The number of channels recovered at the same time",
+        required = True,
+        opt_type = interactions.OptionType.INTEGER,
+        min_value=1,
+        max_value=50
+    )
+    @interactions.check(my_admin_check)
+    async def module_group_setting_setRecoveryConcurrency(self, ctx: interactions.SlashContext, concurrency: int) -> None:
+        """
+        Set the upper limit of channels whose overdue prisoners are released at the same time after a restart.
+        The requests of the other commands are limited by the outbound scheduler.
+        """
+        state: GuildState = await guilds.load(ctx.guild_id)
+        await self.update_global_setting(state, SettingType.RECOVERY_CONCURRENCY, concurrency)
+        await ctx.send(f"Recovery concurrency is {concurrency}!")
+        self.send_log_channel(state, f"Recovery concurrency is {concurrency}!")
 
     @module_group_setting.subcommand("log_channel", sub_cmd_description="Set the channel to output log")
     @interactions.slash_option(
@@ -504,11 +934,14 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         """
         Set the channel to log the moduel actions
         """
+        state: GuildState = await guilds.load(ctx.guild_id)
         if not hasattr(channel, "send"):
             await ctx.send(f"Message cannot be sent in this channel {channel.mention}", ephemeral=True)
-        await self.update_global_setting(SettingType.LOG_CHANNEL, channel.id, str(ctx.guild.id))
+        await self.update_global_setting(state, SettingType.LOG_CHANNEL, channel.id, str(ctx.guild.id))
+        if state.log_pipeline is not None:
+            state.log_pipeline.invalidate()
         await ctx.send(f"Log channel is set to {channel.mention}")
-        await self.send_log_channel(f"Log channel is set to {channel.mention}")
+        self.send_log_channel(state, f"Log channel is set to {channel.mention}")
 
     @module_group_setting.subcommand("set_global_admin", sub_cmd_description="Set the Global Admin")
     @interactions.slash_option(
@@ -527,13 +960,14 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         Pop a User/Role Select Menu ephemeral to choose. It will disappear once selected.
         It will check whether the user or role is capable of the admin
         '''
+        state: GuildState = await guilds.load(ctx.guild_id)
         match set_type:
             case MRCTType.USER:
                 component_user: interactions.UserSelectMenu = interactions.UserSelectMenu(
                     custom_id=GLOBAL_ADMIN_USER_CUSTOM_ID,
                     placeholder="Select the user for global admin",
                     max_values=25,
-                    default_values=[ctx.guild.get_member(_.id) for _ in global_admins if _.type == MRCTType.USER]
+                    default_values=[ctx.guild.get_member(_) for _ in state.permissions.admins(MRCTType.USER)]
                 )
                 await ctx.send("Set the global admin USER:", components=[component_user], ephemeral=True)
             case MRCTType.ROLE:
@@ -541,7 +975,7 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
                     custom_id=GLOBAL_ADMIN_ROLE_CUSTOM_ID,
                     placeholder="Select the role for global admin",
                     max_values=25,
-                    default_values=[ctx.guild.get_role(_.id) for _ in global_admins if _.type == MRCTType.ROLE]
+                    default_values=[ctx.guild.get_role(_) for _ in state.permissions.admins(MRCTType.ROLE)]
                 )
                 await ctx.send("Set the global admin ROLE:", components=[component_role], ephemeral=True)
 
@@ -553,6 +987,7 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         gaType: MRCTType        The type of setting
         """
         if await my_admin_check(ctx):
+            state: GuildState = await guilds.load(ctx.guild_id)
             message: interactions.Message = ctx.message
             if not ga_cm:
                 channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
@@ -567,33 +1002,19 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
                 elif gaType == MRCTType.ROLE:
                     value = cast(interactions.Role, value)
                 if ga_cm:
-                    _to_add: GlobalAdmin = GlobalAdmin(value.id, gaType)
-                    if _to_add not in global_admins:
-                        global_admins.append(_to_add)
-                        async with self.lock_db:
-                            async with Session() as conn:
-                                conn.add(
-                                    GlobalAdminDB(id=_to_add.id, type=_to_add.type)
-                                )
-                                await conn.commit()
+                    if state.permissions.add_admin(value.id, gaType):
+                        storage.add_admin(state.guild_id, value.id, gaType)
                         msg_to_send += f"\n- {value.display_name if gaType == MRCTType.USER else value.name} {value.mention}"
                 else:
-                    _to_add: ChannelModerator = ChannelModerator(value.id, gaType, channel.id)
-                    if _to_add not in channel_moderators:
-                        channel_moderators.append(_to_add)
-                        async with self.lock_db:
-                            async with Session() as conn:
-                                conn.add(
-                                    ModeratorDB(id=_to_add.id, type=_to_add.type, channel_id=_to_add.channel_id)
-                                )
-                                await conn.commit()
+                    if state.permissions.add_moderator(value.id, gaType, channel.id):
+                        storage.add_moderator(state.guild_id, value.id, gaType, channel.id)
                         msg_to_send += f"\n- {value.display_name if gaType == MRCTType.USER else value.name} {value.mention}"
             # Edit the original ephemeral message to hide the select menu
             await ctx.edit_origin(
                 content=f"{'Global Admin' if ga_cm else 'Channel Moderator'} {'user' if gaType == MRCTType.USER else 'role'} set!",
                 components=[])
             # The edit above already acknowledged the context so has to send message to channel directly
-            await self.send_log_channel(msg_to_send, int("0000FF", 16))
+            self.send_log_channel(state, msg_to_send, int("0000FF", 16))
             return
         await ctx.send("You do not have the permission to do so!", ephemeral=True)
         pass
@@ -624,6 +1045,7 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         Pop a User/Role Select Menu ephemeral to choose. It will disappear once selected.
         It will check whether the user or role is capable of the channel moderator
         '''
+        state: GuildState = await guilds.load(ctx.guild_id)
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
         match set_type:
             case MRCTType.USER:
@@ -631,7 +1053,7 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
                     custom_id=CHANNEL_MODERATOR_USER_CUSTOM_ID,
                     placeholder=f"Select the user moderator for {channel.name}",
                     max_values=25,
-                    default_values=[ctx.guild.get_member(_.id) for _ in channel_moderators if _.type == MRCTType.USER and _.channel_id == channel.id]
+                    default_values=[ctx.guild.get_member(_) for _ in state.permissions.moderators(MRCTType.USER, channel.id)]
                 )
                 await ctx.send(f"Set the `{ctx.channel.name}` moderator USER:", components=[component_user], ephemeral=True)
             case MRCTType.ROLE:
@@ -639,7 +1061,7 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
                     custom_id=CHANNEL_MODERATOR_ROLE_CUSTOM_ID,
                     placeholder=f"Select the role moderator for {channel.name}",
                     max_values=25,
-                    default_values=[ctx.guild.get_role(_.id) for _ in channel_moderators if _.type == MRCTType.ROLE and _.channel_id == channel.id]
+                    default_values=[ctx.guild.get_role(_) for _ in state.permissions.moderators(MRCTType.ROLE, channel.id)]
                 )
                 await ctx.send(f"Set the `{ctx.channel.name}` moderator ROLE:", components=[component_role], ephemeral=True)
 
@@ -674,6 +1096,7 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         """
         Remove the global admin user or role
         """
+        state: GuildState = await guilds.load(ctx.guild_id)
         # If there is no parameter provided
         if user is None and role is None:
             await ctx.send("Please select either a user or a role to be removed!", ephemeral=True)
@@ -685,77 +1108,57 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         except ValueError:
             await ctx.send("Input value error! Please contact technical support.", ephemeral=True)
             return
-        async with self.lock_db:
-            async with Session() as session:
-                msg: str = ""
-                if user is not None:
-                    ga: GlobalAdmin = GlobalAdmin(user, MRCTType.USER)
-                    ga_mention: str = ctx.guild.get_member(ga.id).mention
-                    if ga not in global_admins:
-                        await ctx.send(f"{ga_mention} is not a global admin user!", silent=True)
-                        return
-                    msg += f"\n- {ga_mention}"
-                    global_admins.remove(ga)
-                    await session.execute(
-                        sqldelete(GlobalAdminDB).
-                        where(sqlalchemy.and_(
-                            GlobalAdminDB.id == ga.id,
-                            GlobalAdminDB.type == ga.type
-                        ))
-                    )
-                if role is not None:
-                    ga: GlobalAdmin = GlobalAdmin(role, MRCTType.ROLE)
-                    ga_mention: str = ctx.guild.get_role(ga.id).mention
-                    if ga not in global_admins:
-                        await ctx.send(f"{ga_mention} is not a global admin role!", silent=True)
-                        return
-                    msg += f"\n- {ga_mention}"
-                    global_admins.remove(ga)
-                    await session.execute(
-                        sqldelete(GlobalAdminDB).
-                        where(sqlalchemy.and_(
-                            GlobalAdminDB.id == ga.id,
-                            GlobalAdminDB.type == ga.type
-                        ))
-                    )
-                await session.commit()
+        msg: str = ""
+        if user is not None:
+            ga_mention: str = ctx.guild.get_member(user).mention
+            if not state.permissions.remove_admin(user, MRCTType.USER):
+                await ctx.send(f"{ga_mention} is not a global admin user!", silent=True)
+                return
+            msg += f"\n- {ga_mention}"
+            storage.remove_admin(state.guild_id, user, MRCTType.USER)
+        if role is not None:
+            ga_mention: str = ctx.guild.get_role(role).mention
+            if not state.permissions.remove_admin(role, MRCTType.ROLE):
+                await ctx.send(f"{ga_mention} is not a global admin role!", silent=True)
+                return
+            msg += f"\n- {ga_mention}"
+            storage.remove_admin(state.guild_id, role, MRCTType.ROLE)
         # Get user and role objects to get name and mention
         user: Optional[interactions.User] = ctx.guild.get_member(user) if user is not None else None
         role: Optional[interactions.Role] = ctx.guild.get_role(role) if role is not None else None
         await ctx.send(f"Removed global admins:\n{'- '+user.mention if user is not None else ''}\n{'- '+role.mention if role is not None else ''}")
-        await self.send_log_channel(f"Removed global admins:\n{'- '+user.mention if user is not None else ''}\n{'- '+role.mention if role is not None else ''}", int("FF00FF", 16))
+        self.send_log_channel(state, f"Removed global admins:\n{'- '+user.mention if user is not None else ''}\n{'- '+role.mention if role is not None else ''}", int("FF00FF", 16))
     
+    def autocomplete_choices(self, state: GuildState, ctx: interactions.AutocompleteContext, scope: tuple, type: int) -> list[dict[str, str]]:
+        '''
+        Name the entries of the scope not named yet from the gateway cache, and search the name index
+        '''
+        for i in state.names.pending(scope):
+            if type == MRCTType.USER:
+                member: Optional[interactions.Member] = ctx.guild.get_member(i)
+                if member is None:
+                    state.names.name(scope, i, str(i))
+                else:
+                    state.names.name(scope, i, member.display_name, (member.username,))
+            else:
+                role: Optional[interactions.Role] = ctx.guild.get_role(i)
+                state.names.name(scope, i, role.name if role is not None else str(i))
+        return [
+            {
+                "name": name,
+                "value": str(i)
+            } for name, i in state.names.search(scope, ctx.input_text)
+        ]
+
     @module_group_setting_removeGlobalAdmin.autocomplete("user")
     async def autocomplete_removeGlobalAdmin_user(self, ctx: interactions.AutocompleteContext) -> None:
-        option_input: str = ctx.input_text
-        options_user: list[interactions.Member] = [ctx.guild.get_member(i.id) for i in global_admins if i.type == MRCTType.USER]
-        options_auto: list[interactions.Member] = [
-            i for i in options_user if option_input in i.display_name or option_input in i.username
-        ]
-        await ctx.send(
-            choices=[
-                {
-                    "name": i.display_name,
-                    "value": str(i.id)
-                } for i in options_auto
-            ]
-        )
+        state: GuildState = await guilds.load(ctx.guild_id)
+        await ctx.send(choices=self.autocomplete_choices(state, ctx, ("admin", MRCTType.USER), MRCTType.USER))
 
     @module_group_setting_removeGlobalAdmin.autocomplete("role")
     async def autocomplete_removeGlobalAdmin_role(self, ctx: interactions.AutocompleteContext) -> None:
-        option_input: str = ctx.input_text
-        options_role: list[interactions.Role] = [ctx.guild.get_role(i.id) for i in global_admins if i.type == MRCTType.ROLE]
-        options_auto: list[interactions.Role] = [
-            i for i in options_role if option_input in i.name
-        ]
-        await ctx.send(
-            choices=[
-                {
-                    "name": i.name,
-                    "value": str(i.id)
-                } for i in options_auto
-            ]
-        )
+        state: GuildState = await guilds.load(ctx.guild_id)
+        await ctx.send(choices=self.autocomplete_choices(state, ctx, ("admin", MRCTType.ROLE), MRCTType.ROLE))
     
     @module_group_setting.subcommand("remove_channel_mod", sub_cmd_description="Remove the Channel Moderator")
     @interactions.slash_option(
@@ -780,6 +1183,7 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         """
         Remove the moderator of current channel
         """
+        state: GuildState = await guilds.load(ctx.guild_id)
         # If there is no parameter provided
         if user is None and role is None:
             await ctx.send("Please select either a user or a role to be removed!", ephemeral=True)
@@ -792,168 +1196,232 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
             await ctx.send("Input value error! Please contact technical support.", ephemeral=True)
             return
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
-        async with self.lock_db:
-            async with Session() as session:
-                msg: str = ""
-                if user is not None:
-                    cm: ChannelModerator = ChannelModerator(user, MRCTType.USER, channel.id)
-                    cm_mention: str = ctx.guild.get_member(cm.id).mention
-                    if cm not in channel_moderators:
-                        await ctx.send(f"{cm_mention} is not the moderator user of this channel {channel.mention}!", silent=True)
-                        return
-                    msg += f"\n- {cm_mention}"
-                    channel_moderators.remove(cm)
-                    await session.execute(
-                        sqldelete(ModeratorDB).
-                        where(sqlalchemy.and_(
-                            ModeratorDB.id == cm.id,
-                            ModeratorDB.type == cm.type,
-                            ModeratorDB.channel_id == cm.channel_id
-                        ))
-                    )
-                if role is not None:
-                    cm: ChannelModerator = ChannelModerator(role, MRCTType.ROLE, channel.id)
-                    cm_mention: str = ctx.guild.get_role(cm.id).mention
-                    if cm not in channel_moderators:
-                        await ctx.send(f"{cm_mention} is not the moderator role of this channel {channel.mention}!", silent=True)
-                        return
-                    msg += f"\n- {cm_mention}"
-                    channel_moderators.remove(cm)
-                    await session.execute(
-                        sqldelete(ModeratorDB).
-                        where(sqlalchemy.and_(
-                            ModeratorDB.id == cm.id,
-                            ModeratorDB.type == cm.type,
-                            ModeratorDB.channel_id == cm.channel_id
-                        ))
-                    )
-                await session.commit()
+        msg: str = ""
+        if user is not None:
+            cm_mention: str = ctx.guild.get_member(user).mention
+            if not state.permissions.remove_moderator(user, MRCTType.USER, channel.id):
+                await ctx.send(f"{cm_mention} is not the moderator user of this channel {channel.mention}!", silent=True)
+                return
+            msg += f"\n- {cm_mention}"
+            storage.remove_moderator(state.guild_id, user, MRCTType.USER, channel.id)
+        if role is not None:
+            cm_mention: str = ctx.guild.get_role(role).mention
+            if not state.permissions.remove_moderator(role, MRCTType.ROLE, channel.id):
+                await ctx.send(f"{cm_mention} is not the moderator role of this channel {channel.mention}!", silent=True)
+                return
+            msg += f"\n- {cm_mention}"
+            storage.remove_moderator(state.guild_id, role, MRCTType.ROLE, channel.id)
         # Get user and role objects to get name and mention
         user: Optional[interactions.User] = ctx.guild.get_member(user) if user is not None else None
         role: Optional[interactions.Role] = ctx.guild.get_role(role) if role is not None else None
         await ctx.send(f"Removed channel moderator in {channel.mention}:\n{'- '+user.mention if user is not None else ''}\n{'- '+role.mention if role is not None else ''}")
-        await self.send_log_channel(f"Removed channel moderator in {channel.mention}:\n{'- '+user.mention if user is not None else ''}\n{'- '+role.mention if role is not None else ''}", int("FF00FF", 16))
+        self.send_log_channel(state, f"Removed channel moderator in {channel.mention}:\n{'- '+user.mention if user is not None else ''}\n{'- '+role.mention if role is not None else ''}", int("FF00FF", 16))
 
     @module_group_setting_removeChannelModerator.autocomplete("user")
     async def autocomplete_removeChannelModerator_user(self, ctx: interactions.AutocompleteContext) -> None:
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
-        option_input: str = ctx.input_text
-        options_user: list[interactions.Member] = [ctx.guild.get_member(i.id) for i in channel_moderators if i.type == MRCTType.USER and i.channel_id == channel.id]
-        options_auto: list[interactions.Member] = [
-            i for i in options_user if option_input in i.display_name or option_input in i.username
-        ]
-        await ctx.send(
-            choices=[
-                {
-                    "name": i.display_name,
-                    "value": str(i.id)
-                } for i in options_auto
-            ]
-        )
+        state: GuildState = await guilds.load(ctx.guild_id)
+        await ctx.send(choices=self.autocomplete_choices(state, ctx, ("moderator", MRCTType.USER, channel.id), MRCTType.USER))
 
     @module_group_setting_removeChannelModerator.autocomplete("role")
     async def autocomplete_removeChannelModerator_role(self, ctx: interactions.AutocompleteContext) -> None:
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
-        option_input: str = ctx.input_text
-        options_role: list[interactions.Role] = [ctx.guild.get_role(i.id) for i in channel_moderators if i.type == MRCTType.ROLE and i.channel_id == channel.id]
-        options_auto: list[interactions.Role] = [
-            i for i in options_role if option_input in i.name
-        ]
-        await ctx.send(
-            choices=[
-                {
-                    "name": i.name,
-                    "value": str(i.id)
-                } for i in options_auto
-            ]
-        )
+        state: GuildState = await guilds.load(ctx.guild_id)
+        await ctx.send(choices=self.autocomplete_choices(state, ctx, ("moderator", MRCTType.ROLE, channel.id), MRCTType.ROLE))
     
+    def render_permission_entry(self, guild: interactions.Guild, entry: tuple[int, int]) -> str:
+        '''
+        Render a global admin or channel moderator entry of (id, type) from the gateway cache
+        '''
+        id, type = entry
+        if type == MRCTType.USER:
+            return f"- User: <@{id}>"
+        msg: str = f"- Role: <@&{id}>"
+        role: Optional[interactions.Role] = guild.get_role(id)
+        if role is not None:
+            members: list[interactions.Member] = role.members
+            msg += "".join(f"\n  - User: {u.mention}" for u in members[:ROLE_MEMBERS_SHOWN])
+            if len(members) > ROLE_MEMBERS_SHOWN:
+                msg += f"\n  - ... and {len(members) - ROLE_MEMBERS_SHOWN} more"
+        return msg
+
+    @staticmethod
+    def render_prisoner_entry(entry: tuple[int, float]) -> str:
+        '''The entry is the prisoner id and the seconds left'''
+        return f"- <@{entry[0]}> `{entry[1] / 60:.2f} minutes left`"
+
+    @staticmethod
+    def render_history_entry(event: HistoryEvent) -> str:
+        at, _, kind, user_id, channel_id, moderator_id, duration, reason = event
+        msg: str = f"- <t:{at}:f> {'Jailed' if kind == HistoryKind.JAIL else 'Released'} <@{user_id}> in <#{channel_id}> "
+        msg += f"by <@{moderator_id}>" if moderator_id != 0 else "automatically"
+        if kind == HistoryKind.JAIL:
+            msg += f" for `{math.ceil(duration / 60)} minutes`"
+        if len(reason) > 0:
+            msg += f". Reason: {reason[:50]+'...' if len(reason) > 51 else reason}"
+        return msg
+
+    async def history_sections(self, guild_id: int, user_id: Optional[int] = None, channel_id: Optional[int] = None) -> list[Section]:
+        '''The latest events, then the totals of the months past the retention'''
+        # The buffered events are written first so the view includes them
+        await self.history.flush()
+        events: list[HistoryEvent] = await storage.load_history(guild_id, user_id, channel_id, HISTORY_SHOWN)
+        jails, releases, jailed_seconds = await storage.history_summary(guild_id, user_id, channel_id)
+        scope: str = "".join([f" of <@{user_id}>" if user_id is not None else "", f" in <#{channel_id}>" if channel_id is not None else ""])
+        sections: list[Section] = [Section(f"History{scope}:", events, self.render_history_entry, empty="No history")]
+        if jails > 0 or releases > 0:
+            sections.append(Section(
+                "Older history:",
+                [f"{jails} jail(s) for `{math.ceil(jailed_seconds / 60)} minutes` in total and {releases} release(s)"]))
+        return sections
+
+    def admin_section(self, state: GuildState, guild: interactions.Guild) -> Section:
+        users: set[int] = state.permissions.admins(MRCTType.USER)
+        roles: set[int] = state.permissions.admins(MRCTType.ROLE)
+        return Section(
+            "Global Admins:",
+            lambda: [(i, MRCTType.USER) for i in users] + [(i, MRCTType.ROLE) for i in roles],
+            lambda e: self.render_permission_entry(guild, e),
+            count=len(users) + len(roles)
+        )
+
+    def moderator_section(self, state: GuildState, guild: interactions.Guild, channel_id: int) -> Section:
+        users: set[int] = state.permissions.moderators(MRCTType.USER, channel_id)
+        roles: set[int] = state.permissions.moderators(MRCTType.ROLE, channel_id)
+        return Section(
+            f"Moderators in <#{channel_id}>:",
+            lambda: [(i, MRCTType.USER) for i in users] + [(i, MRCTType.ROLE) for i in roles],
+            lambda e: self.render_permission_entry(guild, e),
+            count=len(users) + len(roles)
+        )
+
+    def prisoner_section(self, state: GuildState, channel_id: int) -> Section:
+        return Section(
+            f"Prisoners in <#{channel_id}>:",
+            lambda: state.prisoners.time_left_in_channel(channel_id, time.time()),
+            self.render_prisoner_entry,
+            empty=f"No prisoners in <#{channel_id}>",
+            count=state.prisoners.count_in_channel(channel_id)
+        )
+
+    def summary_streams(self, state: GuildState, guild: interactions.Guild) -> list[StreamSection]:
+        '''
+        The moderators and the prisoners of all the channels. A page only reads the entries it shows.
+        The channels missing from the gateway cache are deleted and skipped until the reconciler prunes them.
+        '''
+        exists: Callable[[int], bool] = lambda cid: self.bot.cache.get_channel(cid) is not None
+        streams: list[StreamSection] = []
+        if state.permissions.moderator_count > 0:
+            streams.append(StreamSection(
+                state.permissions.moderator_count,
+                state.permissions.moderator_slice,
+                lambda cid: f"Moderators in <#{cid}>:",
+                lambda e: self.render_permission_entry(guild, e),
+                keep=exists
+            ))
+        if len(state.prisoners) > 0:
+            streams.append(StreamSection(
+                len(state.prisoners),
+                state.prisoners.slice,
+                lambda cid: f"Prisoners in <#{cid}>:",
+                lambda e: self.render_prisoner_entry((e[0], e[1] - time.time())),
+                keep=exists
+            ))
+        return streams
+
+    @module_group_debug.subcommand("profile", sub_cmd_description="Sample the event loop and attach the collapsed stacks")
+    @interactions.slash_option(
+        name = "seconds",
+        description = "The length of the capture",
+        required = True,
+        opt_type = interactions.OptionType.INTEGER,
+        min_value=1,
+        max_value=120
+    )
+    @interactions.check(my_admin_check)
+    async def module_group_debug_profile(self, ctx: interactions.SlashContext, seconds: int) -> None:
+        """
+        Capture a sampling profile of the event loop with the loop lag, the live tasks and the handler times
+        """
+        if self.profiler.running:
+            await ctx.send("A profile is already being captured!", ephemeral=True)
+            return
+        # The capture outlasts the interaction response deadline
+        await ctx.defer(ephemeral=True)
+        releases_start: int = len(self.release_scheduler)
+        report: ProfileReport = await self.profiler.capture(seconds)
+        lines: list[str] = report.summary()
+        lines.insert(3 if report.lags else 2, f"Scheduled releases: {releases_start} at start, {len(self.release_scheduler)} at end")
+        file: interactions.File = interactions.File(
+            io.BytesIO(report.collapsed().encode()),
+            file_name=f"confined_timeout_profile_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.collapsed")
+        await ctx.send("\n".join(lines)[:2000], file=file, ephemeral=True)
+
     @module_group_setting.subcommand("view_global_admin", sub_cmd_description="View all Global Admins")
     async def module_group_setting_viewGlobalAdmin(self, ctx: interactions.SlashContext) -> None:
-        msg: str = ""
-        for i in global_admins:
-            if i.type == MRCTType.USER:
-                msg += f"- User: {ctx.guild.get_member(i.id).mention}\n"
-            elif i.type == MRCTType.ROLE:
-                role: interactions.Role = await ctx.guild.fetch_role(i.id)
-                msg += f"- Role: {role.mention}\n"
-                for u in role.members:
-                    msg += f"  - User: {u.mention}\n"
-        pag: Paginator = Paginator.create_from_string(self.bot, f"Global Admin for Confined Timeout:\n{msg}", page_size=1000)
+        state: GuildState = await guilds.load(ctx.guild_id)
+        pages: LazyPages = LazyPages([self.admin_section(state, ctx.guild)], title="Global Admin for Confined Timeout")
+        pag: Paginator = Paginator(self.bot, pages=pages)
         await pag.send(ctx)
     
     @module_group_setting.subcommand("view_channel_mod", sub_cmd_description="View Moderators of this channel")
     async def module_group_setting_viewChannelModerator(self, ctx: interactions.SlashContext) -> None:
+        state: GuildState = await guilds.load(ctx.guild_id)
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
-        msg: str = ""
-        for i in channel_moderators:
-            if i.channel_id != channel.id:
-                continue
-            if i.type == MRCTType.USER:
-                msg += f"- User: {ctx.guild.get_member(i.id).mention}\n"
-            elif i.type == MRCTType.ROLE:
-                role: interactions.Role = await ctx.guild.fetch_role(i.id)
-                msg += f"- Role: {role.mention}\n"
-                for u in role.members:
-                    msg += f"  - User: {u.mention}\n"
-        pag: Paginator = Paginator.create_from_string(self.bot, f"Moderators in {channel.mention} for Confined Timeout:\n{msg}", page_size=1000)
+        pages: LazyPages = LazyPages([self.moderator_section(state, ctx.guild, channel.id)], title="Moderators for Confined Timeout")
+        pag: Paginator = Paginator(self.bot, pages=pages)
         await pag.send(ctx)
 
     @module_base.subcommand("view_prisoners", sub_cmd_description="View Prisoners in this channel")
     async def module_base_view_prisoner(self, ctx: interactions.SlashContext) -> None:
-        pass
+        state: GuildState = await guilds.load(ctx.guild_id)
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
-        ps_in_channel: list[Prisoner] = [i for i in prisoners if i.channel_id == channel.id]
-        msg: str = f"Prisoners in {channel.mention}:\n" if len(ps_in_channel) > 0 else f"No prisoners in {channel.mention}"
-        for i in ps_in_channel:
-            timeleft: datetime.timedelta = i.release_datetime.replace(tzinfo=None) - datetime.datetime.now()
-            msg += f"- {ctx.guild.get_member(i.id).mention} `{timeleft.total_seconds() / 60:.2f} minutes left`\n"
-        pag: Paginator = Paginator.create_from_string(self.bot, msg, page_size=2000, timeout=10)
+        pages: LazyPages = LazyPages([self.prisoner_section(state, channel.id)], title="Prisoners for Confined Timeout")
+        pag: Paginator = Paginator(self.bot, pages=pages, timeout_interval=10)
+        await pag.send(ctx)
+
+    @module_base.subcommand("history", sub_cmd_description="View the timeout history of this channel")
+    @interactions.slash_option(
+        name = "user",
+        description = "Only the history of the user",
+        required = False,
+        opt_type = interactions.OptionType.USER
+    )
+    @interactions.check(my_channel_moderator_check)
+    async def module_base_history(self, ctx: interactions.SlashContext, user: Optional[interactions.User] = None) -> None:
+        channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
+        await ctx.defer()
+        sections: list[Section] = await self.history_sections(ctx.guild_id, user.id if user is not None else None, channel.id)
+        pag: Paginator = Paginator(self.bot, pages=LazyPages(sections, title="History for Confined Timeout"), timeout_interval=10)
+        await pag.send(ctx)
+
+    @module_group_setting.subcommand("user_history", sub_cmd_description="View the timeout history of a member in all channels")
+    @interactions.slash_option(
+        name = "user",
+        description = "The member to view",
+        required = True,
+        opt_type = interactions.OptionType.USER
+    )
+    @interactions.check(my_admin_check)
+    async def module_group_setting_user_history(self, ctx: interactions.SlashContext, user: interactions.User) -> None:
+        await ctx.defer()
+        sections: list[Section] = await self.history_sections(ctx.guild_id, user.id)
+        pag: Paginator = Paginator(self.bot, pages=LazyPages(sections, title="History for Confined Timeout"), timeout_interval=10)
         await pag.send(ctx)
 
     @module_group_setting.subcommand("summary", sub_cmd_description="View summary")
     async def module_group_setting_viewSummary(self, ctx: interactions.SlashContext) -> None:
-        channel_config: Config = global_settings[SettingType.LOG_CHANNEL]
-        minute_config: Config = global_settings[SettingType.MINUTE_LIMIT]
-        config_msg: str = "Log channel is "
-        config_msg += "not set!" if str(ctx.guild.id) != channel_config.setting1 else ctx.guild.get_channel(int(channel_config.setting)).mention
-        config_msg += f"\nTimeout Limit is `{minute_config.setting} minutes`\n"
-        msg: str = config_msg + "\nGlobal Admins:\n"
-        for i in global_admins:
-            if i.type == MRCTType.USER:
-                msg += f"- User: {ctx.guild.get_member(i.id).mention}\n"
-            elif i.type == MRCTType.ROLE:
-                role: interactions.Role = await ctx.guild.fetch_role(i.id)
-                msg += f"- Role: {role.mention}\n"
-                for u in role.members:
-                    msg += f"  - User: {u.mention}\n"
-        cms: dict[int, list[ChannelModerator]] = {i.channel_id: [] for i in channel_moderators}
-        for i in channel_moderators:
-            cms[i.channel_id].append(i)
-        for cid, cmls in cms.items():
-            if ctx.guild.get_channel(cid) is None:
-                continue
-            msg += f"\nModerator in {ctx.guild.get_channel(cid).mention}:\n"
-            for i in cmls:
-                if i.type == MRCTType.USER:
-                    msg += f"- User: {ctx.guild.get_member(i.id).mention}\n"
-                elif i.type == MRCTType.ROLE:
-                    role: interactions.Role = await ctx.guild.fetch_role(i.id)
-                    msg += f"- Role: {role.mention}\n"
-                    for u in role.members:
-                        msg += f"  - User: {u.mention}\n"
-        ps: dict[int, list[Prisoner]] = {i.channel_id: [] for i in prisoners}
-        for i in prisoners:
-            ps[i.channel_id].append(i)
-        for cid, pls in ps.items():
-            if ctx.guild.get_channel(cid) is None:
-                continue
-            msg += f"\nPrisoners in {ctx.guild.get_channel(cid).mention}:\n"
-            for i in pls:
-                timeleft: datetime.timedelta = i.release_datetime.replace(tzinfo=None) - datetime.datetime.now()
-                timestring: str = f"{timeleft.total_seconds() / 60:.2f} minutes"
-                msg += f"- {ctx.guild.get_member(i.id).mention} `{timestring} left`\n"
-        pag: Paginator = Paginator.create_from_string(self.bot, f"Summary for Confined Timeout:\n\n{msg}", page_size=1000)
+        state: GuildState = await guilds.load(ctx.guild_id)
+        channel_config: Config = state.settings[SettingType.LOG_CHANNEL]
+        minute_config: Config = state.settings[SettingType.MINUTE_LIMIT]
+        config_msg: list[str] = [
+            "Log channel is " + ("not set!" if str(ctx.guild.id) != channel_config.setting1 else f"<#{channel_config.setting}>"),
+            f"Timeout Limit is `{minute_config.setting} minutes`",
+            f"Recovery concurrency is `{state.settings[SettingType.RECOVERY_CONCURRENCY].setting}`"
+        ]
+        sections: list[Union[Section, StreamSection]] = [Section("Settings:", config_msg), self.admin_section(state, ctx.guild)]
+        sections.extend(self.summary_streams(state, ctx.guild))
+        pag: Paginator = Paginator(self.bot, pages=LazyPages(sections, title="Summary for Confined Timeout"))
         await pag.send(ctx)
     
     @module_base.subcommand("timeout", sub_cmd_description="Timeout a member in this channel")
@@ -971,8 +1439,61 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
     )
     @interactions.check(my_channel_moderator_check)
     async def module_base_timeout(self, ctx: interactions.SlashContext, user: interactions.User, minutes: int) -> None:
+        state: GuildState = await guilds.load(ctx.guild_id)
+        channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
+        success: bool = await self.jail_prisoner(state, user, minutes, channel, ctx=ctx)
+
+    @module_base.subcommand("bulk_timeout", sub_cmd_description="Timeout multiple members in this channel")
+    @interactions.slash_option(
+        "users",
+        description="The users to timeout. Mentions or IDs separated by spaces",
+        required=True,
+        opt_type=interactions.OptionType.STRING
+    )
+    @interactions.slash_option(
+        "minutes",
+        description = "The minutes to timeout",
+        required = True,
+        opt_type=interactions.OptionType.INTEGER
+    )
+    @interactions.slash_option(
+        "reason",
+        description = "The reason of the timeout",
+        required = False,
+        opt_type=interactions.OptionType.STRING
+    )
+    @interactions.check(my_channel_moderator_check)
+    async def module_base_bulk_timeout(self, ctx: interactions.SlashContext, users: str, minutes: int, reason: str = "") -> None:
+        state: GuildState = await guilds.load(ctx.guild_id)
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
-        success: bool = await self.jail_prisoner(user, minutes, channel, ctx=ctx)
+        user_ids: list[int] = list(dict.fromkeys(int(i) for i in re.findall(r"\d{15,20}", users)))
+        if len(user_ids) == 0:
+            await ctx.send("Please provide the members to timeout!", ephemeral=True)
+            return
+        await ctx.defer()
+        members: list[interactions.Member] = []
+        failed: list[tuple[Union[interactions.Member, int], str]] = []
+        # Resolve the members concurrently, the cache misses are fetched in parallel
+        results: list = await asyncio.gather(*(self.resolver.member(ctx.guild.id, user_id) for user_id in user_ids), return_exceptions=True)
+        for user_id, member in zip(user_ids, results):
+            if isinstance(member, Exception):
+                failed.append((user_id, f"Failed to fetch the member: {member!r}"))
+            elif member is None:
+                failed.append((user_id, "Not a member of this server!"))
+            else:
+                members.append(member)
+        jailed, bulk_failed = await self.jail_prisoners_bulk(state, members, minutes, channel, reason, ctx.author.id)
+        failed.extend(bulk_failed)
+        reason_str: str = 'None' if len(reason) == 0 else reason[:50]+'...' if len(reason) > 51 else reason
+        msg: str = f"{len(jailed)} member(s) jailed for {minutes} minutes in {channel.mention}. Reason: {reason_str}"
+        msg += "".join(f"\n- {m.mention}" for m in jailed)
+        if len(jailed) > 0:
+            self.send_log_channel(state, msg, int("FFFF00", 16))
+        if len(failed) > 0:
+            msg += f"\n{len(failed)} member(s) failed:"
+            msg += "".join(f"\n- {f'<@{m}>' if isinstance(m, int) else m.mention}: {err}" for m, err in failed)
+        pag: Paginator = Paginator.create_from_string(self.bot, msg, page_size=1000)
+        await pag.send(ctx)
     
     async def cmd_timeout(self, ctx: interactions.ContextMenuContext, is_msg: bool):
         """
@@ -999,7 +1520,8 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         except ValueError:
             await modal_ctx.send("The input is not integer!", ephemeral=True)
             return
-        success: bool = await self.jail_prisoner(user, minutes, channel, ctx=modal_ctx, reason=msg.content if is_msg else "")
+        state: GuildState = await guilds.load(ctx.guild_id)
+        success: bool = await self.jail_prisoner(state, user, minutes, channel, ctx=modal_ctx, reason=msg.content if is_msg else "")
 
     @interactions.user_context_menu("Confined Timeout User")
     @interactions.check(my_channel_moderator_check)
@@ -1022,19 +1544,22 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
         is_cmd: bool                                    Whether this is used in command or context menu
         user: Optional[int]                             (Optional) The user id
         """
+        state: GuildState = await guilds.load(ctx.guild_id)
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
         if is_cmd:
             assert user is not None
-            user: interactions.Member = await ctx.guild.fetch_member(user)
+            user_id: int = user
+            user: interactions.Member = await self.resolver.member(ctx.guild.id, user_id)
+            if user is None:
+                await ctx.send(f"The member <@{user_id}> is not in this server!", ephemeral=True)
+                return
         else:
             user: interactions.Member = ctx.target
-        prisoned, prisoner = self.check_prisoner(user, 1, channel)
+        prisoned, prisoner = self.check_prisoner(state, user, 1, channel)
         if not prisoned:
             await ctx.send(f"The member {user.mention} is not prisoned!")
             return
-        await self.release_prinsoner(prisoner=prisoner, ctx=ctx)
-        if prisoner.to_tuple() in prisoner_tasks:
-            prisoner_tasks[prisoner.to_tuple()].cancel()
+        await self.release_prinsoner(state, prisoner=prisoner, ctx=ctx)
 
     @module_base.subcommand("release", sub_cmd_description="Revoke a member timeout in this channel")
     @interactions.slash_option(
@@ -1057,20 +1582,67 @@ class ModuleRetr0initConfinedTimeout(interactions.Extension):
     @module_base_release.autocomplete("user")
     async def autocomplete_release_user(self, ctx: interactions.AutocompleteContext) -> None:
         channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
-        option_input: str = ctx.input_text
-        options_user: list[interactions.Member] = [ctx.guild.get_member(i.id) for i in prisoners if i.channel_id == channel.id]
-        options_auto: list[interactions.Member] = [
-            i for i in options_user if option_input in i.display_name or option_input in i.username
-        ]
-        await ctx.send(
-            choices=[
-                {
-                    "name": i.display_name,
-                    "value": str(i.id)
-                } for i in options_auto
-            ]
-        )
+        state: GuildState = await guilds.load(ctx.guild_id)
+        await ctx.send(choices=self.autocomplete_choices(state, ctx, ("prisoner", channel.id), MRCTType.USER))
     
+    @module_base.subcommand("release_all", sub_cmd_description="Revoke all member timeouts in this channel")
+    @interactions.check(my_channel_moderator_check)
+    async def module_base_release_all(self, ctx: interactions.SlashContext) -> None:
+        state: GuildState = await guilds.load(ctx.guild_id)
+        channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
+        ps: list[Prisoner] = state.prisoners.in_channel(channel.id)
+        if len(ps) == 0:
+            await ctx.send(f"No prisoners in {channel.mention}", ephemeral=True)
+            return
+        await ctx.defer()
+        released, failed = await self.release_prisoners_bulk(state, channel, ps, moderator_id=ctx.author.id)
+        msg: str = self.release_summary(channel, released, failed)
+        self.send_log_channel(state, msg, int("00FF00", 16))
+        pag: Paginator = Paginator.create_from_string(self.bot, msg, page_size=1000)
+        await pag.send(ctx)
+
+    @module_base.subcommand("release_multi", sub_cmd_description="Select members to revoke the timeouts in this channel")
+    @interactions.check(my_channel_moderator_check)
+    async def module_base_release_multi(self, ctx: interactions.SlashContext) -> None:
+        state: GuildState = await guilds.load(ctx.guild_id)
+        channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
+        ps: list[Prisoner] = state.prisoners.in_channel(channel.id)
+        if len(ps) == 0:
+            await ctx.send(f"No prisoners in {channel.mention}", ephemeral=True)
+            return
+        options: list[interactions.StringSelectOption] = []
+        # A select menu holds at most 25 options
+        for p in sorted(ps, key=lambda x: x.release_at)[:25]:
+            member: Optional[interactions.Member] = ctx.guild.get_member(p.id)
+            options.append(interactions.StringSelectOption(
+                label=member.display_name if member is not None else str(p.id),
+                value=str(p.id)
+            ))
+        component: interactions.StringSelectMenu = interactions.StringSelectMenu(
+            *options,
+            custom_id=RELEASE_SELECT_CUSTOM_ID,
+            placeholder=f"Select the prisoners to release in {channel.name}",
+            max_values=len(options)
+        )
+        await ctx.send(f"Release the prisoners in {channel.mention}:", components=[component], ephemeral=True)
+
+    @interactions.component_callback(RELEASE_SELECT_CUSTOM_ID)
+    async def callback_release_select(self, ctx: interactions.ComponentContext) -> None:
+        state: GuildState = await guilds.load(ctx.guild_id)
+        if not await my_channel_moderator_check(ctx):
+            await ctx.send("You do not have the permission to do so!", ephemeral=True)
+            return
+        channel: interactions.GuildChannel = ctx.channel if not hasattr(ctx.channel, "parent_channel") else ctx.channel.parent_channel
+        ps: list[Prisoner] = [p for p in (state.prisoners.get(int(v), channel.id) for v in ctx.values) if p is not None]
+        # Edit the original ephemeral message to hide the select menu
+        await ctx.edit_origin(content="Releasing the selected prisoners...", components=[])
+        released, failed = await self.release_prisoners_bulk(state, channel, ps, moderator_id=ctx.author.id)
+        msg: str = self.release_summary(channel, released, failed)
+        self.send_log_channel(state, msg, int("00FF00", 16))
+        # The edit above already acknowledged the context so has to send message to channel directly
+        await self.outbound.run(Priority.INTERACTION, ctx.channel.id, "send", lambda: ctx.channel.send(embed=interactions.Embed(
+            title="Confined Timeout", description=msg[:4096], color=int("00FF00", 16)), silent=True))
+
     @interactions.user_context_menu("Confined Release")
     @interactions.check(my_channel_moderator_check)
     async def contextmenu_usr_release(self, ctx: interactions.ContextMenuContext) -> None:
@@ -0,0 +1,281 @@
+'''
+Confined Timeout
+Counters, latency histograms and gauges
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Recording is off unless the environment variable CONFINED_TIMEOUT_METRICS is set to 1
+or CONFINED_TIMEOUT_METRICS_PORT is set, which also serves the Prometheus text format on
+http://127.0.0.1:<port>/metrics
+'''
+import asyncio
+import bisect
+import os
+import time
+from typing import Any, Callable, Optional
+
+# Seconds, from a dictionary lookup to a slow REST call
+DEFAULT_BUCKETS: tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _label_text(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+class Counter:
+    '''A monotonically increasing count per label values'''
+    __slots__ = ('name', 'help', 'labelnames', 'registry', 'values')
+    def __init__(self, registry: "Metrics", name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.registry: Metrics = registry
+        self.name: str = name
+        self.help: str = help
+        self.labelnames: tuple[str, ...] = labelnames
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        if not self.registry.enabled:
+            return
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def snapshot(self) -> dict[tuple, float]:
+        return dict(self.values)
+
+    def render(self) -> list[str]:
+        lines: list[str] = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{_label_text(self.labelnames, labels)} {value}" for labels, value in self.values.items())
+        return lines
+
+class _Timer:
+    '''Context manager observing the elapsed seconds into a histogram'''
+    __slots__ = ('histogram', 'labels', 'start')
+    def __init__(self, histogram: "Histogram", labels: tuple) -> None:
+        self.histogram: Histogram = histogram
+        self.labels: tuple = labels
+        self.start: float = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        if exc_type is not None and self.histogram.errors is not None:
+            self.histogram.errors.inc(*self.labels)
+
+class _NoTimer:
+    __slots__ = ()
+    def __enter__(self) -> "_NoTimer":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+_NO_TIMER: _NoTimer = _NoTimer()
+
+class Histogram:
+    '''
+    Cumulative bucket counts, sum and count per label values, as Prometheus expects them.
+    An optional error counter with the same labels counts the timed blocks that raised.
+    '''
+    __slots__ = ('name', 'help', 'labelnames', 'registry', 'buckets', 'values', 'errors')
+    def __init__(self, registry: "Metrics", name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS, errors: Optional[Counter] = None) -> None:
+        self.registry: Metrics = registry
+        self.name: str = name
+        self.help: str = help
+        self.labelnames: tuple[str, ...] = labelnames
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        # labels -> [count per bucket plus +Inf, sum]
+        self.values: dict[tuple, list] = {}
+        self.errors: Optional[Counter] = errors
+
+    def observe(self, value: float, *labels) -> None:
+        if not self.registry.enabled:
+            return
+        entry: Optional[list] = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def time(self, *labels):
+        '''Time a with block. Nothing is measured while the metrics are disabled.'''
+        if not self.registry.enabled:
+            return _NO_TIMER
+        return _Timer(self, labels)
+
+    def snapshot(self) -> dict[tuple, dict[str, Any]]:
+        result: dict[tuple, dict[str, Any]] = {}
+        for labels, (counts, total) in self.values.items():
+            count: int = sum(counts)
+            result[labels] = {
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else 0.0,
+                "p50": self._quantile(counts, count, 0.5),
+                "p95": self._quantile(counts, count, 0.95),
+                "p99": self._quantile(counts, count, 0.99),
+            }
+        return result
+
+    def _quantile(self, counts: list[int], count: int, q: float) -> float:
+        '''The upper bound of the bucket holding the quantile'''
+        if count == 0:
+            return 0.0
+        rank: float = q * count
+        cumulative: int = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> list[str]:
+        lines: list[str] = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names: tuple[str, ...] = (*self.labelnames, "le")
+        for labels, (counts, total) in self.values.items():
+            cumulative: int = 0
+            for bound, n in zip((*self.buckets, "+Inf"), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_text(names, (*labels, bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    '''A value read from the callback when the metrics are collected, so it costs nothing in between'''
+    __slots__ = ('name', 'help', 'callback')
+    def __init__(self, name: str, help: str, callback: Callable[[], float]) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.callback: Callable[[], float] = callback
+
+    def value(self) -> Optional[float]:
+        try:
+            return float(self.callback())
+        except Exception as e:
+            print(f"Failed to read the gauge {self.name}: {e!r}")
+            return None
+
+    def render(self) -> list[str]:
+        value: Optional[float] = self.value()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+class Metrics:
+    '''
+    The registry of all the metrics.
+    Every metric is registered once per name, so reloading the extension keeps the recorded values.
+    '''
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled: bool = enabled
+        self._metrics: dict[str, Any] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        metric: Optional[Counter] = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Counter(self, name, help, labelnames)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS, errors: Optional[Counter] = None) -> Histogram:
+        metric: Optional[Histogram] = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = Histogram(self, name, help, labelnames, buckets, errors)
+        return metric
+
+    def gauge(self, name: str, help: str, callback: Callable[[], float]) -> Gauge:
+        '''Register the gauge, replacing the callback of an earlier one with the same name'''
+        metric: Gauge = Gauge(name, help, callback)
+        self._metrics[name] = metric
+        return metric
+
+    def remove(self, name: str) -> None:
+        self._metrics.pop(name, None)
+
+    def snapshot(self) -> dict[str, Any]:
+        '''
+        The current values keyed by the metric name.
+        Counters and histograms map the label values joined by "/" to the value or the summary.
+        '''
+        result: dict[str, Any] = {}
+        for name, metric in self._metrics.items():
+            if isinstance(metric, Gauge):
+                result[name] = metric.value()
+            else:
+                result[name] = {"/".join(str(v) for v in labels): value for labels, value in metric.snapshot().items()}
+        return result
+
+    def render(self) -> str:
+        '''The Prometheus text exposition format'''
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    ################ Endpoint ################
+
+    async def serve(self, port: int, host: str = "127.0.0.1") -> None:
+        '''Serve GET /metrics on the local port'''
+        if self._server is not None:
+            return
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def close(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request: bytes = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the headers
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts: list[str] = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+def metrics_port() -> Optional[int]:
+    '''The port of the Prometheus endpoint, or None if it is off'''
+    port: str = os.environ.get("CONFINED_TIMEOUT_METRICS_PORT", "")
+    return int(port) if port.isdigit() else None
+
+metrics: Metrics = Metrics(os.environ.get("CONFINED_TIMEOUT_METRICS", "") == "1" or metrics_port() is not None)
+
+################ Instruments ################
+
+COMMAND_SECONDS: Histogram = metrics.histogram("confined_timeout_command_seconds", "Command handler latency", ("command",))
+DB_COMMIT_ERRORS: Counter = metrics.counter("confined_timeout_db_commit_errors_total", "Database commits that failed")
+DB_COMMIT_SECONDS: Histogram = metrics.histogram("confined_timeout_db_commit_seconds", "Database writer commit latency", errors=DB_COMMIT_ERRORS)
+DB_OPERATIONS: Counter = metrics.counter("confined_timeout_db_operations_total", "Operations committed by the database writer")
+DB_OPERATIONS_FAILED: Counter = metrics.counter("confined_timeout_db_operations_failed_total", "Operations dropped by the database writer after the retries")
+DISCORD_ERRORS: Counter = metrics.counter("confined_timeout_discord_errors_total", "Discord calls that raised", ("call",))
+DISCORD_SECONDS: Histogram = metrics.histogram("confined_timeout_discord_seconds", "Outbound Discord call latency", ("call",), errors=DISCORD_ERRORS)
@@ -0,0 +1,139 @@
+'''
+Confined Timeout
+Database schema migrations
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import datetime
+import math
+from typing import Callable
+
+import sqlalchemy
+from sqlalchemy import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .model import DBBase, PrisonerDB, SchemaVersionDB, SettingDB
+
+def _columns(conn: Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+def _partition_by_guild(conn: Connection) -> None:
+    '''
+    Add the guild_id to every table.
+    The settings and the global admins are backfilled with the guild of the log channel setting, the only guild bound to them.
+    The moderator and prisoner rows stay at guild 0, since they may come from several guilds,
+    and are adopted on startup by the guilds of their channels.
+    '''
+    row = conn.exec_driver_sql("SELECT setting1 FROM SettingDB WHERE type = 0 AND setting1 IS NOT NULL").first()
+    guild_id: int = int(row[0]) if row is not None and row[0].isdigit() else 0
+    for table in ("GlobalAdminDB", "ModeratorDB", "PrisonerDB"):
+        if "guild_id" not in _columns(conn, table):
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN guild_id BIGINT NOT NULL DEFAULT 0")
+    conn.exec_driver_sql("UPDATE GlobalAdminDB SET guild_id = ? WHERE guild_id = 0", (guild_id,))
+    # The primary key of a SQLite table cannot be altered so the table is rebuilt
+    if "guild_id" not in _columns(conn, "SettingDB"):
+        conn.exec_driver_sql("ALTER TABLE SettingDB RENAME TO SettingDB_old")
+        SettingDB.__table__.create(conn)
+        conn.exec_driver_sql("INSERT INTO SettingDB (guild_id, type, setting, setting1) SELECT ?, type, setting, setting1 FROM SettingDB_old", (guild_id,))
+        conn.exec_driver_sql("DROP TABLE SettingDB_old")
+    for statement in (
+        "DROP INDEX IF EXISTS ix_GlobalAdminDB_natural",
+        "DROP INDEX IF EXISTS ix_ModeratorDB_natural",
+        "DROP INDEX IF EXISTS ix_PrisonerDB_natural",
+        "CREATE UNIQUE INDEX ix_GlobalAdminDB_natural ON GlobalAdminDB (guild_id, id, type)",
+        "CREATE UNIQUE INDEX ix_ModeratorDB_natural ON ModeratorDB (guild_id, id, type, channel_id)",
+        "CREATE UNIQUE INDEX ix_PrisonerDB_natural ON PrisonerDB (guild_id, id, channel_id)",
+    ):
+        conn.exec_driver_sql(statement)
+
+def _release_datetime_index(conn: Connection) -> None:
+    # The column is replaced by the integer release time in version 3
+    if "release_datetime" in _columns(conn, "PrisonerDB"):
+        conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_PrisonerDB_release_datetime ON PrisonerDB (release_datetime)")
+
+def _epoch_release_time(conn: Connection) -> None:
+    '''
+    Replace the naive release datetime with the UTC epoch seconds.
+    The datetimes were written in the local time of the host, which is how they are read back here,
+    and rounded up so that nobody is released early. The table is rebuilt to drop the old column.
+    '''
+    if "release_datetime" not in _columns(conn, "PrisonerDB"):
+        return
+    rows: list[tuple[int, int, int, int, int]] = [
+        (uid, guild_id, id, channel_id, math.ceil(datetime.datetime.fromisoformat(str(release_datetime)).timestamp()))
+        for uid, guild_id, id, channel_id, release_datetime
+        in conn.exec_driver_sql("SELECT uid, guild_id, id, channel_id, release_datetime FROM PrisonerDB")
+    ]
+    # The indexes keep their names when the table is renamed
+    for index in ("ix_PrisonerDB_natural", "ix_PrisonerDB_channel_id", "ix_PrisonerDB_release_datetime"):
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index}")
+    conn.exec_driver_sql("ALTER TABLE PrisonerDB RENAME TO PrisonerDB_old")
+    PrisonerDB.__table__.create(conn)
+    if len(rows) > 0:
+        conn.exec_driver_sql("INSERT INTO PrisonerDB (uid, guild_id, id, channel_id, release_at) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.exec_driver_sql("DROP TABLE PrisonerDB_old")
+
+def _sql(*statements: str) -> Callable[[Connection], None]:
+    def func(conn: Connection) -> None:
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+    return func
+
+def _steps(*funcs: Callable[[Connection], None]) -> Callable[[Connection], None]:
+    def func(conn: Connection) -> None:
+        for f in funcs:
+            f(conn)
+    return func
+
+'''
+Migrations are applied in order and each one exactly once.
+New databases get the tables from create_all first, so every migration has to be idempotent.
+'''
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Natural key unique indexes and release time index", _steps(_sql(
+        # Remove the duplicated rows before adding the unique constraints
+        "DELETE FROM GlobalAdminDB WHERE uid NOT IN (SELECT MIN(uid) FROM GlobalAdminDB GROUP BY id, type)",
+        "DELETE FROM ModeratorDB WHERE uid NOT IN (SELECT MIN(uid) FROM ModeratorDB GROUP BY id, type, channel_id)",
+        "DELETE FROM PrisonerDB WHERE uid NOT IN (SELECT MIN(uid) FROM PrisonerDB GROUP BY id, channel_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_GlobalAdminDB_natural ON GlobalAdminDB (id, type)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_ModeratorDB_natural ON ModeratorDB (id, type, channel_id)",
+        "CREATE INDEX IF NOT EXISTS ix_ModeratorDB_channel_id ON ModeratorDB (channel_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_PrisonerDB_natural ON PrisonerDB (id, channel_id)",
+        "CREATE INDEX IF NOT EXISTS ix_PrisonerDB_channel_id ON PrisonerDB (channel_id)",
+    ), _release_datetime_index)),
+    (2, "Partition the tables by guild", _partition_by_guild),
+    (3, "Integer epoch release times", _epoch_release_time),
+]
+
+def _migrate(conn: Connection) -> int:
+    DBBase.metadata.create_all(conn)
+    current: int = conn.execute(sqlalchemy.select(sqlalchemy.func.max(SchemaVersionDB.version))).scalar() or 0
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        func(conn)
+        conn.execute(sqlalchemy.insert(SchemaVersionDB).values(version=version, applied_at=datetime.datetime.now()))
+        print(f"Confined Timeout database migrated to version {version}: {description}")
+        current = version
+    return current
+
+async def migrate(engine: AsyncEngine) -> int:
+    '''
+    Create the missing tables and apply the pending migrations in one transaction.
+    Return the schema version.
+    '''
+    async with engine.begin() as conn:
+        return await conn.run_sync(_migrate)
@@ -18,53 +18,153 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
 import sqlalchemy
-from sqlalchemy import DateTime, BigInteger, String
+from sqlalchemy import DateTime, BigInteger, String, Index, Float, Column, Integer, MetaData, Table
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
 from datetime import datetime
+from typing import Optional
 
 # class DBBase(DeclarativeBase):
 class DBBase(AsyncAttrs, DeclarativeBase):
     pass
 
+class SchemaVersionDB(DBBase):
+    __tablename__ = "SchemaVersionDB"
+
+    version:    Mapped[int] = mapped_column(primary_key=True)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"SchemaVersionDB(version={self.version!r}, applied_at={self.applied_at!r})"
+
 class GlobalAdminDB(DBBase):
     __tablename__ = "GlobalAdminDB"
+    __table_args__ = (
+        Index("ix_GlobalAdminDB_natural", "guild_id", "id", "type", unique=True),
+    )
 
-    uid:    Mapped[int] = mapped_column(primary_key=True)
-    id:     Mapped[int] = mapped_column(BigInteger, nullable=False)
-    type:   Mapped[int] = mapped_column(nullable=False)
+    uid:        Mapped[int] = mapped_column(primary_key=True)
+    guild_id:   Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    id:         Mapped[int] = mapped_column(BigInteger, nullable=False)
+    type:       Mapped[int] = mapped_column(nullable=False)
 
     def __repr__(self) -> str:
-        return f"GlobalAdminDB(uid={self.uid!r}, id={self.id!r}, type={self.type!r})"
+        return f"GlobalAdminDB(uid={self.uid!r}, guild_id={self.guild_id!r}, id={self.id!r}, type={self.type!r})"
 
 class ModeratorDB(DBBase):
     __tablename__ = "ModeratorDB"
+    __table_args__ = (
+        Index("ix_ModeratorDB_natural", "guild_id", "id", "type", "channel_id", unique=True),
+        Index("ix_ModeratorDB_channel_id", "channel_id"),
+    )
 
     uid:        Mapped[int] = mapped_column(primary_key=True)
+    guild_id:   Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
     id:         Mapped[int] = mapped_column(BigInteger, nullable=False)
     type:       Mapped[int] = mapped_column(nullable=False)
     channel_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
 
     def __repr__(self) -> str:
-        return f"ModeratorDB(uid={self.uid!r}, id={self.id!r}, type={self.type!r}, channel_id={self.channel_id!r})"
+        return f"ModeratorDB(uid={self.uid!r}, guild_id={self.guild_id!r}, id={self.id!r}, type={self.type!r}, channel_id={self.channel_id!r})"
 
 class PrisonerDB(DBBase):
     __tablename__ = "PrisonerDB"
+    __table_args__ = (
+        Index("ix_PrisonerDB_natural", "guild_id", "id", "channel_id", unique=True),
+        Index("ix_PrisonerDB_channel_id", "channel_id"),
+        Index("ix_PrisonerDB_release_at", "release_at"),
+    )
 
     uid:                Mapped[int] = mapped_column(primary_key=True)
+    guild_id:           Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
     id:                 Mapped[int] = mapped_column(BigInteger, nullable=False)
     channel_id:         Mapped[int] = mapped_column(BigInteger, nullable=False)
-    release_datetime:   Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    # UTC epoch seconds
+    release_at:         Mapped[int] = mapped_column(BigInteger, nullable=False)
 
     def __repr__(self) -> str:
-        return f"PrisonerDB(uid={self.uid!r}, id={self.id!r}, channel_id={self.channel_id!r}, release_datetime={self.release_datetime!r})"
+        return f"PrisonerDB(uid={self.uid!r}, guild_id={self.guild_id!r}, id={self.id!r}, channel_id={self.channel_id!r}, release_at={self.release_at!r})"
 
 class SettingDB(DBBase):
     __tablename__ = "SettingDB"
 
-    type:           Mapped[int] = mapped_column(nullable=False, primary_key=True, unique=True)
+    guild_id:       Mapped[int] = mapped_column(BigInteger, nullable=False, primary_key=True, default=0)
+    type:           Mapped[int] = mapped_column(nullable=False, primary_key=True)
     setting:        Mapped[int] = mapped_column(BigInteger, nullable=False)
     # Reserved setting for future
-    setting1:       Mapped[str] = mapped_column(String(100), nullable=True)
\ No newline at end of file
+    setting1:       Mapped[str] = mapped_column(String(100), nullable=True)
+
+class LeaseDB(DBBase):
+    __tablename__ = "LeaseDB"
+
+    name:       Mapped[str] = mapped_column(String(100), primary_key=True)
+    owner:      Mapped[str] = mapped_column(String(100), nullable=False)
+    # Epoch seconds
+    expires_at: Mapped[float] = mapped_column(Float, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"LeaseDB(name={self.name!r}, owner={self.owner!r}, expires_at={self.expires_at!r})"
+
+class ChangeDB(DBBase):
+    __tablename__ = "ChangeDB"
+
+    seq:        Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    guild_id:   Mapped[int] = mapped_column(BigInteger, nullable=False)
+    origin:     Mapped[str] = mapped_column(String(100), nullable=False)
+    # Epoch seconds
+    changed_at: Mapped[float] = mapped_column(Float, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"ChangeDB(seq={self.seq!r}, guild_id={self.guild_id!r}, origin={self.origin!r}, changed_at={self.changed_at!r})"
+
+class HistorySummaryDB(DBBase):
+    '''The totals of the history buckets dropped by the retention'''
+    __tablename__ = "HistorySummaryDB"
+    __table_args__ = (
+        Index("ix_HistorySummaryDB_user", "guild_id", "user_id"),
+        Index("ix_HistorySummaryDB_channel", "guild_id", "channel_id"),
+    )
+
+    guild_id:       Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # The month of the bucket as YYYYMM
+    bucket:         Mapped[int] = mapped_column(primary_key=True)
+    user_id:        Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    channel_id:     Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    jails:          Mapped[int] = mapped_column(nullable=False, default=0)
+    releases:       Mapped[int] = mapped_column(nullable=False, default=0)
+    # The sum of the jail durations in seconds
+    jailed_seconds: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"HistorySummaryDB(guild_id={self.guild_id!r}, bucket={self.bucket!r}, user_id={self.user_id!r}, channel_id={self.channel_id!r}, jails={self.jails!r}, releases={self.releases!r})"
+
+# The history is append-only and split into one table per month, so the retention drops whole tables.
+# The bucket tables are created on the first write of the month and are not part of create_all.
+HISTORY_METADATA: MetaData = MetaData()
+HISTORY_TABLE_PREFIX: str = "HistoryDB_"
+
+def history_table(bucket: int) -> Table:
+    '''The table of the month YYYYMM'''
+    name: str = f"{HISTORY_TABLE_PREFIX}{bucket}"
+    table: Optional[Table] = HISTORY_METADATA.tables.get(name)
+    if table is None:
+        table = Table(
+            name, HISTORY_METADATA,
+            Column("uid", Integer, primary_key=True),
+            Column("guild_id", BigInteger, nullable=False),
+            # UTC epoch seconds
+            Column("at", BigInteger, nullable=False),
+            Column("kind", Integer, nullable=False),
+            Column("user_id", BigInteger, nullable=False),
+            Column("channel_id", BigInteger, nullable=False),
+            # 0 if nobody ran a command, such as an expiry
+            Column("moderator_id", BigInteger, nullable=False),
+            # The jail duration in seconds
+            Column("duration", BigInteger, nullable=False),
+            Column("reason", String(200), nullable=False),
+            Index(f"ix_{name}_user", "guild_id", "user_id", "at"),
+            Index(f"ix_{name}_channel", "guild_id", "channel_id", "at"),
+        )
+    return table
@@ -0,0 +1,184 @@
+'''
+Confined Timeout
+Priority scheduler of the outbound Discord requests
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import bisect
+import itertools
+import time
+from enum import IntEnum, unique
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from .metrics import DISCORD_SECONDS, Counter, Histogram, metrics
+
+@unique
+class Priority(IntEnum):
+    '''Lower runs first'''
+    ENFORCEMENT = 0
+    INTERACTION = 1
+    ANNOUNCEMENT = 2
+    LOG = 3
+
+class OutboundShed(Exception):
+    '''The request was dropped from the queue under pressure'''
+
+OUTBOUND_WAIT_SECONDS: Histogram = metrics.histogram("confined_timeout_outbound_wait_seconds", "Time outbound requests spend queued", ("priority",))
+OUTBOUND_SHED: Counter = metrics.counter("confined_timeout_outbound_shed_total", "Outbound requests dropped under pressure", ("priority",))
+
+class _Request:
+    __slots__ = ('priority', 'seq', 'route', 'label', 'call', 'future', 'queued_at')
+    def __init__(self, priority: Priority, seq: int, route: Hashable, label: str, call: Callable[[], Awaitable[Any]], future: asyncio.Future) -> None:
+        self.priority: Priority = priority
+        self.seq: int = seq
+        self.route: Hashable = route
+        self.label: str = label
+        self.call = call
+        self.future: asyncio.Future = future
+        self.queued_at: float = time.perf_counter()
+
+    def __lt__(self, other: "_Request") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class OutboundScheduler:
+    '''
+    Run the Discord requests by priority with a concurrency limit per route and in total.
+    The low priorities can only take part of the total slots, so the enforcement never waits behind them,
+    and their queues are bounded by dropping the oldest requests.
+    The rate limits themselves are still handled by the HTTP client, this only decides who goes first.
+    '''
+    def __init__(
+        self,
+        limit: int = 16,
+        low_priority_limit: int = 8,
+        route_limits: Optional[dict[str, int]] = None,
+        default_route_limit: int = 4,
+        max_queued: Optional[dict[Priority, int]] = None) -> None:
+        '''
+        limit: int                  Requests running at the same time
+        low_priority_limit: int     Announcements and logs running at the same time
+        route_limits: dict          Requests running at the same time on one route, by the request label
+        default_route_limit: int    The route limit of the other labels
+        max_queued: dict            Queued requests of a priority before the oldest is dropped, unbounded if missing
+        '''
+        self.limit: int = limit
+        self.low_priority_limit: int = low_priority_limit
+        self.route_limits: dict[str, int] = route_limits if route_limits is not None else {}
+        self.default_route_limit: int = default_route_limit
+        self.max_queued: dict[Priority, int] = max_queued if max_queued is not None else {Priority.ANNOUNCEMENT: 200, Priority.LOG: 100}
+        self._queue: list[_Request] = []
+        self._queued: dict[Priority, int] = {p: 0 for p in Priority}
+        self._running: int = 0
+        self._running_low: int = 0
+        self._routes: dict[Hashable, int] = {}
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def submit(self, priority: Priority, route: Hashable, label: str, call: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        '''
+        Queue the coroutine function and return the future of its result.
+        The route is the rate limit bucket, such as the label and the channel id.
+        '''
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        request: _Request = _Request(priority, next(self._counter), (label, route), label, call, future)
+        bisect.insort(self._queue, request)
+        self._queued[priority] += 1
+        self._shed(priority)
+        self._dispatch()
+        return future
+
+    async def run(self, priority: Priority, route: Hashable, label: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        '''Queue the coroutine function and wait for its result'''
+        return await self.submit(priority, route, label, call)
+
+    def submit_nowait(self, priority: Priority, route: Hashable, label: str, call: Callable[[], Awaitable[Any]]) -> None:
+        '''Queue the coroutine function without waiting for it. Failures are printed.'''
+        self.submit(priority, route, label, call).add_done_callback(self._report)
+
+    @staticmethod
+    def _report(future: asyncio.Future) -> None:
+        if future.cancelled():
+            return
+        e: Optional[BaseException] = future.exception()
+        if e is not None and not isinstance(e, OutboundShed):
+            print(f"Outbound request failed: {e!r}")
+
+    def _shed(self, priority: Priority) -> None:
+        limit: Optional[int] = self.max_queued.get(priority)
+        if limit is None or self._queued[priority] <= limit:
+            return
+        # The oldest request of the priority is the first one in the queue
+        for i, request in enumerate(self._queue):
+            if request.priority == priority:
+                del self._queue[i]
+                self._queued[priority] -= 1
+                OUTBOUND_SHED.inc(priority.name)
+                if not request.future.done():
+                    request.future.set_exception(OutboundShed(f"{request.label} {request.route} dropped"))
+                return
+
+    def _dispatch(self) -> None:
+        i: int = 0
+        while i < len(self._queue) and self._running < self.limit:
+            request: _Request = self._queue[i]
+            low: bool = request.priority >= Priority.ANNOUNCEMENT
+            if low and self._running_low >= self.low_priority_limit:
+                # Everything after this one is low priority as well
+                break
+            if self._routes.get(request.route, 0) >= self.route_limits.get(request.label, self.default_route_limit):
+                i += 1
+                continue
+            del self._queue[i]
+            self._queued[request.priority] -= 1
+            if request.future.cancelled():
+                continue
+            self._running += 1
+            if low:
+                self._running_low += 1
+            self._routes[request.route] = self._routes.get(request.route, 0) + 1
+            OUTBOUND_WAIT_SECONDS.observe(time.perf_counter() - request.queued_at, request.priority.name)
+            asyncio.create_task(self._execute(request))
+
+    async def _execute(self, request: _Request) -> None:
+        try:
+            with DISCORD_SECONDS.time(request.label):
+                result: Any = await request.call()
+            if not request.future.done():
+                request.future.set_result(result)
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+        finally:
+            self._running -= 1
+            if request.priority >= Priority.ANNOUNCEMENT:
+                self._running_low -= 1
+            count: int = self._routes[request.route] - 1
+            if count > 0:
+                self._routes[request.route] = count
+            else:
+                del self._routes[request.route]
+            self._dispatch()
+
+    async def drain(self) -> None:
+        '''Wait until every queued and running request is done'''
+        while self._queue or self._running > 0:
+            await asyncio.sleep(0.05)
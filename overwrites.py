@@ -0,0 +1,172 @@
+'''
+Confined Timeout
+Coalescing of the member permission overwrite changes per channel
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+import interactions
+
+from .metrics import Histogram, metrics
+
+# Discord truncates the audit log reason
+REASON_LIMIT: int = 512
+
+OVERWRITE_BATCH: Histogram = metrics.histogram(
+    "confined_timeout_overwrite_batch_size", "Member overwrite changes applied by one request", buckets=(1, 2, 5, 10, 25, 50, 100))
+
+class _Change:
+    __slots__ = ('member_id', 'deny', 'reason', 'future')
+    def __init__(self, member_id: int, deny: Optional[int], reason: str, future: asyncio.Future) -> None:
+        self.member_id: int = member_id
+        # The permissions to deny, or None to delete the overwrite
+        self.deny: Optional[int] = deny
+        self.reason: str = reason
+        self.future: asyncio.Future = future
+
+async def _run_call(route: Hashable, label: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    return await call()
+
+class OverwriteCoalescer:
+    '''
+    Buffer the member overwrite changes of each channel for a short window and apply them together.
+    A lone change uses the member overwrite endpoints, which keep its audit log reason. Several changes replace
+    the whole overwrite list of the channel in one edit, so a raid of 50 members is one request. The list is built
+    from the up to date copy of the channel, so the overwrites edited outside the bot are not undone.
+    The changes of one channel are applied one batch at a time, and the cached overwrites are updated
+    after each batch, so a batch always starts from the overwrites the previous one left. Every change gets its own future, failed with the error of its batch.
+    '''
+    def __init__(
+        self,
+        run: Optional[Callable[[Hashable, str, Callable[[], Awaitable[Any]]], Awaitable[Any]]] = None,
+        window: float = 0.1,
+        current: Optional[Callable[[int], Awaitable[Optional[interactions.GuildChannel]]]] = None) -> None:
+        '''
+        run: Callable       (Optional) Run the request coroutine function with the route and the label, such as the outbound scheduler
+        window: float       Seconds the first change of a channel waits for the others
+        current: Callable   (Optional) The up to date channel before an edit of the whole list, such as the gateway copy
+        '''
+        self.run = run if run is not None else _run_call
+        self.window: float = window
+        self.current = current
+        self._pending: dict[int, list[_Change]] = {}
+        # The latest channel object seen for each channel id
+        self._channels: dict[int, interactions.GuildChannel] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return sum(len(changes) for changes in self._pending.values())
+
+    def deny(self, channel: interactions.GuildChannel, member_id: int, permissions: int, reason: str = "") -> asyncio.Future:
+        '''Deny the permissions to the member, merged into the existing overwrite of the member'''
+        return self._queue(channel, member_id, int(permissions), reason)
+
+    def delete(self, channel: interactions.GuildChannel, member_id: int, reason: str = "") -> asyncio.Future:
+        '''Delete the overwrite of the member. A missing overwrite is not an error.'''
+        return self._queue(channel, member_id, None, reason)
+
+    def _queue(self, channel: interactions.GuildChannel, member_id: int, deny: Optional[int], reason: str) -> asyncio.Future:
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(channel.id, []).append(_Change(int(member_id), deny, reason, future))
+        self._channels[channel.id] = channel
+        if channel.id not in self._tasks:
+            self._tasks[channel.id] = asyncio.create_task(self._flush(channel.id))
+        return future
+
+    async def _flush(self, channel_id: int) -> None:
+        try:
+            await asyncio.sleep(self.window)
+            # The changes queued while a batch is applied go in the next batch
+            while self._pending.get(channel_id):
+                changes: list[_Change] = self._pending.pop(channel_id)
+                channel: interactions.GuildChannel = self._channels[channel_id]
+                try:
+                    await self._apply(channel, changes)
+                except Exception as e:
+                    for change in changes:
+                        if not change.future.done():
+                            change.future.set_exception(e)
+                else:
+                    for change in changes:
+                        if not change.future.done():
+                            change.future.set_result(None)
+        finally:
+            del self._tasks[channel_id]
+            self._channels.pop(channel_id, None)
+            for change in self._pending.pop(channel_id, []):
+                change.future.cancel()
+
+    async def _apply(self, channel: interactions.GuildChannel, changes: list[_Change]) -> None:
+        OVERWRITE_BATCH.observe(len(changes))
+        if len(changes) > 1 and self.current is not None:
+            # The channel may come from a cache older than the overwrites edited outside the bot
+            channel = await self.current(channel.id) or channel
+        overwrites: list[interactions.PermissionOverwrite] = self.merge(channel.permission_overwrites, changes)
+        if len(changes) == 1:
+            change: _Change = changes[0]
+            if change.deny is None:
+                try:
+                    await self.run(channel.id, "delete_permission", lambda: channel.delete_permission(change.member_id, change.reason))
+                except interactions.errors.NotFound:
+                    pass
+            else:
+                # add_permission drops the reason when it creates the overwrite, so put the merged overwrite directly
+                overwrite: interactions.PermissionOverwrite = next(
+                    o for o in overwrites if o.type == interactions.OverwriteType.MEMBER and int(o.id) == change.member_id)
+                await self.run(channel.id, "add_permission", lambda: channel.edit_permission(overwrite, change.reason))
+        else:
+            denied: int = sum(1 for c in changes if c.deny is not None)
+            reason: str = f"{denied} member(s) timeout and {len(changes) - denied} member(s) released in Channel {channel.name}"
+            await self.run(channel.id, "edit_permissions", lambda: channel.edit(permission_overwrites=overwrites, reason=reason[:REASON_LIMIT]))
+        # The member endpoints leave the cached overwrites as they were until the gateway update arrives,
+        # and the next edit is built from the cache, so it would bring a deleted overwrite back
+        channel.permission_overwrites = overwrites
+
+    @staticmethod
+    def merge(current: list[interactions.PermissionOverwrite], changes: list[_Change]) -> list[interactions.PermissionOverwrite]:
+        '''
+        The overwrite list after the changes, in order. The cached overwrites are copied, not modified,
+        so a failed edit leaves the cache as it was.
+        '''
+        overwrites: list[interactions.PermissionOverwrite] = [
+            interactions.PermissionOverwrite(id=o.id, type=o.type, allow=o.allow, deny=o.deny) for o in current
+        ]
+        members: dict[int, interactions.PermissionOverwrite] = {
+            int(o.id): o for o in overwrites if o.type == interactions.OverwriteType.MEMBER
+        }
+        for change in changes:
+            existing: Optional[interactions.PermissionOverwrite] = members.get(change.member_id)
+            if change.deny is None:
+                if existing is not None:
+                    overwrites.remove(existing)
+                    del members[change.member_id]
+            elif existing is not None:
+                existing.deny = interactions.Permissions(int(existing.deny or 0) | change.deny)
+                existing.allow = interactions.Permissions(int(existing.allow or 0) & ~change.deny)
+            else:
+                overwrite: interactions.PermissionOverwrite = interactions.PermissionOverwrite(
+                    id=change.member_id, type=interactions.OverwriteType.MEMBER,
+                    allow=interactions.Permissions.NONE, deny=interactions.Permissions(change.deny))
+                overwrites.append(overwrite)
+                members[change.member_id] = overwrite
+        return overwrites
+
+    async def drain(self) -> None:
+        '''Wait until every queued change is applied'''
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
@@ -0,0 +1,154 @@
+'''
+Confined Timeout
+Lazily rendered paginator pages
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import bisect
+from collections.abc import Sequence
+from typing import Any, Callable, Hashable, Optional, Union
+
+from interactions.ext.paginators import Page
+
+class Section:
+    '''
+    A header followed by entries. Each entry is rendered only when its page is viewed.
+    The entries can be a callable returning the sequence together with the count,
+    so that they are only collected when one of the pages of the section is viewed.
+    '''
+    __slots__ = ('header', '_entries', 'count', 'render', 'empty')
+    def __init__(self, header: str, entries: Union[Sequence, Callable[[], Sequence]], render: Callable[[Any], str] = str, empty: str = "None", count: Optional[int] = None) -> None:
+        self.header: str = header
+        self._entries: Union[Sequence, Callable[[], Sequence]] = entries
+        self.count: int = count if count is not None else len(entries)
+        self.render: Callable[[Any], str] = render
+        self.empty: str = empty
+
+    @property
+    def entries(self) -> Sequence:
+        if callable(self._entries):
+            self._entries = self._entries()
+        return self._entries
+
+    def page_count(self, per_page: int) -> int:
+        return _page_count(self.count, per_page)
+
+    def render_page(self, offset: int, per_page: int) -> str:
+        '''The page of the entries from the offset'''
+        header: str = self.header if offset == 0 else f"{self.header} (continued)"
+        if self.count > 0:
+            content: str = "\n".join(self.render(e) for e in self.entries[offset:offset + per_page])
+        else:
+            content: str = self.empty
+        return f"{header}\n{content}"
+
+def _page_count(count: int, per_page: int) -> int:
+    return max(1, -(-count // per_page))
+
+class StreamSection:
+    '''
+    The entries of many groups, such as the prisoners of every channel, as one stream in the order of the groups.
+    The page count only needs the total and a page only reads its own slice of the stream,
+    so the first page costs the same regardless of the number of groups.
+    A group starts with its header, repeated where the group continues on the next page.
+    '''
+    __slots__ = ('count', 'slice', 'header', 'render', 'empty', 'keep')
+    def __init__(
+        self,
+        count: int,
+        slice: Callable[[int, int], Sequence[tuple[Hashable, Any]]],
+        header: Callable[[Hashable], str],
+        render: Callable[[Any], str] = str,
+        empty: str = "None",
+        keep: Optional[Callable[[Hashable], bool]] = None) -> None:
+        '''
+        count: int          The number of entries of all the groups
+        slice: Callable     The (group, entry) pairs from the start to the stop position of the stream
+        header: Callable    The header of a group
+        keep: Callable      (Optional) Whether a group is shown, checked only for the groups on the page
+        '''
+        self.count: int = count
+        self.slice: Callable[[int, int], Sequence[tuple[Hashable, Any]]] = slice
+        self.header: Callable[[Hashable], str] = header
+        self.render: Callable[[Any], str] = render
+        self.empty: str = empty
+        self.keep: Optional[Callable[[Hashable], bool]] = keep
+
+    def page_count(self, per_page: int) -> int:
+        return _page_count(self.count, per_page)
+
+    def render_page(self, offset: int, per_page: int) -> str:
+        if self.count == 0:
+            return self.empty
+        # The entry before the page tells whether the first group continues from the previous page
+        pairs: Sequence[tuple[Hashable, Any]] = self.slice(max(0, offset - 1), offset + per_page)
+        previous: Optional[Hashable] = None
+        if offset > 0 and len(pairs) > 0:
+            previous, pairs = pairs[0][0], pairs[1:]
+        lines: list[str] = []
+        kept: dict[Hashable, bool] = {}
+        for group, entry in pairs:
+            if self.keep is not None:
+                if group not in kept:
+                    kept[group] = self.keep(group)
+                if not kept[group]:
+                    # The page stays shorter rather than moving the entries of the later pages
+                    continue
+            if len(lines) == 0 or group != previous:
+                lines.append(f"{self.header(group)} (continued)" if group == previous else self.header(group))
+                previous = group
+            lines.append(self.render(entry))
+        return "\n".join(lines) if lines else self.empty
+
+class LazyPages(Sequence):
+    '''
+    Page sequence for the Paginator.
+    Only the page boundaries are computed up front, so the first page costs the same regardless of the data size.
+    '''
+    def __init__(self, sections: list[Union[Section, StreamSection]], per_page: int = 15, title: Optional[str] = None) -> None:
+        self.sections: list[Union[Section, StreamSection]] = sections
+        self.per_page: int = per_page
+        self.title: Optional[str] = title
+        # First page index of each section
+        self._starts: list[int] = []
+        total: int = 0
+        for section in sections:
+            self._starts.append(total)
+            total += section.page_count(per_page)
+        self._total: int = total
+        self._cache: dict[int, Page] = {}
+
+    def __len__(self) -> int:
+        return self._total
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._total))]
+        if index < 0:
+            index += self._total
+        if not 0 <= index < self._total:
+            raise IndexError("page index out of range")
+        page: Optional[Page] = self._cache.get(index)
+        if page is None:
+            page = self._render(index)
+            self._cache[index] = page
+        return page
+
+    def _render(self, index: int) -> Page:
+        section_index: int = bisect.bisect_right(self._starts, index) - 1
+        section: Union[Section, StreamSection] = self.sections[section_index]
+        offset: int = (index - self._starts[section_index]) * self.per_page
+        return Page(section.render_page(offset, self.per_page), title=self.title)
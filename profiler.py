@@ -0,0 +1,139 @@
+'''
+Confined Timeout
+Sampling profiler of the event loop
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+# The loop waits for events in the selector when it has nothing to run
+IDLE_FILES: tuple[str, ...] = ("selectors.py",)
+
+class ProfileReport:
+    '''The result of one capture'''
+    __slots__ = ('seconds', 'samples', 'idle_samples', 'stacks', 'lags', 'tasks_start', 'tasks_end', 'tasks_max', 'handlers')
+    def __init__(self) -> None:
+        self.seconds: float = 0.0
+        self.samples: int = 0
+        self.idle_samples: int = 0
+        # Collapsed stack from the outermost frame -> number of samples
+        self.stacks: dict[str, int] = {}
+        # Seconds each loop lag probe woke up late
+        self.lags: list[float] = []
+        self.tasks_start: int = 0
+        self.tasks_end: int = 0
+        self.tasks_max: int = 0
+        # Handler name -> wall times in seconds
+        self.handlers: dict[str, list[float]] = {}
+
+    def collapsed(self) -> str:
+        '''The stacks in the collapsed format read by flamegraph.pl and speedscope'''
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items(), key=lambda a: -a[1]))
+
+    def summary(self) -> list[str]:
+        lines: list[str] = [f"Captured {self.samples} samples in {self.seconds:.1f} seconds"]
+        if self.samples > 0:
+            lines.append(f"Loop busy: {100 * (self.samples - self.idle_samples) / self.samples:.1f}%")
+        if self.lags:
+            lags: list[float] = sorted(self.lags)
+            lines.append(
+                f"Loop lag: mean {1000 * sum(lags) / len(lags):.1f} ms, "
+                f"p99 {1000 * lags[min(len(lags) - 1, int(len(lags) * 0.99))]:.1f} ms, max {1000 * lags[-1]:.1f} ms"
+            )
+        lines.append(f"Live tasks: {self.tasks_start} at start, {self.tasks_end} at end, {self.tasks_max} at most")
+        if self.handlers:
+            lines.append("Handlers:")
+            for name, times in sorted(self.handlers.items(), key=lambda a: -sum(a[1])):
+                lines.append(f"- {name}: {len(times)} calls, {1000 * sum(times):.1f} ms total, {1000 * max(times):.1f} ms max")
+        return lines
+
+class LoopProfiler:
+    '''
+    Sample the stack of the event loop thread from a background thread.
+    The loop itself only runs a lag probe, so the capture barely slows the loop down.
+    The sampler needs the GIL to take a sample, so long stretches of pure Python work are under-sampled.
+    '''
+    def __init__(self, interval: float = 0.005, lag_interval: float = 0.05) -> None:
+        '''
+        interval: float         Seconds between the stack samples
+        lag_interval: float     Seconds between the loop lag probes
+        '''
+        self.interval: float = interval
+        self.lag_interval: float = lag_interval
+        self._report: Optional[ProfileReport] = None
+
+    @property
+    def running(self) -> bool:
+        return self._report is not None
+
+    def record_handler(self, name: str, seconds: float) -> None:
+        '''Record the wall time of a handler finished during the capture'''
+        if self._report is not None:
+            self._report.handlers.setdefault(name, []).append(seconds)
+
+    async def capture(self, seconds: float) -> ProfileReport:
+        if self._report is not None:
+            raise RuntimeError("A profile is already being captured")
+        report: ProfileReport = ProfileReport()
+        self._report = report
+        stop: threading.Event = threading.Event()
+        sampler: threading.Thread = threading.Thread(
+            target=self._sample, args=(threading.get_ident(), report, stop), name="confined_timeout_profiler", daemon=True)
+        report.tasks_start = report.tasks_max = len(asyncio.all_tasks())
+        start: float = time.perf_counter()
+        sampler.start()
+        try:
+            deadline: float = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                before: float = time.perf_counter()
+                await asyncio.sleep(self.lag_interval)
+                report.lags.append(max(0.0, time.perf_counter() - before - self.lag_interval))
+                report.tasks_max = max(report.tasks_max, len(asyncio.all_tasks()))
+        finally:
+            stop.set()
+            # The sampler wakes up within one interval
+            await asyncio.to_thread(sampler.join)
+            self._report = None
+        report.seconds = time.perf_counter() - start
+        report.tasks_end = len(asyncio.all_tasks())
+        return report
+
+    def _sample(self, thread_id: int, report: ProfileReport, stop: threading.Event) -> None:
+        labels: dict = {}
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            names: list[str] = []
+            idle: bool = os.path.basename(frame.f_code.co_filename) in IDLE_FILES
+            while frame is not None:
+                code = frame.f_code
+                label: Optional[str] = labels.get(code)
+                if label is None:
+                    label = labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                names.append(label)
+                frame = frame.f_back
+            names.reverse()
+            stack: str = ";".join(names)
+            report.stacks[stack] = report.stacks.get(stack, 0) + 1
+            report.samples += 1
+            if idle:
+                report.idle_samples += 1
@@ -0,0 +1,141 @@
+'''
+Confined Timeout
+Incremental reconciliation of the stored prisoners and the channel overwrites
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable, Iterable, Iterator, Optional
+
+class Reconciler:
+    '''
+    Walk the channels with a cursor, a bounded number of channels and API calls per tick.
+    A full cycle reads the channel keys lazily and the cursor moves through them tick by tick,
+    so the cost of a tick does not depend on the number of channels.
+    Channels touched by a jail or a release within the grace period are skipped until the next cycle,
+    as the gateway cache may not show the new overwrite yet.
+    A drift is only repaired once it is seen in two cycles in a row, so a change made by another process
+    has time to reach this one.
+    '''
+    def __init__(
+        self,
+        keys: Callable[[], Iterable[Hashable]],
+        check: Callable[[Hashable, int], Awaitable[tuple[int, bool]]],
+        interval: float = 30.0,
+        channels_per_tick: int = 20,
+        api_budget: int = 5,
+        grace: float = 60.0) -> None:
+        '''
+        keys: Callable              Return the channel keys of a new cycle, read as the cursor reaches them
+        check: Callable             Coroutine function reconciling the channel with at most the budget of API calls.
+                                    Return the API calls used and whether the channel is done.
+        interval: float             Seconds between the ticks
+        channels_per_tick: int      Channels checked in one tick
+        api_budget: int             API calls allowed in one tick
+        grace: float                Seconds a touched channel is left alone
+        '''
+        self.keys = keys
+        self.check = check
+        self.interval: float = interval
+        self.channels_per_tick: int = channels_per_tick
+        self.api_budget: int = api_budget
+        self.grace: float = grace
+        self._cycle: Optional[Iterator[Hashable]] = None
+        # The key at the cursor, kept while a channel is resumed on the next tick
+        self._current: Optional[Hashable] = None
+        self._touched: dict[Hashable, float] = {}
+        # Drifts seen in this cycle and in the previous one
+        self._flagged: set[Hashable] = set()
+        self._previous: set[Hashable] = set()
+        self._task: Optional[asyncio.Task] = None
+        self.stats: dict[str, int] = {"cycles": 0, "channels": 0, "api_calls": 0}
+
+    def touch(self, key: Hashable) -> None:
+        '''Mark the channel as just changed by this process'''
+        self._touched[key] = time.monotonic() + self.grace
+
+    def recently_touched(self, key: Hashable) -> bool:
+        until: Optional[float] = self._touched.get(key)
+        if until is None:
+            return False
+        if until < time.monotonic():
+            del self._touched[key]
+            return False
+        return True
+
+    def confirm(self, item: Hashable) -> bool:
+        '''Flag the drift and return whether it was already flagged in the previous cycle'''
+        self._flagged.add(item)
+        return item in self._previous
+
+    def reset(self) -> None:
+        '''Start over with a new cycle on the next tick'''
+        self._cycle = None
+        self._current = None
+        self._flagged.clear()
+        self._previous.clear()
+
+    async def tick(self) -> int:
+        '''Return the number of channels checked'''
+        if self._cycle is None:
+            self._cycle = iter(self.keys())
+            self.stats["cycles"] += 1
+            self._previous = self._flagged
+            self._flagged = set()
+            # Forget the expired touches once per cycle
+            now: float = time.monotonic()
+            self._touched = {k: t for k, t in self._touched.items() if t >= now}
+        budget: int = self.api_budget
+        checked: int = 0
+        while checked < self.channels_per_tick:
+            if self._current is None:
+                self._current = next(self._cycle, None)
+                if self._current is None:
+                    # The cycle is over, the next tick starts a new one
+                    self._cycle = None
+                    break
+            key: Hashable = self._current
+            if not self.recently_touched(key):
+                used, done = await self.check(key, budget)
+                budget -= used
+                self.stats["api_calls"] += used
+                if not done:
+                    # Resume from this channel with a fresh budget
+                    break
+            self._current = None
+            checked += 1
+            self.stats["channels"] += 1
+        return checked
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Reconciliation tick failed: {e!r}")
@@ -0,0 +1,121 @@
+'''
+Confined Timeout
+Entity resolution cache
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+import interactions
+
+from .metrics import DISCORD_SECONDS
+
+class EntityResolver:
+    '''
+    Resolve channels, users and members.
+    The gateway cache is checked first, then a TTL/LRU cache, and only then the REST API.
+    Concurrent requests of the same entity share one in-flight REST request.
+    '''
+    def __init__(self, bot: interactions.Client, ttl: float = 300.0, maxsize: int = 4096) -> None:
+        self.bot: interactions.Client = bot
+        self.ttl: float = ttl
+        self.maxsize: int = maxsize
+        self._cache: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self.stats: dict[str, int] = {
+            "gateway_hits": 0,
+            "cache_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "not_found": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._cache.pop(key, None)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def _get_cached(self, key: Hashable) -> Optional[Any]:
+        item: Optional[tuple[float, Any]] = self._cache.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return item[1]
+
+    def _put(self, key: Hashable, value: Any) -> None:
+        self._cache[key] = (time.monotonic() + self.ttl, value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    async def _resolve(self, key: Hashable, gateway: Optional[Any], fetch: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        if gateway is not None:
+            self.stats["gateway_hits"] += 1
+            return gateway
+        cached: Optional[Any] = self._get_cached(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+        future: Optional[asyncio.Future] = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(future)
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            with DISCORD_SECONDS.time(f"fetch_{key[0]}"):
+                try:
+                    value: Optional[Any] = await fetch()
+                except interactions.errors.NotFound:
+                    value = None
+            if value is None:
+                self.stats["not_found"] += 1
+            else:
+                self._put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Only the waiters should see the exception
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    ################ Entities ################
+
+    async def channel(self, channel_id: int) -> Optional[interactions.BaseChannel]:
+        return await self._resolve(("channel", channel_id), self.bot.cache.get_channel(channel_id), lambda: self.bot.cache.fetch_channel(channel_id))
+
+    async def user(self, user_id: int) -> Optional[interactions.User]:
+        return await self._resolve(("user", user_id), self.bot.cache.get_user(user_id), lambda: self.bot.cache.fetch_user(user_id))
+
+    async def member(self, guild_id: int, user_id: int) -> Optional[interactions.Member]:
+        return await self._resolve(("member", guild_id, user_id), self.bot.cache.get_member(guild_id, user_id), lambda: self.bot.cache.fetch_member(guild_id, user_id))
@@ -0,0 +1,214 @@
+'''
+Confined Timeout
+Release scheduler
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+class ReleaseScheduler:
+    '''
+    A single min-heap of release times driven by one loop task.
+    Cancelled entries are marked and skipped lazily when they reach the top of the heap.
+    '''
+    def __init__(self, callback: Callable[[list[Hashable]], Awaitable[Any]]) -> None:
+        '''
+        callback: Callable  Coroutine function receiving all the keys due in one wake-up
+        '''
+        self.callback = callback
+        self._heap: list[list] = []
+        self._entries: dict[Hashable, list] = {}
+        self._counter = itertools.count()
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def schedule(self, key: Hashable, when: float) -> None:
+        '''
+        Schedule the key at the epoch timestamp. Rescheduling replaces the previous entry.
+        '''
+        self.cancel(key)
+        entry: list = [when, next(self._counter), key]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        # Only wake the loop up if the new entry is the earliest one
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def cancel(self, key: Hashable) -> bool:
+        '''
+        Return False if the key is not scheduled
+        '''
+        entry: Optional[list] = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        # Compact the heap once most of it is cancelled entries
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._entries):
+            self._heap = [e for e in self._heap if e[2] is not None]
+            heapq.heapify(self._heap)
+        return True
+
+    def clear(self) -> None:
+        self._heap.clear()
+        self._entries.clear()
+
+    def pop_due(self, now: float) -> list[Hashable]:
+        '''
+        Remove and return all the keys due at the timestamp
+        '''
+        due: list[Hashable] = []
+        while self._heap and self._heap[0][0] <= now:
+            entry: list = heapq.heappop(self._heap)
+            if entry[2] is not None:
+                del self._entries[entry[2]]
+                due.append(entry[2])
+        return due
+
+    def next_time(self) -> Optional[float]:
+        while self._heap and self._heap[0][2] is None:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            next_time: Optional[float] = self.next_time()
+            timeout: Optional[float] = None if next_time is None else max(next_time - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            due: list[Hashable] = self.pop_due(time.time())
+            if not due:
+                continue
+            try:
+                await self.callback(due)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Release scheduler callback failed: {e!r}")
+
+def release_horizon() -> int:
+    '''The seconds of releases kept in memory, from CONFINED_TIMEOUT_RELEASE_HORIZON or one hour'''
+    horizon: str = os.environ.get("CONFINED_TIMEOUT_RELEASE_HORIZON", "")
+    return int(horizon) if horizon.isdigit() and int(horizon) > 0 else 3600
+
+class HorizonLoader:
+    '''
+    Keep only the releases due within the horizon in the scheduler.
+    The loader pages the next window in from the storage before the loaded one runs out,
+    so the scheduler holds the near-term releases however many long timeouts are stored.
+    Releases beyond the loaded window are left to the storage and picked up by a later page.
+    '''
+    def __init__(
+        self,
+        scheduler: ReleaseScheduler,
+        load: Callable[[int, int], Awaitable[list[tuple[Hashable, int]]]],
+        horizon: int = 3600,
+        interval: Optional[float] = None) -> None:
+        '''
+        scheduler: ReleaseScheduler     The scheduler to fill
+        load: Callable                  Coroutine function returning the (key, release epoch seconds) after the first time up to the second
+        horizon: int                    Seconds ahead of now to keep loaded
+        interval: float                 (Optional) Seconds between the pages, a quarter of the horizon by default
+        '''
+        self.scheduler: ReleaseScheduler = scheduler
+        self.load = load
+        self.horizon: int = horizon
+        self.interval: float = interval if interval is not None else max(horizon / 4, 1)
+        # Everything due up to this epoch second is in the scheduler
+        self.loaded_until: Optional[int] = None
+        # The bound of the page being loaded
+        self._loading_until: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def covers(self, when: int) -> bool:
+        return self.loaded_until is not None and when <= self.loaded_until
+
+    def offer(self, key: Hashable, when: int) -> bool:
+        '''
+        Schedule the key if it is due within the loaded window or the page being loaded.
+        Return whether it is scheduled.
+        '''
+        # The query of the page may not see a row written meanwhile, so it is scheduled now
+        if not (self.covers(when) or (self._loading_until is not None and when <= self._loading_until)):
+            return False
+        self.scheduler.schedule(key, when)
+        return True
+
+    async def advance(self, since: Optional[int] = None) -> int:
+        '''
+        Load the releases up to the horizon from now, after since on the first page.
+        Return the number of releases loaded.
+        '''
+        previous: Optional[int] = self.loaded_until
+        start: int = previous if previous is not None else since if since is not None else int(time.time())
+        until: int = max(int(time.time()) + self.horizon, start)
+        # The releases offered during the query are scheduled by offer, and the bound only
+        # moves once the rows of the page are in the scheduler
+        self._loading_until = until
+        try:
+            rows: list[tuple[Hashable, int]] = await self.load(start, until)
+        finally:
+            self._loading_until = None
+        for key, when in rows:
+            self.scheduler.schedule(key, when)
+        self.loaded_until = until
+        return len(rows)
+
+    def reset(self) -> None:
+        self.loaded_until = None
+        self._loading_until = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.advance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Release window load failed: {e!r}")
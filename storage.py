@@ -0,0 +1,496 @@
+'''
+Confined Timeout
+Storage backends
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Collection, Iterable, Optional, Protocol
+
+import sqlalchemy
+from sqlalchemy import select as sqlselect
+from sqlalchemy import delete as sqldelete
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, async_sessionmaker
+
+from .model import HISTORY_TABLE_PREFIX, GlobalAdminDB, HistorySummaryDB, ModeratorDB, PrisonerDB, SettingDB, history_table
+from .history import HistoryEvent, HistoryKind, history_bucket
+from .writer import DBWriter
+from .migration import migrate
+from .coordination import Coordinator, guild_shard
+
+@dataclass
+class GuildRows:
+    '''All the stored rows of one guild'''
+    __slots__ = ('admins', 'moderators', 'prisoners', 'settings')
+    # (id, type)
+    admins: list[tuple[int, int]]
+    # (id, type, channel_id)
+    moderators: list[tuple[int, int, int]]
+    # (id, channel_id, release_at)
+    prisoners: list[tuple[int, int, int]]
+    # (type, setting, setting1)
+    settings: list[tuple[int, int, Optional[str]]]
+
+class Storage(Protocol):
+    '''
+    The persistence used by the extension.
+    The writes return awaitables resolved once the write is durable, and callers are not required to wait for them.
+    '''
+    async def open(self) -> None:
+        '''Prepare the storage before any other call'''
+        ...
+
+    async def close(self) -> None:
+        '''Write everything pending and release the resources'''
+        ...
+
+    def flush(self) -> Awaitable[None]:
+        '''Resolved once everything written so far is durable'''
+        ...
+
+    def create_coordinator(self) -> Optional[Coordinator]:
+        '''The coordinator of the processes sharing the storage, or None if it cannot be shared'''
+        ...
+
+    async def load_guild(self, guild_id: int) -> GuildRows: ...
+
+    async def load_prisoners(self, guild_ids: Optional[Iterable[int]] = None, shards: Optional[tuple[Collection[int], int]] = None) -> list[tuple[int, int, int, int]]:
+        '''
+        The (guild_id, id, channel_id, release_at) of the prisoners in the guilds,
+        or in the guilds of the (shard_ids, total_shards), or everywhere.
+        The release times are UTC epoch seconds.
+        '''
+        ...
+
+    async def load_due(self, since: Optional[int] = None, until: Optional[int] = None, shards: Optional[tuple[Collection[int], int]] = None) -> list[tuple[int, int, int, int]]:
+        '''
+        The (guild_id, id, channel_id, release_at) of the prisoners released after since and at or before until,
+        either bound left out, in the order of the release time
+        '''
+        ...
+
+    def add_prisoner(self, guild_id: int, id: int, channel_id: int, release_at: int) -> Awaitable[None]: ...
+
+    def remove_prisoner(self, guild_id: int, id: int, channel_id: int) -> Awaitable[None]: ...
+
+    def remove_prisoners(self, guild_id: int, channel_id: int, ids: Optional[list[int]] = None) -> Awaitable[None]:
+        '''Remove the prisoners of the channel, all of them if ids is None'''
+        ...
+
+    def remove_overdue(self, guild_id: int, before: int, keep: list[tuple[int, int]]) -> Awaitable[None]:
+        '''Remove the prisoners of the guild released at or before the epoch seconds except the kept (id, channel_id)'''
+        ...
+
+    def add_admin(self, guild_id: int, id: int, type: int) -> Awaitable[None]: ...
+
+    def remove_admin(self, guild_id: int, id: int, type: int) -> Awaitable[None]: ...
+
+    def add_moderator(self, guild_id: int, id: int, type: int, channel_id: int) -> Awaitable[None]: ...
+
+    def remove_moderator(self, guild_id: int, id: int, type: int, channel_id: int) -> Awaitable[None]: ...
+
+    def upsert_setting(self, guild_id: int, type: int, setting: int, setting1: Optional[str]) -> Awaitable[None]: ...
+
+    async def legacy_rows(self) -> tuple[list[int], int]:
+        '''The channels of the moderator and prisoner rows without a guild, and the number of global admins without a guild'''
+        ...
+
+    def adopt_legacy(self, guild_id: int, channel_id: Optional[int] = None) -> Awaitable[None]:
+        '''Assign the rows without a guild to the guild, only the rows of the channel if given'''
+        ...
+
+    async def add_history(self, events: list[HistoryEvent]) -> None:
+        '''Append the events to the buckets of their months'''
+        ...
+
+    async def load_history(self, guild_id: int, user_id: Optional[int] = None, channel_id: Optional[int] = None, limit: int = 100) -> list[HistoryEvent]:
+        '''The latest events of the guild, of the user or in the channel or both'''
+        ...
+
+    async def history_summary(self, guild_id: int, user_id: Optional[int] = None, channel_id: Optional[int] = None) -> tuple[int, int, int]:
+        '''The jails, the releases and the jailed seconds of the buckets dropped by the retention'''
+        ...
+
+    async def compact_history(self, before: int) -> int:
+        '''Summarize and drop the buckets before the bucket. Return the number of buckets dropped.'''
+        ...
+
+################ SQLite ################
+
+class SQLiteStorage:
+    '''
+    SQLite database through aiosqlite.
+    All the writes go through the write-behind writer.
+    '''
+    def __init__(self, path: str, window: float = 0.05, batch_size: int = 500) -> None:
+        self.engine: AsyncEngine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        sqlalchemy.event.listen(self.engine.sync_engine, "connect", self._do_connect)
+        sqlalchemy.event.listen(self.engine.sync_engine, "begin", self._do_begin)
+        self.Session = async_sessionmaker(self.engine)
+        self.writer: DBWriter = DBWriter(self.Session, window, batch_size)
+        # The history buckets known to have a table
+        self.history_tables: set[int] = set()
+
+    @staticmethod
+    def _do_connect(dbapi_connection, connection_record) -> None:
+        dbapi_connection.isolation_level = None
+        # WAL lets the readers run while the writer commits
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA cache_size=-16000")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    @staticmethod
+    def _do_begin(conn) -> None:
+        conn.exec_driver_sql("BEGIN")
+
+    async def open(self) -> None:
+        await migrate(self.engine)
+
+    async def close(self) -> None:
+        await self.writer.close()
+        await self.engine.dispose()
+
+    def flush(self) -> Awaitable[None]:
+        return self.writer.flush()
+
+    def create_coordinator(self) -> Optional[Coordinator]:
+        coordinator: Coordinator = Coordinator(self.Session)
+        # Record the changed guilds for the other processes
+        self.writer.change_origin = coordinator.owner
+        return coordinator
+
+    async def load_guild(self, guild_id: int) -> GuildRows:
+        # The pending writes of an evicted partition have to be visible before reading
+        await self.writer.flush()
+        async with self.Session() as conn:
+            gas = await conn.execute(sqlselect(GlobalAdminDB.id, GlobalAdminDB.type).where(GlobalAdminDB.guild_id == guild_id))
+            cms = await conn.execute(sqlselect(ModeratorDB.id, ModeratorDB.type, ModeratorDB.channel_id).where(ModeratorDB.guild_id == guild_id))
+            ps  = await conn.execute(sqlselect(PrisonerDB.id, PrisonerDB.channel_id, PrisonerDB.release_at).where(PrisonerDB.guild_id == guild_id))
+            gss = await conn.execute(sqlselect(SettingDB.type, SettingDB.setting, SettingDB.setting1).where(SettingDB.guild_id == guild_id))
+            return GuildRows(
+                [tuple(r) for r in gas],
+                [tuple(r) for r in cms],
+                [tuple(r) for r in ps],
+                [tuple(r) for r in gss]
+            )
+
+    @staticmethod
+    def _prisoner_query(shards: Optional[tuple[Collection[int], int]]):
+        stmt = sqlselect(PrisonerDB.guild_id, PrisonerDB.id, PrisonerDB.channel_id, PrisonerDB.release_at)
+        if shards is not None and shards[1] > 1:
+            stmt = stmt.where((PrisonerDB.guild_id.op(">>")(22) % shards[1]).in_(list(shards[0])))
+        return stmt
+
+    async def load_prisoners(self, guild_ids: Optional[Iterable[int]] = None, shards: Optional[tuple[Collection[int], int]] = None) -> list[tuple[int, int, int, int]]:
+        stmt = self._prisoner_query(shards)
+        if guild_ids is not None:
+            stmt = stmt.where(PrisonerDB.guild_id.in_(list(guild_ids)))
+        async with self.Session() as conn:
+            return [tuple(r) for r in await conn.execute(stmt)]
+
+    async def load_due(self, since: Optional[int] = None, until: Optional[int] = None, shards: Optional[tuple[Collection[int], int]] = None) -> list[tuple[int, int, int, int]]:
+        # The prisoners jailed beyond the loaded release window have to be visible to the next page
+        await self.writer.flush()
+        # A range scan of the release time index
+        stmt = self._prisoner_query(shards).order_by(PrisonerDB.release_at)
+        if since is not None:
+            stmt = stmt.where(PrisonerDB.release_at > since)
+        if until is not None:
+            stmt = stmt.where(PrisonerDB.release_at <= until)
+        async with self.Session() as conn:
+            return [tuple(r) for r in await conn.execute(stmt)]
+
+    def add_prisoner(self, guild_id: int, id: int, channel_id: int, release_at: int) -> Awaitable[None]:
+        return self.writer.insert(PrisonerDB, guild_id=guild_id, id=id, channel_id=channel_id, release_at=release_at)
+
+    def remove_prisoner(self, guild_id: int, id: int, channel_id: int) -> Awaitable[None]:
+        return self.writer.delete(PrisonerDB, guild_id=guild_id, id=id, channel_id=channel_id)
+
+    def remove_prisoners(self, guild_id: int, channel_id: int, ids: Optional[list[int]] = None) -> Awaitable[None]:
+        where = sqlalchemy.and_(PrisonerDB.guild_id == guild_id, PrisonerDB.channel_id == channel_id)
+        if ids is not None:
+            where = sqlalchemy.and_(where, PrisonerDB.id.in_(ids))
+        return self.writer.execute(sqldelete(PrisonerDB).where(where), guild_id)
+
+    def remove_overdue(self, guild_id: int, before: int, keep: list[tuple[int, int]]) -> Awaitable[None]:
+        stmt = sqldelete(PrisonerDB).where(sqlalchemy.and_(
+            PrisonerDB.guild_id == guild_id,
+            PrisonerDB.release_at <= before
+        ))
+        if len(keep) > 0:
+            stmt = stmt.where(sqlalchemy.tuple_(PrisonerDB.id, PrisonerDB.channel_id).not_in(keep))
+        return self.writer.execute(stmt, guild_id)
+
+    def add_admin(self, guild_id: int, id: int, type: int) -> Awaitable[None]:
+        return self.writer.insert(GlobalAdminDB, guild_id=guild_id, id=id, type=type)
+
+    def remove_admin(self, guild_id: int, id: int, type: int) -> Awaitable[None]:
+        return self.writer.delete(GlobalAdminDB, guild_id=guild_id, id=id, type=type)
+
+    def add_moderator(self, guild_id: int, id: int, type: int, channel_id: int) -> Awaitable[None]:
+        return self.writer.insert(ModeratorDB, guild_id=guild_id, id=id, type=type, channel_id=channel_id)
+
+    def remove_moderator(self, guild_id: int, id: int, type: int, channel_id: int) -> Awaitable[None]:
+        return self.writer.delete(ModeratorDB, guild_id=guild_id, id=id, type=type, channel_id=channel_id)
+
+    def upsert_setting(self, guild_id: int, type: int, setting: int, setting1: Optional[str]) -> Awaitable[None]:
+        return self.writer.upsert(SettingDB, guild_id=guild_id, type=type, setting=setting, setting1=setting1)
+
+    async def legacy_rows(self) -> tuple[list[int], int]:
+        async with self.Session() as conn:
+            channel_ids: list[int] = list((await conn.execute(
+                sqlalchemy.union(
+                    sqlselect(ModeratorDB.channel_id).where(ModeratorDB.guild_id == 0),
+                    sqlselect(PrisonerDB.channel_id).where(PrisonerDB.guild_id == 0)
+                )
+            )).scalars())
+            admins: int = (await conn.execute(sqlselect(sqlalchemy.func.count()).select_from(GlobalAdminDB).where(GlobalAdminDB.guild_id == 0))).scalar()
+        return channel_ids, admins
+
+    def adopt_legacy(self, guild_id: int, channel_id: Optional[int] = None) -> Awaitable[None]:
+        if channel_id is None:
+            for model in (GlobalAdminDB, ModeratorDB, PrisonerDB, SettingDB):
+                self.writer.execute(sqlalchemy.update(model).where(model.guild_id == 0).values(guild_id=guild_id).prefix_with("OR IGNORE"), guild_id)
+        else:
+            for model in (ModeratorDB, PrisonerDB):
+                self.writer.execute(sqlalchemy.update(model).where(sqlalchemy.and_(
+                    model.guild_id == 0,
+                    model.channel_id == channel_id
+                )).values(guild_id=guild_id).prefix_with("OR IGNORE"), guild_id)
+        return self.writer.flush()
+
+    ################ History ################
+
+    async def _history_buckets(self, conn) -> list[int]:
+        '''The buckets with a table, the latest first'''
+        names = await conn.execute(sqlalchemy.text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix"), {"prefix": f"{HISTORY_TABLE_PREFIX}%"})
+        suffixes: list[str] = [name[len(HISTORY_TABLE_PREFIX):] for name in names.scalars()]
+        return sorted((int(b) for b in suffixes if b.isdigit()), reverse=True)
+
+    async def add_history(self, events: list[HistoryEvent]) -> None:
+        # Its own transaction so a failed history write never takes the prisoner writes down
+        by_bucket: dict[int, list[dict]] = {}
+        for at, guild_id, kind, user_id, channel_id, moderator_id, duration, reason in events:
+            by_bucket.setdefault(history_bucket(at), []).append({
+                "guild_id": guild_id, "at": at, "kind": kind, "user_id": user_id, "channel_id": channel_id,
+                "moderator_id": moderator_id, "duration": duration, "reason": reason
+            })
+        async with self.Session() as session:
+            for bucket, rows in by_bucket.items():
+                table: sqlalchemy.Table = history_table(bucket)
+                if bucket not in self.history_tables:
+                    await session.run_sync(lambda s, t=table: t.create(s.connection(), checkfirst=True))
+                await session.execute(sqlalchemy.insert(table), rows)
+            await session.commit()
+        self.history_tables.update(by_bucket)
+
+    async def load_history(self, guild_id: int, user_id: Optional[int] = None, channel_id: Optional[int] = None, limit: int = 100) -> list[HistoryEvent]:
+        result: list[HistoryEvent] = []
+        async with self.Session() as conn:
+            # The buckets are read from the latest until there are enough events
+            for bucket in await self._history_buckets(conn):
+                table: sqlalchemy.Table = history_table(bucket)
+                c = table.c
+                stmt = sqlselect(c.at, c.guild_id, c.kind, c.user_id, c.channel_id, c.moderator_id, c.duration, c.reason).where(c.guild_id == guild_id)
+                if user_id is not None:
+                    stmt = stmt.where(c.user_id == user_id)
+                if channel_id is not None:
+                    stmt = stmt.where(c.channel_id == channel_id)
+                stmt = stmt.order_by(c.at.desc(), c.uid.desc()).limit(limit - len(result))
+                result.extend(tuple(r) for r in await conn.execute(stmt))
+                if len(result) >= limit:
+                    break
+        return result
+
+    async def history_summary(self, guild_id: int, user_id: Optional[int] = None, channel_id: Optional[int] = None) -> tuple[int, int, int]:
+        stmt = sqlselect(
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(HistorySummaryDB.jails), 0),
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(HistorySummaryDB.releases), 0),
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(HistorySummaryDB.jailed_seconds), 0)
+        ).where(HistorySummaryDB.guild_id == guild_id)
+        if user_id is not None:
+            stmt = stmt.where(HistorySummaryDB.user_id == user_id)
+        if channel_id is not None:
+            stmt = stmt.where(HistorySummaryDB.channel_id == channel_id)
+        async with self.Session() as conn:
+            return tuple((await conn.execute(stmt)).one())
+
+    async def compact_history(self, before: int) -> int:
+        async with self.Session() as session:
+            buckets: list[int] = [b for b in await self._history_buckets(session) if b < before]
+            for bucket in buckets:
+                table: sqlalchemy.Table = history_table(bucket)
+                # The WHERE clause tells the SQLite parser the ON CONFLICT belongs to the INSERT
+                await session.execute(sqlalchemy.text(
+                    f"INSERT INTO {HistorySummaryDB.__tablename__} (guild_id, bucket, user_id, channel_id, jails, releases, jailed_seconds) "
+                    f"SELECT guild_id, {bucket}, user_id, channel_id, "
+                    f"SUM(kind = {HistoryKind.JAIL.value}), SUM(kind = {HistoryKind.RELEASE.value}), "
+                    f"SUM(CASE WHEN kind = {HistoryKind.JAIL.value} THEN duration ELSE 0 END) "
+                    f"FROM {table.name} WHERE true GROUP BY guild_id, user_id, channel_id "
+                    "ON CONFLICT (guild_id, bucket, user_id, channel_id) DO UPDATE SET "
+                    "jails = jails + excluded.jails, releases = releases + excluded.releases, jailed_seconds = jailed_seconds + excluded.jailed_seconds"
+                ))
+                # Dropping the whole table is the bulk delete of the month
+                await session.execute(sqlalchemy.text(f"DROP TABLE {table.name}"))
+            await session.commit()
+        self.history_tables.difference_update(buckets)
+        return len(buckets)
+
+################ Memory ################
+
+def _done() -> asyncio.Future:
+    future: asyncio.Future = asyncio.get_running_loop().create_future()
+    future.set_result(None)
+    return future
+
+class MemoryStorage:
+    '''
+    Everything is kept in dictionaries and lost on exit.
+    The writes are applied immediately, for the benchmarks and the load tests.
+    '''
+    def __init__(self) -> None:
+        self.admins: dict[int, set[tuple[int, int]]] = {}
+        self.moderators: dict[int, set[tuple[int, int, int]]] = {}
+        self.prisoners: dict[int, dict[tuple[int, int], int]] = {}
+        self.settings: dict[int, dict[int, tuple[int, Optional[str]]]] = {}
+        self.history: dict[int, list[HistoryEvent]] = {}
+        # (guild_id, bucket, user_id, channel_id) -> [jails, releases, jailed seconds]
+        self.summaries: dict[tuple[int, int, int, int], list[int]] = {}
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    def flush(self) -> Awaitable[None]:
+        return _done()
+
+    def create_coordinator(self) -> Optional[Coordinator]:
+        return None
+
+    async def load_guild(self, guild_id: int) -> GuildRows:
+        return GuildRows(
+            list(self.admins.get(guild_id, ())),
+            list(self.moderators.get(guild_id, ())),
+            [(id, channel_id, release_at) for (id, channel_id), release_at in self.prisoners.get(guild_id, {}).items()],
+            [(type, setting, setting1) for type, (setting, setting1) in self.settings.get(guild_id, {}).items()]
+        )
+
+    async def load_prisoners(self, guild_ids: Optional[Iterable[int]] = None, shards: Optional[tuple[Collection[int], int]] = None) -> list[tuple[int, int, int, int]]:
+        gids: Iterable[int] = self.prisoners.keys() if guild_ids is None else [gid for gid in guild_ids if gid in self.prisoners]
+        if shards is not None and shards[1] > 1:
+            gids = [gid for gid in gids if guild_shard(gid, shards[1]) in shards[0]]
+        return [
+            (gid, id, channel_id, release_at)
+            for gid in gids for (id, channel_id), release_at in self.prisoners[gid].items()
+        ]
+
+    async def load_due(self, since: Optional[int] = None, until: Optional[int] = None, shards: Optional[tuple[Collection[int], int]] = None) -> list[tuple[int, int, int, int]]:
+        return sorted((
+            r for r in await self.load_prisoners(shards=shards)
+            if (since is None or r[3] > since) and (until is None or r[3] <= until)
+        ), key=lambda r: r[3])
+
+    def add_prisoner(self, guild_id: int, id: int, channel_id: int, release_at: int) -> Awaitable[None]:
+        self.prisoners.setdefault(guild_id, {}).setdefault((id, channel_id), release_at)
+        return _done()
+
+    def remove_prisoner(self, guild_id: int, id: int, channel_id: int) -> Awaitable[None]:
+        self.prisoners.get(guild_id, {}).pop((id, channel_id), None)
+        return _done()
+
+    def remove_prisoners(self, guild_id: int, channel_id: int, ids: Optional[list[int]] = None) -> Awaitable[None]:
+        ps: dict[tuple[int, int], int] = self.prisoners.get(guild_id, {})
+        if ids is None:
+            for key in [k for k in ps if k[1] == channel_id]:
+                del ps[key]
+        else:
+            for id in ids:
+                ps.pop((id, channel_id), None)
+        return _done()
+
+    def remove_overdue(self, guild_id: int, before: int, keep: list[tuple[int, int]]) -> Awaitable[None]:
+        ps: dict[tuple[int, int], int] = self.prisoners.get(guild_id, {})
+        kept: set[tuple[int, int]] = set(keep)
+        for key in [k for k, t in ps.items() if t <= before and k not in kept]:
+            del ps[key]
+        return _done()
+
+    def add_admin(self, guild_id: int, id: int, type: int) -> Awaitable[None]:
+        self.admins.setdefault(guild_id, set()).add((id, type))
+        return _done()
+
+    def remove_admin(self, guild_id: int, id: int, type: int) -> Awaitable[None]:
+        self.admins.get(guild_id, set()).discard((id, type))
+        return _done()
+
+    def add_moderator(self, guild_id: int, id: int, type: int, channel_id: int) -> Awaitable[None]:
+        self.moderators.setdefault(guild_id, set()).add((id, type, channel_id))
+        return _done()
+
+    def remove_moderator(self, guild_id: int, id: int, type: int, channel_id: int) -> Awaitable[None]:
+        self.moderators.get(guild_id, set()).discard((id, type, channel_id))
+        return _done()
+
+    def upsert_setting(self, guild_id: int, type: int, setting: int, setting1: Optional[str]) -> Awaitable[None]:
+        self.settings.setdefault(guild_id, {})[type] = (setting, setting1)
+        return _done()
+
+    async def legacy_rows(self) -> tuple[list[int], int]:
+        return [], 0
+
+    def adopt_legacy(self, guild_id: int, channel_id: Optional[int] = None) -> Awaitable[None]:
+        return _done()
+
+    async def add_history(self, events: list[HistoryEvent]) -> None:
+        for event in events:
+            self.history.setdefault(history_bucket(event[0]), []).append(event)
+
+    async def load_history(self, guild_id: int, user_id: Optional[int] = None, channel_id: Optional[int] = None, limit: int = 100) -> list[HistoryEvent]:
+        result: list[HistoryEvent] = []
+        for bucket in sorted(self.history, reverse=True):
+            result.extend(
+                e for e in reversed(self.history[bucket])
+                if e[1] == guild_id and (user_id is None or e[3] == user_id) and (channel_id is None or e[4] == channel_id)
+            )
+            if len(result) >= limit:
+                break
+        return result[:limit]
+
+    async def history_summary(self, guild_id: int, user_id: Optional[int] = None, channel_id: Optional[int] = None) -> tuple[int, int, int]:
+        totals: list[int] = [0, 0, 0]
+        for (gid, _, uid, cid), values in self.summaries.items():
+            if gid == guild_id and (user_id is None or uid == user_id) and (channel_id is None or cid == channel_id):
+                totals = [a + b for a, b in zip(totals, values)]
+        return tuple(totals)
+
+    async def compact_history(self, before: int) -> int:
+        buckets: list[int] = [b for b in self.history if b < before]
+        for bucket in buckets:
+            for at, guild_id, kind, user_id, channel_id, moderator_id, duration, reason in self.history.pop(bucket):
+                values: list[int] = self.summaries.setdefault((guild_id, bucket, user_id, channel_id), [0, 0, 0])
+                if kind == HistoryKind.JAIL:
+                    values[0] += 1
+                    values[2] += duration
+                else:
+                    values[1] += 1
+        return len(buckets)
@@ -0,0 +1,31 @@
+'''
+Confined Timeout
+Test setup
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+The extension is imported from its directory as the package below without installing it.
+'''
+import os
+import sys
+import types
+
+PACKAGE_NAME: str = "confined_timeout_test"
+
+if PACKAGE_NAME not in sys.modules:
+    package: types.ModuleType = types.ModuleType(PACKAGE_NAME)
+    package.__path__ = [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+    sys.modules[PACKAGE_NAME] = package
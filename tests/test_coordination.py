@@ -0,0 +1,56 @@
+'''
+Confined Timeout
+Tests of the coordination between the processes
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from conftest import PACKAGE_NAME
+
+coordination = importlib.import_module(f"{PACKAGE_NAME}.coordination")
+model = importlib.import_module(f"{PACKAGE_NAME}.model")
+
+def test_lease_lost_when_renewal_fails_past_ttl(tmp_path) -> None:
+    async def run() -> None:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'lease.db'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(model.DBBase.metadata.create_all)
+        try:
+            coordinator = coordination.Coordinator(async_sessionmaker(engine), owner="a", lease_ttl=0.2)
+            events: list[str] = []
+            async def on_acquire(name: str) -> None:
+                events.append("acquire")
+            async def on_lose(name: str) -> None:
+                events.append("lose")
+            coordinator.want("release", on_acquire, on_lose)
+            await coordinator._renew()
+            assert coordinator.holds("release") and events == ["acquire"]
+            async def fail(name: str) -> bool:
+                raise OSError("database is locked")
+            coordinator.try_acquire = fail
+            # Within the TTL the lease is still valid for the others
+            await coordinator._renew()
+            assert coordinator.holds("release") and events == ["acquire"]
+            await asyncio.sleep(0.25)
+            await coordinator._renew()
+            assert not coordinator.holds("release") and events == ["acquire", "lose"]
+        finally:
+            await engine.dispose()
+    asyncio.run(run())
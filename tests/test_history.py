@@ -0,0 +1,117 @@
+'''
+Confined Timeout
+Tests of the moderation history and its retention
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import calendar
+import importlib
+import sqlite3
+
+import pytest
+
+from conftest import PACKAGE_NAME
+
+history = importlib.import_module(f"{PACKAGE_NAME}.history")
+storage_module = importlib.import_module(f"{PACKAGE_NAME}.storage")
+
+JAIL: int = history.HistoryKind.JAIL.value
+RELEASE: int = history.HistoryKind.RELEASE.value
+
+def at(year: int, month: int, day: int = 1) -> int:
+    return calendar.timegm((year, month, day, 12, 0, 0))
+
+# (at, guild_id, kind, user_id, channel_id, moderator_id, duration, reason)
+EVENTS: list = [
+    (at(2024, 1, 5), 1, JAIL, 10, 100, 7, 600, "spam"),
+    (at(2024, 1, 6), 1, RELEASE, 10, 100, 0, 0, "Expired"),
+    (at(2024, 2, 1), 1, JAIL, 10, 100, 7, 60, ""),
+    (at(2024, 2, 2), 1, JAIL, 11, 200, 7, 120, ""),
+    (at(2024, 2, 3), 2, JAIL, 10, 100, 7, 30, ""),
+    (at(2024, 6, 1), 1, JAIL, 10, 100, 7, 900, "again"),
+]
+
+def test_buckets() -> None:
+    assert history.history_bucket(at(2024, 1, 31)) == 202401
+    assert history.history_bucket(at(2023, 12, 31)) == 202312
+    assert history.months_before(202403, 6) == 202309
+    assert history.months_before(202401, 1) == 202312
+    assert history.months_before(202412, 0) == 202412
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return storage_module.MemoryStorage()
+    return storage_module.SQLiteStorage(str(tmp_path / "history.db"))
+
+def history_tables(path: str) -> list[str]:
+    db: sqlite3.Connection = sqlite3.connect(path)
+    try:
+        return sorted(r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'History%' AND name != 'HistorySummaryDB'"))
+    finally:
+        db.close()
+
+def test_history_buckets_and_retention(backend, tmp_path) -> None:
+    async def run() -> None:
+        await backend.open()
+        try:
+            await backend.add_history(EVENTS)
+            # The latest first across the buckets
+            assert await backend.load_history(1) == [e for e in reversed(EVENTS) if e[1] == 1]
+            assert await backend.load_history(1, user_id=10, limit=2) == [EVENTS[5], EVENTS[2]]
+            assert await backend.load_history(1, channel_id=200) == [EVENTS[3]]
+            if isinstance(backend, storage_module.SQLiteStorage):
+                assert len(history_tables(str(tmp_path / "history.db"))) == 3
+            assert await backend.compact_history(202406) == 2
+            # The detailed events of the dropped months are gone, their totals are kept
+            assert await backend.load_history(1) == [EVENTS[5]]
+            assert await backend.history_summary(1) == (3, 1, 780)
+            assert await backend.history_summary(1, user_id=10) == (2, 1, 660)
+            assert await backend.history_summary(1, channel_id=200) == (1, 0, 120)
+            assert await backend.history_summary(2) == (1, 0, 30)
+            if isinstance(backend, storage_module.SQLiteStorage):
+                assert len(history_tables(str(tmp_path / "history.db"))) == 1
+            # A late event of a summarized month is added to its existing totals
+            await backend.add_history([(at(2024, 1, 20), 1, JAIL, 10, 100, 7, 40, "")])
+            assert await backend.compact_history(202406) == 1
+            assert await backend.history_summary(1, user_id=10, channel_id=100) == (3, 1, 700)
+            assert await backend.compact_history(202406) == 0
+        finally:
+            await backend.close()
+    asyncio.run(run())
+
+def test_recorder_writes_in_batches_and_runs_retention() -> None:
+    async def run() -> None:
+        backend = storage_module.MemoryStorage()
+        writes: list[int] = []
+        async def write(events: list) -> None:
+            writes.append(len(events))
+            await backend.add_history(events)
+        recorder = history.HistoryRecorder(write, backend.compact_history, window=0.01, batch_size=2, retention_months=0)
+        for user_id in range(5):
+            recorder.record(1, history.HistoryKind.JAIL, user_id, 100, moderator_id=7, reason="r" * 300, duration=60)
+        assert len(recorder) == 5
+        await asyncio.sleep(0.05)
+        assert writes == [2, 2, 1] and len(recorder) == 0
+        events = await backend.load_history(1)
+        assert len(events) == 5 and all(len(e[7]) == history.REASON_LIMIT for e in events)
+        # Nothing is older than the current month
+        assert await recorder.run_retention() == 0
+        backend.history = {history.months_before(b, 1): e for b, e in backend.history.items()}
+        assert await recorder.run_retention() == 1
+        assert await backend.history_summary(1) == (5, 0, 300)
+    asyncio.run(run())
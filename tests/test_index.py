@@ -0,0 +1,80 @@
+'''
+Confined Timeout
+Tests of the in-memory indexes
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import importlib
+import random
+
+from conftest import PACKAGE_NAME
+
+index = importlib.import_module(f"{PACKAGE_NAME}.index")
+
+def test_load_matches_insert() -> None:
+    rng: random.Random = random.Random(1)
+    rows: list[tuple[int, int, int]] = [(rng.randrange(50), rng.randrange(5), rng.randrange(10**9)) for _ in range(300)]
+    loaded = index.PrisonerStore(index.NameIndex())
+    loaded.load(rows)
+    inserted = index.PrisonerStore(index.NameIndex())
+    for row in rows:
+        inserted.insert(*row)
+    assert list(loaded) == list(inserted)
+    for id in range(50):
+        assert loaded.of_user(id) == inserted.of_user(id)
+        assert sorted(loaded.names.pending(("prisoner", 0))) == sorted(inserted.names.pending(("prisoner", 0)))
+
+def test_of_user_follows_insert_and_remove() -> None:
+    store = index.PrisonerStore()
+    store.load([(1, 10, 100), (1, 20, 200), (2, 10, 300)])
+    assert store.of_user(1) == [(1, 10, 100), (1, 20, 200)]
+    store.remove(1, 10)
+    store.insert(1, 30, 400)
+    assert store.of_user(1) == [(1, 20, 200), (1, 30, 400)]
+    store.remove(2, 10)
+    assert store.of_user(2) == []
+    store.clear()
+    assert store.of_user(1) == []
+
+def test_name_search_matches_scan() -> None:
+    rng: random.Random = random.Random(2)
+    names = index.NameIndex()
+    labels: dict[int, str] = {id: "".join(rng.choice("abcde") for _ in range(rng.randrange(1, 9))) for id in range(200)}
+    for id, label in labels.items():
+        names.name("scope", id, label)
+    for id in range(0, 200, 3):
+        names.remove("scope", id)
+        del labels[id]
+    for text in ("", "a", "cd", "abc", "bcda", "eeee", "abcdeab"):
+        found: list[tuple[str, int]] = names.search("scope", text.upper(), limit=1000)
+        expected: set[int] = {id for id, label in labels.items() if text in label or text in str(id)}
+        assert {id for _, id in found} == expected
+        # Prefix matches first
+        is_prefix: list[bool] = [label.startswith(text) or str(id).startswith(text) for label, id in found]
+        assert is_prefix == sorted(is_prefix, reverse=True)
+
+def test_prisoner_names_read_from_the_column() -> None:
+    names = index.NameIndex()
+    store = index.PrisonerStore(names)
+    store.load([(1, 10, 100), (2, 10, 200), (3, 20, 300)])
+    assert sorted(names.pending(("prisoner", 10))) == [1, 2]
+    names.name(("prisoner", 10), 1, "alice")
+    assert names.pending(("prisoner", 10)) == [2]
+    assert names.search(("prisoner", 10), "ali") == [("alice", 1)]
+    store.remove(1, 10)
+    store.insert(4, 10, 400)
+    assert sorted(names.pending(("prisoner", 10))) == [2, 4]
+    assert names.search(("prisoner", 10), "ali") == []
@@ -0,0 +1,96 @@
+'''
+Confined Timeout
+Tests of the log channel pipeline
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+import random
+
+import interactions
+
+from conftest import PACKAGE_NAME
+
+log_channel = importlib.import_module(f"{PACKAGE_NAME}.log_channel")
+outbound = importlib.import_module(f"{PACKAGE_NAME}.outbound")
+
+def entries(count: int, seed: int = 1) -> list[tuple[str, int, interactions.Timestamp]]:
+    rng: random.Random = random.Random(seed)
+    now: interactions.Timestamp = interactions.Timestamp.now()
+    return [(f"{i} " + "x" * rng.randrange(0, 900), rng.choice((0xFF0000, 0x00FF00)), now) for i in range(count)]
+
+def check_limits(messages: list[list[interactions.Embed]]) -> None:
+    for embeds in messages:
+        assert 0 < len(embeds) <= log_channel.EMBEDS_PER_MESSAGE
+        assert sum(len(e.title) + len(e.description) for e in embeds) <= log_channel.MESSAGE_EMBED_CHARACTER_LIMIT
+        for embed in embeds:
+            assert len(embed.description) <= log_channel.EMBED_DESCRIPTION_LIMIT
+
+def test_pack_within_limits_and_in_order() -> None:
+    for seed in range(5):
+        batch = entries(300, seed)
+        counts: list[int] = []
+        messages = log_channel.LogPipeline.pack(batch, counts)
+        check_limits(messages)
+        assert len(counts) == len(messages) and sum(counts) == len(batch)
+        lines: list[str] = [line for embeds in messages for e in embeds for line in e.description.split("\n")]
+        assert lines == [message for message, _, _ in batch]
+        # The entries counted for a message are the ones it holds
+        for embeds, count in zip(messages, counts):
+            assert sum(len(e.description.split("\n")) for e in embeds) == count
+
+def test_pack_same_colour_shares_embeds() -> None:
+    now: interactions.Timestamp = interactions.Timestamp.now()
+    messages = log_channel.LogPipeline.pack([("a", 1, now), ("b", 1, now), ("c", 2, now)])
+    assert [[e.description for e in embeds] for embeds in messages] == [["a\nb", "c"]]
+
+def test_pack_truncates_a_long_message() -> None:
+    now: interactions.Timestamp = interactions.Timestamp.now()
+    messages = log_channel.LogPipeline.pack([("y" * 5000, 0, now), ("z" * 5000, 0, now)])
+    check_limits(messages)
+    # Two full embeds do not fit in the 6000 characters of one message
+    assert len(messages) == 2
+    assert messages[0][0].description == "y" * (log_channel.EMBED_DESCRIPTION_LIMIT - 3) + "..."
+
+def test_pack_at_most_ten_embeds() -> None:
+    now: interactions.Timestamp = interactions.Timestamp.now()
+    counts: list[int] = []
+    messages = log_channel.LogPipeline.pack([(str(i), i % 2, now) for i in range(25)], counts)
+    assert [len(embeds) for embeds in messages] == [10, 10, 5]
+    assert counts == [10, 10, 5]
+
+def test_shed_entries_are_requeued() -> None:
+    async def run() -> None:
+        sent: list[list[str]] = []
+        shed: list[bool] = [True]
+        async def send(channel, embeds: list[interactions.Embed]) -> None:
+            if len(sent) == 1 and shed[0]:
+                shed[0] = False
+                raise outbound.OutboundShed("send dropped")
+            sent.append([line for e in embeds for line in e.description.split("\n")])
+        async def resolve():
+            return object()
+        pipeline = log_channel.LogPipeline(resolve, window=0.01, send=send)
+        batch = [(str(i), i % 2, interactions.Timestamp.now()) for i in range(25)]
+        pipeline._queue = list(batch)
+        await pipeline._flush()
+        # The first message went out, the other 15 entries wait for the next batch
+        assert len(sent) == 1 and len(pipeline) == 15
+        pipeline.send("late", 0)
+        await pipeline.close()
+        assert [line for lines in sent for line in lines] == [m for m, _, _ in batch] + ["late"]
+    asyncio.run(run())
@@ -0,0 +1,115 @@
+'''
+Confined Timeout
+Tests of the schema migrations
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+import sqlite3
+import types
+
+from conftest import PACKAGE_NAME
+
+main = importlib.import_module(f"{PACKAGE_NAME}.main")
+storage_module = importlib.import_module(f"{PACKAGE_NAME}.storage")
+
+GUILD_A: int = 1001
+GUILD_B: int = 1002
+# The channels of each guild
+CHANNELS: dict[int, int] = {11: GUILD_A, 12: GUILD_A, 21: GUILD_B}
+
+# The schema before the guild partitioning
+BASELINE_SCHEMA: list[str] = [
+    "CREATE TABLE GlobalAdminDB (uid INTEGER NOT NULL PRIMARY KEY, id BIGINT NOT NULL, type INTEGER NOT NULL)",
+    "CREATE TABLE ModeratorDB (uid INTEGER NOT NULL PRIMARY KEY, id BIGINT NOT NULL, type INTEGER NOT NULL, channel_id BIGINT NOT NULL)",
+    "CREATE TABLE PrisonerDB (uid INTEGER NOT NULL PRIMARY KEY, id BIGINT NOT NULL, channel_id BIGINT NOT NULL, release_datetime DATETIME NOT NULL)",
+    "CREATE TABLE SettingDB (type INTEGER NOT NULL PRIMARY KEY UNIQUE, setting BIGINT NOT NULL, setting1 VARCHAR(100))",
+]
+
+def baseline_database(path: str) -> None:
+    '''One log channel setting of guild A, and moderators and prisoners in the channels of both guilds'''
+    db: sqlite3.Connection = sqlite3.connect(path)
+    for statement in BASELINE_SCHEMA:
+        db.execute(statement)
+    db.execute("INSERT INTO SettingDB (type, setting, setting1) VALUES (0, 11, ?)", (str(GUILD_A),))
+    db.execute("INSERT INTO GlobalAdminDB (id, type) VALUES (500, 0)")
+    db.executemany("INSERT INTO ModeratorDB (id, type, channel_id) VALUES (?, 0, ?)", [(600 + c, c) for c in CHANNELS])
+    db.executemany(
+        "INSERT INTO PrisonerDB (id, channel_id, release_datetime) VALUES (?, ?, '2099-01-01 00:00:00.000000')",
+        [(700 + c, c) for c in CHANNELS])
+    db.commit()
+    db.close()
+
+class StubResolver:
+    async def channel(self, channel_id: int):
+        guild_id = CHANNELS.get(channel_id)
+        return types.SimpleNamespace(id=channel_id, guild=types.SimpleNamespace(id=guild_id)) if guild_id is not None else None
+
+def test_partition_two_guilds(tmp_path) -> None:
+    path: str = str(tmp_path / "baseline.db")
+    baseline_database(path)
+    async def run() -> None:
+        storage = storage_module.SQLiteStorage(path)
+        await storage.open()
+        try:
+            # The channel rows are not guessed from the log channel setting
+            channel_ids, admins = await storage.legacy_rows()
+            assert sorted(channel_ids) == sorted(CHANNELS)
+            assert admins == 0
+            ext = object.__new__(main.ModuleRetr0initConfinedTimeout)
+            ext.bot = types.SimpleNamespace(guilds=[types.SimpleNamespace(id=GUILD_A), types.SimpleNamespace(id=GUILD_B)])
+            ext.resolver = StubResolver()
+            previous = main.storage
+            main.storage = storage
+            try:
+                await ext.adopt_legacy_rows()
+            finally:
+                main.storage = previous
+            assert await storage.legacy_rows() == ([], 0)
+            a = await storage.load_guild(GUILD_A)
+            b = await storage.load_guild(GUILD_B)
+            assert sorted(p[:2] for p in a.prisoners) == [(711, 11), (712, 12)]
+            assert [p[:2] for p in b.prisoners] == [(721, 21)]
+            assert sorted(m[2] for m in a.moderators) == [11, 12]
+            assert [m[2] for m in b.moderators] == [21]
+            assert a.admins == [(500, 0)] and b.admins == []
+            assert [s[0] for s in a.settings] == [0] and b.settings == []
+        finally:
+            await storage.close()
+    asyncio.run(run())
+
+def test_partition_without_log_channel(tmp_path) -> None:
+    path: str = str(tmp_path / "baseline.db")
+    baseline_database(path)
+    db: sqlite3.Connection = sqlite3.connect(path)
+    db.execute("DELETE FROM SettingDB")
+    db.commit()
+    db.close()
+    async def run() -> None:
+        storage = storage_module.SQLiteStorage(path)
+        await storage.open()
+        try:
+            channel_ids, admins = await storage.legacy_rows()
+            assert sorted(channel_ids) == sorted(CHANNELS)
+            assert admins == 1
+            for channel_id, guild_id in CHANNELS.items():
+                await storage.adopt_legacy(guild_id, channel_id)
+            assert await storage.legacy_rows() == ([], 1)
+            assert len((await storage.load_guild(GUILD_B)).prisoners) == 1
+        finally:
+            await storage.close()
+    asyncio.run(run())
@@ -0,0 +1,107 @@
+'''
+Confined Timeout
+Tests of the outbound request scheduler
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+
+import pytest
+
+from conftest import PACKAGE_NAME
+
+outbound = importlib.import_module(f"{PACKAGE_NAME}.outbound")
+Priority = outbound.Priority
+
+class Calls:
+    '''Requests blocked until released, recording the order they started in'''
+    def __init__(self) -> None:
+        self.started: list[str] = []
+        self.gate: asyncio.Event = asyncio.Event()
+
+    def __call__(self, name: str):
+        async def call() -> str:
+            self.started.append(name)
+            await self.gate.wait()
+            return name
+        return call
+
+def test_priority_order() -> None:
+    async def run() -> None:
+        calls: Calls = Calls()
+        scheduler = outbound.OutboundScheduler(limit=1, low_priority_limit=1)
+        first = scheduler.submit(Priority.LOG, 1, "send", calls("blocker"))
+        futures = [
+            scheduler.submit(Priority.LOG, 1, "send", calls("log")),
+            scheduler.submit(Priority.ANNOUNCEMENT, 2, "send", calls("announcement")),
+            scheduler.submit(Priority.INTERACTION, 3, "send", calls("interaction")),
+            scheduler.submit(Priority.ENFORCEMENT, 4, "edit", calls("enforcement 1")),
+            scheduler.submit(Priority.ENFORCEMENT, 5, "edit", calls("enforcement 2")),
+        ]
+        calls.gate.set()
+        assert await asyncio.gather(first, *futures) == ["blocker", "log", "announcement", "interaction", "enforcement 1", "enforcement 2"]
+        assert calls.started == ["blocker", "enforcement 1", "enforcement 2", "interaction", "announcement", "log"]
+    asyncio.run(run())
+
+def test_low_priority_cap() -> None:
+    async def run() -> None:
+        calls: Calls = Calls()
+        scheduler = outbound.OutboundScheduler(limit=4, low_priority_limit=2)
+        futures = [scheduler.submit(Priority.LOG, i, "send", calls(f"log {i}")) for i in range(4)]
+        await asyncio.sleep(0)
+        # Only part of the slots go to the logs, the rest stay free for the enforcement
+        assert calls.started == ["log 0", "log 1"]
+        futures.append(scheduler.submit(Priority.ENFORCEMENT, 9, "edit", calls("enforcement")))
+        await asyncio.sleep(0)
+        assert calls.started == ["log 0", "log 1", "enforcement"]
+        calls.gate.set()
+        await asyncio.gather(*futures)
+        assert len(scheduler) == 0
+    asyncio.run(run())
+
+def test_route_limit() -> None:
+    async def run() -> None:
+        calls: Calls = Calls()
+        scheduler = outbound.OutboundScheduler(limit=10, route_limits={"send": 1})
+        futures = [scheduler.submit(Priority.INTERACTION, 1, "send", calls(f"a{i}")) for i in range(2)]
+        futures.append(scheduler.submit(Priority.INTERACTION, 2, "send", calls("b")))
+        await asyncio.sleep(0)
+        # The second request of the same channel waits, the other channel does not
+        assert calls.started == ["a0", "b"]
+        calls.gate.set()
+        await asyncio.gather(*futures)
+        assert calls.started == ["a0", "b", "a1"]
+    asyncio.run(run())
+
+def test_shed_oldest_low_priority() -> None:
+    async def run() -> None:
+        calls: Calls = Calls()
+        scheduler = outbound.OutboundScheduler(limit=1, max_queued={Priority.ANNOUNCEMENT: 2, Priority.LOG: 1})
+        blocker = scheduler.submit(Priority.ENFORCEMENT, 0, "edit", calls("blocker"))
+        announcements = [scheduler.submit(Priority.ANNOUNCEMENT, i, "send", calls(f"announcement {i}")) for i in range(3)]
+        logs = [scheduler.submit(Priority.LOG, i, "send", calls(f"log {i}")) for i in range(2)]
+        interaction_futures = [scheduler.submit(Priority.INTERACTION, i, "send", calls(f"interaction {i}")) for i in range(3)]
+        # The oldest ones are dropped, the interactions are never bounded
+        for future in (announcements[0], logs[0]):
+            with pytest.raises(outbound.OutboundShed):
+                await future
+        assert len(scheduler) == 6
+        calls.gate.set()
+        await asyncio.gather(blocker, *announcements[1:], logs[1], *interaction_futures)
+        assert "announcement 0" not in calls.started and "log 0" not in calls.started
+        assert len(calls.started) == 7
+    asyncio.run(run())
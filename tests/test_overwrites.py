@@ -0,0 +1,121 @@
+'''
+Confined Timeout
+Tests of the overwrite coalescer
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+
+import interactions
+
+from conftest import PACKAGE_NAME
+
+overwrites = importlib.import_module(f"{PACKAGE_NAME}.overwrites")
+
+DENY: int = int(interactions.Permissions.SEND_MESSAGES)
+
+class StubChannel:
+    '''
+    The overwrites on Discord and the cached copy. Like the library, the member endpoints only call REST
+    and leave the cache alone, while an edit replaces the whole list.
+    '''
+    def __init__(self, member_ids: list[int]) -> None:
+        self.id: int = 1
+        self.name: str = "channel"
+        self.server: dict[int, int] = {i: DENY for i in member_ids}
+        self.permission_overwrites: list[interactions.PermissionOverwrite] = [
+            interactions.PermissionOverwrite(
+                id=i, type=interactions.OverwriteType.MEMBER, allow=interactions.Permissions.NONE, deny=interactions.Permissions(DENY))
+            for i in member_ids
+        ]
+        self.edits: int = 0
+        self.delay: float = 0
+        self.reasons: list[str] = []
+
+    async def delete_permission(self, target: int, reason: str = "") -> None:
+        await asyncio.sleep(self.delay)
+        if target not in self.server:
+            raise interactions.errors.NotFound(type("Response", (), {"status": 404, "reason": "Not Found"})(), "Unknown Overwrite")
+        del self.server[target]
+
+    async def edit_permission(self, overwrite: interactions.PermissionOverwrite, reason: str = "") -> None:
+        await asyncio.sleep(self.delay)
+        self.reasons.append(reason)
+        self.server[int(overwrite.id)] = int(overwrite.deny)
+
+    async def edit(self, permission_overwrites: list[interactions.PermissionOverwrite], reason: str = "") -> None:
+        await asyncio.sleep(self.delay)
+        self.edits += 1
+        self.reasons.append(reason)
+        self.server = {int(o.id): int(o.deny) for o in permission_overwrites}
+
+def test_delete_then_merged_batch() -> None:
+    async def run() -> None:
+        channel: StubChannel = StubChannel([111])
+        channel.delay = 0.05
+        coalescer = overwrites.OverwriteCoalescer(window=0)
+        released: asyncio.Future = coalescer.delete(channel, 111)
+        # Queued while the release is in flight, so they go in the next batch together
+        await asyncio.sleep(0.01)
+        jailed: list[asyncio.Future] = [coalescer.deny(channel, 222, DENY), coalescer.deny(channel, 333, DENY)]
+        await asyncio.gather(released, *jailed)
+        assert channel.edits == 1
+        assert channel.server == {222: DENY, 333: DENY}
+        assert sorted(int(o.id) for o in channel.permission_overwrites) == [222, 333]
+    asyncio.run(run())
+
+def test_deny_then_merged_batch() -> None:
+    async def run() -> None:
+        channel: StubChannel = StubChannel([111, 222])
+        channel.delay = 0.05
+        coalescer = overwrites.OverwriteCoalescer(window=0)
+        jailed: asyncio.Future = coalescer.deny(channel, 333, DENY)
+        await asyncio.sleep(0.01)
+        released: list[asyncio.Future] = [coalescer.delete(channel, 111), coalescer.delete(channel, 222)]
+        await asyncio.gather(jailed, *released)
+        assert channel.server == {333: DENY}
+    asyncio.run(run())
+
+def test_missing_overwrite_delete() -> None:
+    async def run() -> None:
+        channel: StubChannel = StubChannel([])
+        coalescer = overwrites.OverwriteCoalescer(window=0)
+        await coalescer.delete(channel, 111)
+        assert channel.server == {}
+    asyncio.run(run())
+
+def test_lone_new_deny_keeps_reason() -> None:
+    async def run() -> None:
+        channel: StubChannel = StubChannel([])
+        coalescer = overwrites.OverwriteCoalescer(window=0)
+        await coalescer.deny(channel, 111, DENY, "jailed")
+        assert channel.server == {111: DENY}
+        assert channel.reasons == ["jailed"] and channel.edits == 0
+    asyncio.run(run())
+
+def test_batch_built_from_current_channel() -> None:
+    async def run() -> None:
+        stale: StubChannel = StubChannel([111])
+        # Another bot added an overwrite the stale copy does not know about
+        current: StubChannel = StubChannel([111, 999])
+        async def lookup(channel_id: int) -> StubChannel:
+            return current
+        coalescer = overwrites.OverwriteCoalescer(window=0.01, current=lookup)
+        await asyncio.gather(coalescer.deny(stale, 222, DENY), coalescer.delete(stale, 111))
+        assert current.server == {999: DENY, 222: DENY}
+        assert stale.edits == 0
+    asyncio.run(run())
@@ -0,0 +1,58 @@
+'''
+Confined Timeout
+Tests of the lazy pages
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import importlib
+
+from conftest import PACKAGE_NAME
+
+pages = importlib.import_module(f"{PACKAGE_NAME}.pages")
+
+def test_stream_section_headers() -> None:
+    stream: list[tuple[int, int]] = [(1, 10), (1, 11), (1, 12), (2, 20), (3, 30)]
+    section = pages.StreamSection(len(stream), lambda start, stop: stream[start:stop], lambda g: f"G{g}:")
+    assert section.page_count(2) == 3
+    assert section.render_page(0, 2) == "G1:\n10\n11"
+    assert section.render_page(2, 2) == "G1: (continued)\n12\nG2:\n20"
+    assert section.render_page(4, 2) == "G3:\n30"
+
+def test_lazy_pages_mix_sections() -> None:
+    stream: list[tuple[int, int]] = [(1, n) for n in range(5)]
+    lazy = pages.LazyPages([
+        pages.Section("Settings:", ["a"]),
+        pages.StreamSection(len(stream), lambda start, stop: stream[start:stop], lambda g: f"G{g}:"),
+        pages.StreamSection(0, lambda start, stop: [], lambda g: f"G{g}:", empty="Nobody")
+    ], per_page=3)
+    assert len(lazy) == 4
+    assert lazy[2].content == "G1: (continued)\n3\n4"
+    assert lazy[3].content == "Nobody"
+
+def test_stream_section_skips_groups() -> None:
+    stream: list[tuple[int, int]] = [(1, 10), (2, 20), (2, 21), (3, 30), (3, 31)]
+    kept: list[int] = []
+    def keep(group: int) -> bool:
+        kept.append(group)
+        return group != 2
+    section = pages.StreamSection(len(stream), lambda start, stop: stream[start:stop], lambda g: f"G{g}:", keep=keep)
+    assert section.render_page(0, 2) == "G1:\n10"
+    assert section.render_page(2, 2) == "G3:\n30"
+    assert section.render_page(4, 2) == "G3: (continued)\n31"
+    # Only the groups on the pages are checked, once per page
+    assert kept == [1, 2, 2, 3, 3]
+    skipped = pages.StreamSection(2, lambda start, stop: [(2, 20), (2, 21)][start:stop], lambda g: f"G{g}:", empty="Nobody", keep=keep)
+    assert skipped.render_page(0, 2) == "Nobody"
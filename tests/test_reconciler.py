@@ -0,0 +1,113 @@
+'''
+Confined Timeout
+Tests of the background reconciliation
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+
+from conftest import PACKAGE_NAME
+
+reconciler_module = importlib.import_module(f"{PACKAGE_NAME}.reconciler")
+
+class Channels:
+    '''The channels of the guilds, counting the channels read by the cycles'''
+    def __init__(self, guilds: dict[int, list[int]]) -> None:
+        self.guilds: dict[int, list[int]] = guilds
+        self.read: int = 0
+
+    def keys(self):
+        for guild_id, channel_ids in self.guilds.items():
+            for channel_id in channel_ids:
+                self.read += 1
+                yield guild_id, channel_id
+
+def test_cursor_reads_the_channels_lazily() -> None:
+    async def run() -> None:
+        channels: Channels = Channels({1: list(range(10)), 2: list(range(10, 20))})
+        checked: list = []
+        async def check(key, budget: int) -> tuple[int, bool]:
+            checked.append(key)
+            return 0, True
+        r = reconciler_module.Reconciler(channels.keys, check, channels_per_tick=3)
+        assert await r.tick() == 3
+        # Only the channels up to the cursor are read
+        assert channels.read == 3
+        assert [await r.tick() for _ in range(6)] == [3, 3, 3, 3, 3, 2]
+        assert checked == [(1, c) for c in range(10)] + [(2, c) for c in range(10, 20)]
+        assert r.stats["cycles"] == 1
+        # The cycle is over, the next tick starts a new one
+        assert await r.tick() == 3 and r.stats["cycles"] == 2
+        assert checked[-3:] == [(1, 0), (1, 1), (1, 2)]
+    asyncio.run(run())
+
+def test_budget_resumes_the_channel() -> None:
+    async def run() -> None:
+        # Each channel needs 3 API calls
+        needed: dict[int, int] = {c: 3 for c in range(4)}
+        calls: list[tuple[int, int]] = []
+        async def check(key: int, budget: int) -> tuple[int, bool]:
+            calls.append((key, budget))
+            used: int = min(budget, needed[key])
+            needed[key] -= used
+            return used, needed[key] == 0
+        r = reconciler_module.Reconciler(lambda: list(range(4)), check, channels_per_tick=10, api_budget=5)
+        assert await r.tick() == 1
+        assert calls == [(0, 5), (1, 2)]
+        # The unfinished channel goes first on the next tick with a fresh budget
+        assert await r.tick() == 2
+        assert calls[2:] == [(1, 5), (2, 4), (3, 1)]
+        assert r.stats["api_calls"] == 10
+    asyncio.run(run())
+
+def test_touched_channels_are_skipped() -> None:
+    async def run() -> None:
+        checked: list[int] = []
+        async def check(key: int, budget: int) -> tuple[int, bool]:
+            checked.append(key)
+            return 0, True
+        r = reconciler_module.Reconciler(lambda: [1, 2, 3], check, grace=60)
+        r.touch(2)
+        assert await r.tick() == 3
+        assert checked == [1, 3]
+    asyncio.run(run())
+
+def test_drift_confirmed_in_two_cycles() -> None:
+    async def run() -> None:
+        drifts: set[str] = {"a", "b"}
+        repaired: list[str] = []
+        r = None
+        async def check(key: int, budget: int) -> tuple[int, bool]:
+            for drift in sorted(drifts):
+                if r.confirm(drift):
+                    repaired.append(drift)
+                    drifts.discard(drift)
+            return 0, True
+        r = reconciler_module.Reconciler(lambda: [0], check)
+        await r.tick()
+        assert repaired == []
+        # b went away before the second cycle, so only a is repaired
+        drifts.discard("b")
+        await r.tick()
+        await r.tick()
+        assert repaired == ["a"]
+        # A reset forgets the flags
+        r.reset()
+        drifts.add("b")
+        await r.tick()
+        assert repaired == ["a"]
+    asyncio.run(run())
@@ -0,0 +1,92 @@
+'''
+Confined Timeout
+Tests of the retries of the failed releases
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+import time
+import types
+
+from conftest import PACKAGE_NAME
+
+main = importlib.import_module(f"{PACKAGE_NAME}.main")
+storage_module = importlib.import_module(f"{PACKAGE_NAME}.storage")
+
+GUILD_ID: int = 1
+CHANNEL_ID: int = 100
+
+class StubResolver:
+    async def channel(self, channel_id: int):
+        return types.SimpleNamespace(id=channel_id, name="channel", mention=f"<#{channel_id}>")
+
+async def noop(keys) -> None:
+    pass
+
+async def new_ext(monkeypatch, prisoner_ids: list[int], released_at: int):
+    monkeypatch.setattr(main, "storage", storage_module.MemoryStorage())
+    state = main.GuildState(GUILD_ID, main.Prisoner.from_columns)
+    await main.load_guild_state(state)
+    for id in prisoner_ids:
+        state.prisoners.insert(id, CHANNEL_ID, released_at)
+    async def load(guild_id: int):
+        return state
+    monkeypatch.setattr(main, "guilds", types.SimpleNamespace(load=load))
+    ext = object.__new__(main.ModuleRetr0initConfinedTimeout)
+    ext.resolver = StubResolver()
+    ext.release_scheduler = main.ReleaseScheduler(noop)
+    ext.release_retries = {}
+    return ext, state
+
+def test_failed_recovery_is_retried(monkeypatch) -> None:
+    async def run() -> None:
+        now: int = int(time.time())
+        ext, state = await new_ext(monkeypatch, [10, 11], now - 100)
+        async def release_bulk(*args, **kwargs):
+            raise OSError("connection reset")
+        ext.release_prisoners_bulk = release_bulk
+        overdue = {CHANNEL_ID: [main.Prisoner(id, now - 100, CHANNEL_ID, GUILD_ID) for id in (10, 11)]}
+        await ext.recover_overdue(state, overdue, now)
+        keys = [(GUILD_ID, id, CHANNEL_ID) for id in (10, 11)]
+        assert all(key in ext.release_scheduler for key in keys)
+        assert now + main.RELEASE_RETRY_SECONDS - 1 <= ext.release_scheduler.next_time() <= time.time() + main.RELEASE_RETRY_SECONDS
+        assert ext.release_retries == {key: 1 for key in keys}
+    asyncio.run(run())
+
+def test_failed_release_backs_off_until_released(monkeypatch) -> None:
+    async def run() -> None:
+        now: int = int(time.time())
+        ext, state = await new_ext(monkeypatch, [10], now - 100)
+        key = (GUILD_ID, 10, CHANNEL_ID)
+        released: list[bool] = [False]
+        async def release(state, prisoner, ctx=None, reason: str = "") -> None:
+            # Without the permission the release returns and the prisoner stays
+            if released[0]:
+                state.prisoners.remove(prisoner.id, prisoner.channel_id)
+        ext.release_prinsoner = release
+        async def wake_up() -> None:
+            # As the scheduler loop does once the retry is due
+            await ext.release_prisoners_due(ext.release_scheduler.pop_due(time.time() + 10**6))
+        ext.release_scheduler.schedule(key, now - 100)
+        await wake_up()
+        await wake_up()
+        assert ext.release_retries == {key: 2}
+        assert ext.release_scheduler.next_time() >= time.time() + 2 * main.RELEASE_RETRY_SECONDS - 1
+        released[0] = True
+        await wake_up()
+        assert ext.release_retries == {} and (10, CHANNEL_ID) not in state.prisoners and key not in ext.release_scheduler
+    asyncio.run(run())
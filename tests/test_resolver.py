@@ -0,0 +1,131 @@
+'''
+Confined Timeout
+Tests of the entity resolution cache
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+import types
+
+import interactions
+
+from conftest import PACKAGE_NAME
+
+resolver_module = importlib.import_module(f"{PACKAGE_NAME}.resolver")
+
+def not_found() -> interactions.errors.NotFound:
+    return interactions.errors.NotFound(types.SimpleNamespace(status=404, reason="Not Found"), "Unknown Channel")
+
+class FakeCache:
+    '''The gateway cache and the REST fetches of the bot, counting the fetches'''
+    def __init__(self) -> None:
+        self.gateway: dict[int, object] = {}
+        self.rest: dict[int, object] = {}
+        self.fetches: int = 0
+        self.delay: float = 0
+        self.error: Exception = None
+
+    def get_channel(self, channel_id: int):
+        return self.gateway.get(channel_id)
+
+    async def fetch_channel(self, channel_id: int):
+        self.fetches += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        if channel_id not in self.rest:
+            raise not_found()
+        return self.rest[channel_id]
+
+def new_resolver(**kwargs):
+    cache: FakeCache = FakeCache()
+    return resolver_module.EntityResolver(types.SimpleNamespace(cache=cache), **kwargs), cache
+
+def test_gateway_then_cache_then_rest() -> None:
+    async def run() -> None:
+        resolver, cache = new_resolver()
+        cache.gateway[1] = "gateway"
+        cache.rest[2] = "rest"
+        assert await resolver.channel(1) == "gateway"
+        assert await resolver.channel(2) == "rest"
+        assert await resolver.channel(2) == "rest"
+        assert cache.fetches == 1
+        assert resolver.stats["gateway_hits"] == 1 and resolver.stats["cache_hits"] == 1 and resolver.stats["misses"] == 1
+    asyncio.run(run())
+
+def test_single_flight() -> None:
+    async def run() -> None:
+        resolver, cache = new_resolver()
+        cache.rest[1] = "rest"
+        cache.delay = 0.02
+        results = await asyncio.gather(*(resolver.channel(1) for _ in range(10)))
+        assert results == ["rest"] * 10
+        assert cache.fetches == 1 and resolver.stats["coalesced"] == 9
+    asyncio.run(run())
+
+def test_single_flight_error_reaches_every_waiter() -> None:
+    async def run() -> None:
+        resolver, cache = new_resolver()
+        cache.error = OSError("connection reset")
+        cache.delay = 0.02
+        results = await asyncio.gather(*(resolver.channel(1) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, OSError) for r in results) and cache.fetches == 1
+        # Nothing is cached after an error
+        cache.error = None
+        cache.rest[1] = "rest"
+        assert await resolver.channel(1) == "rest"
+    asyncio.run(run())
+
+def test_not_found_is_none_and_not_cached() -> None:
+    async def run() -> None:
+        resolver, cache = new_resolver()
+        assert await resolver.channel(1) is None
+        assert resolver.stats["not_found"] == 1 and len(resolver) == 0
+        # A missing entity is fetched again, so a created one is seen
+        cache.rest[1] = "created"
+        assert await resolver.channel(1) == "created"
+        assert cache.fetches == 2
+    asyncio.run(run())
+
+def test_ttl_expiry() -> None:
+    async def run() -> None:
+        resolver, cache = new_resolver(ttl=0.02)
+        cache.rest[1] = "old"
+        assert await resolver.channel(1) == "old"
+        cache.rest[1] = "new"
+        assert await resolver.channel(1) == "old"
+        await asyncio.sleep(0.03)
+        assert await resolver.channel(1) == "new"
+        assert cache.fetches == 2
+    asyncio.run(run())
+
+def test_lru_eviction() -> None:
+    async def run() -> None:
+        resolver, cache = new_resolver(maxsize=2)
+        for i in range(3):
+            cache.rest[i] = f"channel {i}"
+        await resolver.channel(0)
+        await resolver.channel(1)
+        # Touch 0 so 1 is the least recently used
+        await resolver.channel(0)
+        await resolver.channel(2)
+        assert len(resolver) == 2 and cache.fetches == 3
+        await resolver.channel(0)
+        assert cache.fetches == 3
+        await resolver.channel(1)
+        assert cache.fetches == 4
+    asyncio.run(run())
@@ -0,0 +1,154 @@
+'''
+Confined Timeout
+Tests of the release scheduler
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+import time
+
+from conftest import PACKAGE_NAME
+
+scheduler = importlib.import_module(f"{PACKAGE_NAME}.scheduler")
+
+async def ignore(keys: list) -> None:
+    pass
+
+def test_pop_due_in_release_order() -> None:
+    s = scheduler.ReleaseScheduler(ignore)
+    s.schedule("c", 30)
+    s.schedule("a", 10)
+    s.schedule("b", 20)
+    s.schedule("a2", 10)
+    # Rescheduling replaces the earlier entry
+    s.schedule("c", 5)
+    assert s.next_time() == 5
+    assert s.pop_due(10) == ["c", "a", "a2"]
+    assert s.pop_due(19) == []
+    assert s.pop_due(100) == ["b"]
+    assert len(s) == 0 and s.next_time() is None
+
+def test_cancel_is_lazy() -> None:
+    s = scheduler.ReleaseScheduler(ignore)
+    for i in range(10):
+        s.schedule(i, i)
+    assert s.cancel(0) and s.cancel(5)
+    assert not s.cancel(5)
+    # The cancelled entries stay in the heap until they reach the top
+    assert len(s) == 8 and len(s._heap) == 10
+    assert 5 not in s
+    assert s.next_time() == 1
+    assert len(s._heap) == 9
+    assert s.pop_due(100) == [1, 2, 3, 4, 6, 7, 8, 9]
+
+def test_compaction_above_64_entries() -> None:
+    s = scheduler.ReleaseScheduler(ignore)
+    for i in range(100):
+        s.schedule(i, i)
+    # Not compacted while at most half of the heap is cancelled
+    for i in range(50):
+        s.cancel(i)
+    assert len(s._heap) == 100
+    s.cancel(50)
+    assert len(s._heap) == 49 and len(s) == 49
+    assert s.pop_due(1000) == list(range(51, 100))
+    # A small heap is never compacted
+    for i in range(10):
+        s.schedule(i, i)
+    for i in range(9):
+        s.cancel(i)
+    assert len(s._heap) == 10 and s.pop_due(1000) == [9]
+
+def test_loop_calls_back_with_due_keys() -> None:
+    async def run() -> None:
+        calls: list[list] = []
+        async def callback(keys: list) -> None:
+            calls.append(keys)
+        s = scheduler.ReleaseScheduler(callback)
+        s.start()
+        try:
+            now: float = time.time()
+            s.schedule("later", now + 0.1)
+            s.schedule("cancelled", now + 0.05)
+            s.schedule("sooner", now + 0.05)
+            s.cancel("cancelled")
+            await asyncio.sleep(0.2)
+        finally:
+            s.stop()
+        assert calls == [["sooner"], ["later"]]
+    asyncio.run(run())
+
+def test_horizon_pages() -> None:
+    async def run() -> None:
+        s = scheduler.ReleaseScheduler(ignore)
+        queries: list[tuple[int, int]] = []
+        rows: list[tuple[str, int]] = [("a", 100), ("b", 5000), ("c", 10**10)]
+        async def load(start: int, until: int) -> list[tuple[str, int]]:
+            queries.append((start, until))
+            return [(k, w) for k, w in rows if start < w <= until]
+        loader = scheduler.HorizonLoader(s, load, horizon=3600)
+        assert not loader.offer("early", 1)
+        assert await loader.advance(since=0) == 2
+        now: int = int(time.time())
+        assert queries[0][0] == 0 and now + 3600 - 5 <= loader.loaded_until <= now + 3600
+        assert "a" in s and "b" in s and "c" not in s
+        assert loader.offer("d", 200) and "d" in s
+        assert not loader.offer("e", 10**10) and "e" not in s
+        # The next page starts where the previous one ended
+        await loader.advance()
+        assert queries[1][0] == queries[0][1]
+    asyncio.run(run())
+
+def test_offer_during_page_load() -> None:
+    async def run() -> None:
+        s = scheduler.ReleaseScheduler(ignore)
+        querying: asyncio.Event = asyncio.Event()
+        committed: asyncio.Event = asyncio.Event()
+        async def load(start: int, until: int) -> list[tuple[str, int]]:
+            querying.set()
+            # The query does not see the prisoner jailed while it runs
+            await committed.wait()
+            return []
+        loader = scheduler.HorizonLoader(s, load, horizon=3600)
+        loader.loaded_until = int(time.time())
+        previous: int = loader.loaded_until
+        task: asyncio.Task = asyncio.create_task(loader.advance())
+        await querying.wait()
+        when: int = previous + 60
+        # Between the old bound and the page: neither loaded yet nor left to a later page
+        assert loader.loaded_until == previous
+        assert loader.offer("jailed", when) and "jailed" in s
+        assert not loader.offer("far", previous + 10**6)
+        committed.set()
+        await task
+        assert loader.loaded_until >= when and "jailed" in s
+    asyncio.run(run())
+
+def test_failed_page_keeps_the_bound() -> None:
+    async def run() -> None:
+        s = scheduler.ReleaseScheduler(ignore)
+        async def load(start: int, until: int) -> list[tuple[str, int]]:
+            raise OSError("database is locked")
+        loader = scheduler.HorizonLoader(s, load, horizon=3600)
+        loader.loaded_until = 1000
+        try:
+            await loader.advance()
+        except OSError:
+            pass
+        assert loader.loaded_until == 1000
+        assert not loader.offer("late", 2000)
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+'''
+Confined Timeout
+Tests of the write-behind writer
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import importlib
+
+import pytest
+
+from conftest import PACKAGE_NAME
+
+storage_module = importlib.import_module(f"{PACKAGE_NAME}.storage")
+
+class FlakySession:
+    '''Session maker whose first sessions fail to start'''
+    def __init__(self, session_maker, failures: int) -> None:
+        self.session_maker = session_maker
+        self.failures: int = failures
+        self.calls: int = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("database is locked")
+        return self.session_maker()
+
+def test_failed_commit_is_retried(tmp_path) -> None:
+    async def run() -> None:
+        storage = storage_module.SQLiteStorage(str(tmp_path / "writer.db"))
+        await storage.open()
+        try:
+            flaky: FlakySession = FlakySession(storage.writer.Session, 2)
+            storage.writer.Session = flaky
+            storage.writer.retry_delay = 0.001
+            await storage.add_prisoner(1, 10, 100, 2**40)
+            assert flaky.calls == 3
+            assert [p[:2] for p in (await storage.load_guild(1)).prisoners] == [(10, 100)]
+        finally:
+            storage.writer.Session = storage.Session
+            await storage.close()
+    asyncio.run(run())
+
+def test_failed_commit_gives_up(tmp_path) -> None:
+    async def run() -> None:
+        storage = storage_module.SQLiteStorage(str(tmp_path / "writer.db"))
+        await storage.open()
+        try:
+            storage.writer.Session = FlakySession(storage.writer.Session, 10)
+            storage.writer.retries = 1
+            storage.writer.retry_delay = 0.001
+            with pytest.raises(OSError):
+                await storage.add_prisoner(1, 10, 100, 2**40)
+            storage.writer.Session = storage.Session
+            assert (await storage.load_guild(1)).prisoners == []
+        finally:
+            storage.writer.Session = storage.Session
+            await storage.close()
+    asyncio.run(run())
@@ -0,0 +1,275 @@
+'''
+Confined Timeout
+Write-behind database writer
+
+Copyright (C) 2024  __retr0.init__
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+'''
+import asyncio
+import time
+from typing import Any, Optional
+
+import sqlalchemy
+from sqlalchemy import delete as sqldelete
+from sqlalchemy.ext.asyncio import async_sessionmaker
+import sqlalchemy.dialects.sqlite as sqlite
+
+from .metrics import DB_COMMIT_SECONDS, DB_OPERATIONS, DB_OPERATIONS_FAILED
+from .model import ChangeDB, DBBase, GlobalAdminDB, ModeratorDB, PrisonerDB, SettingDB
+
+# The natural key of each table used to coalesce the operations on the same row
+NATURAL_KEYS: dict[type[DBBase], tuple[str, ...]] = {
+    GlobalAdminDB:  ("guild_id", "id", "type"),
+    ModeratorDB:    ("guild_id", "id", "type", "channel_id"),
+    PrisonerDB:     ("guild_id", "id", "channel_id"),
+    SettingDB:      ("guild_id", "type"),
+}
+
+OP_INSERT: int = 0
+OP_DELETE: int = 1
+OP_UPSERT: int = 2
+OP_STATEMENT: int = 3
+
+class DBOp:
+    '''A pending database operation'''
+    __slots__ = ('kind', 'model', 'values', 'future')
+    def __init__(self, kind: int, model: Optional[type[DBBase]], values: Any, future: asyncio.Future) -> None:
+        self.kind = kind
+        self.model = model
+        self.values = values
+        self.future = future
+
+class _Segment:
+    '''
+    Operations that can be coalesced with each other.
+    A raw statement closes the segment so nothing is reordered across it.
+    '''
+    __slots__ = ('ops', 'dropped', 'statement')
+    def __init__(self) -> None:
+        self.ops: dict[tuple, list[DBOp]] = {}
+        self.dropped: list[DBOp] = []
+        self.statement: Optional[DBOp] = None
+
+class DBWriter:
+    '''
+    Queue of insert/delete/upsert operations committed in one transaction per window or batch.
+    Every method returns a future resolved once the operation is durable.
+    A jail and a release of the same prisoner inside one window cancel each other out.
+    With the change origin set, every commit also records the guilds it changed for the other processes.
+    A failed commit is retried with an exponential backoff before its operations fail.
+    '''
+    def __init__(self, session_maker: async_sessionmaker, window: float = 0.05, batch_size: int = 500, retries: int = 3, retry_delay: float = 0.1) -> None:
+        self.Session = session_maker
+        self.window: float = window
+        self.batch_size: int = batch_size
+        self.retries: int = retries
+        self.retry_delay: float = retry_delay
+        self._segments: list[_Segment] = [_Segment()]
+        self._pending: int = 0
+        self._wakeup: asyncio.Event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._committing: bool = False
+        self._closed: bool = False
+        # Guilds changed by the pending operations
+        self._changed: set[int] = set()
+        self.change_origin: Optional[str] = None
+
+    def __len__(self) -> int:
+        return self._pending
+
+    ################ Enqueue ################
+
+    def insert(self, model: type[DBBase], **values) -> asyncio.Future:
+        '''Insert a row. Existing rows with the same natural key are left untouched.'''
+        return self._enqueue(OP_INSERT, model, values)
+
+    def delete(self, model: type[DBBase], **where) -> asyncio.Future:
+        '''Delete the row with the natural key'''
+        return self._enqueue(OP_DELETE, model, where)
+
+    def upsert(self, model: type[DBBase], **values) -> asyncio.Future:
+        '''Insert or update the row with the natural key'''
+        return self._enqueue(OP_UPSERT, model, values)
+
+    def execute(self, statement, guild_id: Optional[int] = None) -> asyncio.Future:
+        '''Run a raw statement in order with the other operations. The guild_id is the guild it changes.'''
+        if self._closed:
+            raise RuntimeError("The database writer is closed")
+        if guild_id is not None:
+            self._changed.add(guild_id)
+        future: asyncio.Future = self._new_future()
+        segment: _Segment = self._segments[-1]
+        segment.statement = DBOp(OP_STATEMENT, None, statement, future)
+        self._segments.append(_Segment())
+        self._added()
+        return future
+
+    def flush(self) -> asyncio.Future:
+        '''Return a future resolved once everything enqueued so far is committed'''
+        if self._pending == 0 and not self._committing:
+            future: asyncio.Future = self._new_future()
+            future.set_result(None)
+            return future
+        return self.execute(sqlalchemy.text("SELECT 1"))
+
+    def _new_future(self) -> asyncio.Future:
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Callers are not required to wait for the result, so do not complain about unretrieved errors
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return future
+
+    def _enqueue(self, kind: int, model: type[DBBase], values: dict) -> asyncio.Future:
+        if self._closed:
+            raise RuntimeError("The database writer is closed")
+        key: tuple = (model.__tablename__, *(values[k] for k in NATURAL_KEYS[model]))
+        if "guild_id" in values:
+            self._changed.add(values["guild_id"])
+        op: DBOp = DBOp(kind, model, values, self._new_future())
+        segment: _Segment = self._segments[-1]
+        ops: list[DBOp] = segment.ops.setdefault(key, [])
+        last: Optional[DBOp] = ops[-1] if ops else None
+        if last is None:
+            ops.append(op)
+        elif kind == OP_DELETE and last.kind == OP_INSERT:
+            # The row has never been written, drop both of them
+            segment.dropped.append(ops.pop())
+            segment.dropped.append(op)
+            if not ops:
+                del segment.ops[key]
+        elif kind == last.kind and kind != OP_UPSERT:
+            segment.dropped.append(op)
+        elif kind == OP_UPSERT and last.kind == OP_UPSERT:
+            segment.dropped.append(ops.pop())
+            ops.append(op)
+        else:
+            ops.append(op)
+        self._added()
+        return op.future
+
+    def _added(self) -> None:
+        self._pending += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    ################ Commit ################
+
+    async def _run(self) -> None:
+        while not (self._closed and self._pending == 0):
+            await self._wakeup.wait()
+            if self._pending < self.batch_size and not self._closed:
+                await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            if self._pending > 0:
+                await self._commit()
+
+    async def _commit(self) -> None:
+        segments: list[_Segment] = self._segments
+        self._segments = [_Segment()]
+        operations: int = self._pending
+        self._pending = 0
+        changed: set[int] = self._changed
+        self._changed = set()
+        self._committing = True
+        # Every attempt is a new transaction, the failed ones are rolled back.
+        # The later operations wait in the queue, so the order of the rows is kept.
+        attempt: int = 0
+        while True:
+            try:
+                await self._write(segments, changed)
+                break
+            except Exception as e:
+                if attempt < self.retries:
+                    await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                    attempt += 1
+                    continue
+                self._committing = False
+                DB_OPERATIONS_FAILED.inc(amount=operations)
+                for segment in segments:
+                    for op in self._segment_ops(segment):
+                        if not op.future.done():
+                            op.future.set_exception(e)
+                return
+        self._committing = False
+        DB_OPERATIONS.inc(amount=operations)
+        for segment in segments:
+            for op in self._segment_ops(segment):
+                if not op.future.done():
+                    op.future.set_result(None)
+
+    @staticmethod
+    def _segment_ops(segment: _Segment) -> list[DBOp]:
+        ops: list[DBOp] = [op for ops in segment.ops.values() for op in ops]
+        ops.extend(segment.dropped)
+        if segment.statement is not None:
+            ops.append(segment.statement)
+        return ops
+
+    async def _write(self, segments: list[_Segment], changed: set[int]) -> None:
+        '''Apply the segments and record the changed guilds in one transaction'''
+        with DB_COMMIT_SECONDS.time():
+            async with self.Session() as session:
+                for segment in segments:
+                    await self._apply_segment(session, segment)
+                if self.change_origin is not None and changed:
+                    now: float = time.time()
+                    await session.execute(sqlalchemy.insert(ChangeDB), [
+                        {"guild_id": guild_id, "origin": self.change_origin, "changed_at": now} for guild_id in changed
+                    ])
+                await session.commit()
+
+    async def _apply_segment(self, session, segment: _Segment) -> None:
+        # Rows of the same key keep their order: deletes, then inserts, then upserts
+        deletes: list[DBOp] = []
+        inserts: dict[type[DBBase], list[dict]] = {}
+        upserts: list[DBOp] = []
+        for ops in segment.ops.values():
+            for op in ops:
+                if op.kind == OP_DELETE:
+                    deletes.append(op)
+                elif op.kind == OP_INSERT:
+                    inserts.setdefault(op.model, []).append(op.values)
+                elif op.kind == OP_UPSERT:
+                    upserts.append(op)
+        for op in deletes:
+            await session.execute(
+                sqldelete(op.model).
+                where(sqlalchemy.and_(*(getattr(op.model, k) == v for k, v in op.values.items())))
+            )
+        for model, rows in inserts.items():
+            for i in range(0, len(rows), self.batch_size):
+                await session.execute(
+                    sqlite.insert(model).values(rows[i:i + self.batch_size]).on_conflict_do_nothing()
+                )
+        for op in upserts:
+            index_elements: tuple[str, ...] = NATURAL_KEYS[op.model]
+            stmt = sqlite.insert(op.model).values([op.values])
+            stmt = stmt.on_conflict_do_update(
+                index_elements = index_elements,
+                set_ = {k: getattr(stmt.excluded, k) for k in op.values if k not in index_elements}
+            )
+            await session.execute(stmt)
+        if segment.statement is not None:
+            await session.execute(segment.statement.values)
+
+    async def close(self) -> None:
+        '''Flush everything pending and stop the writer'''
+        self._closed = True
+        if self._task is not None and not self._task.done():
+            self._wakeup.set()
+            await self._task
+        elif self._pending > 0:
+            await self._commit()
+        self._task = None